@@ -0,0 +1,169 @@
+# app/aggregator.py
+import heapq
+
+import numpy as np
+
+from app.tweet_batch import LABELS, round_score
+
+# レポートに例を載せるラベルと、デフォルトの件数 (generate_report のデフォルトと同じ)
+DEFAULT_EXAMPLES_PER_LABEL = {"ポジティブ": 5, "ネガティブ": 5, "ニュートラル": 3}
+
+# 集計から除外するラベル
+EXCLUDED_LABELS = {"ERROR"}
+
+# 例として保持するツイートのフィールド (tokens など大きいフィールドは保持しない)
+EXAMPLE_FIELDS = ("id", "created_at", "cleaned_text", "source_url", "sentiment")
+
+
+class SentimentAggregator:
+    """
+    感情分析済みのツイートを1件ずつ受け取って集計する (ツイートのリスト全体は保持しない)。
+    - ラベルごとの件数・スコア合計・スコアのヒストグラム
+    - ラベルごとのスコア上位 k 件の例 (サイズ k のヒープ)
+    バッチ・ワーカー・実行ごとの部分集計は merge でまとめられる。
+    スコアが同じ例は、先に追加されたもの (merge では self 側) を優先する。
+    """
+
+    def __init__(self, examples_per_label=None, histogram_bins=10):
+        self.examples_per_label = dict(DEFAULT_EXAMPLES_PER_LABEL if examples_per_label is None else examples_per_label)
+        self.histogram_bins = histogram_bins
+        self.counts = {}
+        self.score_sums = {}
+        self.histograms = {}
+        self.seen = 0 # 除外したものも含めて受け取ったツイート数
+        self._heaps = {label: [] for label in self.examples_per_label}
+        self._sequence = 0
+
+    def _bin(self, score):
+        return min(max(int(score * self.histogram_bins), 0), self.histogram_bins - 1)
+
+    def _push_example(self, label, score, sequence, example):
+        limit = self.examples_per_label.get(label, 0)
+        if not limit:
+            return
+        heap = self._heaps.setdefault(label, [])
+        # 最小ヒープの先頭が「スコアが最も低く、同点なら最も後に追加された」例になるようにする
+        item = (score, -sequence, example)
+        if len(heap) < limit:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+
+    def add(self, tweet):
+        self.seen += 1
+        sentiment = tweet.get('sentiment')
+        if not sentiment or sentiment.get('label') in EXCLUDED_LABELS:
+            return
+        label = sentiment['label']
+        score = float(sentiment.get('score', 0) or 0)
+        self.counts[label] = self.counts.get(label, 0) + 1
+        self.score_sums[label] = self.score_sums.get(label, 0.0) + score
+        histogram = self.histograms.get(label)
+        if histogram is None:
+            histogram = self.histograms[label] = [0] * self.histogram_bins
+        histogram[self._bin(score)] += 1
+
+        self._sequence += 1
+        limit = self.examples_per_label.get(label, 0)
+        heap = self._heaps.get(label)
+        # ヒープが満杯で、先頭より低いスコアの場合は例のコピーを作らずに済ませる
+        if limit and (len(heap) < limit or (score, -self._sequence) > heap[0][:2]):
+            example = {key: tweet[key] for key in EXAMPLE_FIELDS if key in tweet}
+            self._push_example(label, score, self._sequence, example)
+
+    def add_batch(self, batch):
+        """
+        TweetBatch を列単位でまとめて集計する (各行を順に add した場合と同じ結果になる)。
+        件数・スコア合計・ヒストグラムは numpy で求め、例はラベルごとの上位 k 件の候補だけ辞書にする。
+        """
+        self.seen += len(batch)
+        valid = np.flatnonzero(batch.valid_mask())
+        if not len(valid):
+            return self
+        codes = batch.label_codes[valid]
+        scores = round_score(batch.scores[valid])
+        sequences = self._sequence + np.arange(1, len(valid) + 1)
+        self._sequence += len(valid)
+        for code in np.unique(codes):
+            label = LABELS[code]
+            positions = np.flatnonzero(codes == code)
+            label_scores = scores[positions]
+            self.counts[label] = self.counts.get(label, 0) + len(positions)
+            self.score_sums[label] = self.score_sums.get(label, 0.0) + float(label_scores.sum())
+            histogram = self.histograms.setdefault(label, [0] * self.histogram_bins)
+            bins = np.clip((label_scores * self.histogram_bins).astype(int), 0, self.histogram_bins - 1)
+            for i, count in enumerate(np.bincount(bins, minlength=self.histogram_bins)):
+                histogram[i] += int(count)
+
+            limit = self.examples_per_label.get(label, 0)
+            if limit:
+                # スコアの高い順 (同点は先に追加された順) に上位 limit 件だけをヒープの候補にする
+                top = positions[np.lexsort((sequences[positions], -label_scores))[:limit]]
+                for p in top:
+                    example = batch.to_dict(valid[p], fields=EXAMPLE_FIELDS)
+                    self._push_example(label, float(scores[p]), int(sequences[p]), example)
+        return self
+
+    def add_many(self, tweets):
+        for tweet in tweets:
+            self.add(tweet)
+        return self
+
+    def merge(self, other):
+        """別の集計 (同じ histogram_bins) を取り込む。self を返す"""
+        if other.histogram_bins != self.histogram_bins:
+            raise ValueError("Cannot merge aggregators with different histogram_bins")
+        self.seen += other.seen
+        for label, count in other.counts.items():
+            self.counts[label] = self.counts.get(label, 0) + count
+            self.score_sums[label] = self.score_sums.get(label, 0.0) + other.score_sums.get(label, 0.0)
+        for label, histogram in other.histograms.items():
+            mine = self.histograms.setdefault(label, [0] * self.histogram_bins)
+            for i, value in enumerate(histogram):
+                mine[i] += value
+        # other の例は self の例より後に追加されたものとして扱う
+        for label, heap in other._heaps.items():
+            for score, negative_sequence, example in heap:
+                self._push_example(label, score, self._sequence - negative_sequence, example)
+        self._sequence += other._sequence
+        return self
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def examples(self):
+        """{ラベル: [tweet, ...]} をスコアの高い順で返す"""
+        return {
+            label: [example for _, _, example in sorted(heap, key=lambda item: (-item[0], -item[1]))]
+            for label, heap in self._heaps.items()
+        }
+
+    def mean_scores(self):
+        return {label: self.score_sums[label] / count for label, count in self.counts.items() if count}
+
+    def to_dict(self):
+        """JSON に保存できる形式に変換する (from_dict で復元できる)"""
+        return {
+            "examples_per_label": self.examples_per_label,
+            "histogram_bins": self.histogram_bins,
+            "counts": self.counts,
+            "score_sums": self.score_sums,
+            "histograms": self.histograms,
+            "seen": self.seen,
+            "examples": self.examples(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls(examples_per_label=data["examples_per_label"], histogram_bins=data["histogram_bins"])
+        aggregator.counts = dict(data["counts"])
+        aggregator.score_sums = dict(data["score_sums"])
+        aggregator.histograms = {label: list(values) for label, values in data["histograms"].items()}
+        aggregator.seen = data["seen"]
+        for label, examples in data["examples"].items():
+            for example in examples:
+                aggregator._sequence += 1
+                aggregator._push_example(label, float(example['sentiment'].get('score', 0) or 0),
+                                         aggregator._sequence, example)
+        return aggregator
@@ -1,81 +1,306 @@
 # app/analyzer.py
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
-import torch
 import logging # ロギングを追加
+import os
+import time
+
+from app.metrics import INFERENCE_BATCH_SIZE, INFERENCE_PADDING_RATIO, record_span
+
+# torch / transformers は読み込みに時間がかかるため、モデルをロードする時点で import する
+# (app.main の import だけでは読み込まれないようにして、起動を速くする)
 
 logger = logging.getLogger(__name__)
 
 # 使用するHugging Faceモデル名
 MODEL_NAME = "Mizuiro-inc/bert-japanese-sentiment-analysis-large"
 
+# バッチ推論のデフォルト設定
+# batch_size: 1回のフォワードパスで処理する最大件数
+# max_tokens_per_batch: (バッチ件数 x バッチ内最大トークン長) の上限。パディング込みの計算量を抑える
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_MAX_TOKENS_PER_BATCH = 4096
+
+# モデルの出力ラベルを日本語にマッピング (モデルの出力ラベルに合わせて調整)
+LABEL_MAP = {
+    "POSITIVE": "ポジティブ",
+    "NEGATIVE": "ネガティブ",
+    "NEUTRAL": "ニュートラル",
+}
+
+# 推論バックエンド
+# - fp32: 通常のモデル
+# - int8: Linear 層を torch の動的量子化 (int8) したモデル (CPU 専用)
+# - int8-torchscript: int8 モデルを TorchScript にトレースしたグラフ (CPU 専用)
+BACKENDS = ("fp32", "int8", "int8-torchscript")
+
+# ウォームアップ用のテキスト (長さの異なるテキストで、バッチのパディングも含めて一度推論しておく)
+WARMUP_TEXTS = (
+    "この映画、本当に感動した！素晴らしいストーリーだった。",
+    "最悪。",
+    "新しいモデルが発表されたらしい。詳しい性能はまだ分からないが、試してみてから判断したい。" * 4,
+)
+
+
 class SentimentAnalyzer:
-    def __init__(self, model_name=MODEL_NAME):
+    def __init__(self, model_name=MODEL_NAME, backend="fp32", model_cache_dir=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown sentiment backend '{backend}'. Choose from {BACKENDS}")
         self.model_name = model_name
+        self.backend = backend
+        # 量子化・トレース済みモデルの保存先 (None の場合は毎回作り直す)
+        self.model_cache_dir = model_cache_dir
         self.sentiment_pipeline = None # 初期化はメソッドで行う
+        self.model = None
+        self.id2label = {}
+        self._traced_input_names = None
+        self.load_error = None # ロードに失敗した場合のエラーメッセージ
 
         try:
+            import torch
+            from transformers import pipeline, AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
+
             logger.info(f"Loading tokenizer for {self.model_name}...")
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
             
-            logger.info(f"Loading model for {self.model_name}...")
-            self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
-            
-            # GPUが利用可能ならGPUを使う設定
-            self.device = 0 if torch.cuda.is_available() else -1 
-            # pipelineを初期化
-            self.sentiment_pipeline = pipeline(
-                "sentiment-analysis",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                device=self.device,
-                # モデルによっては return_all_scores=True を設定すると全ラベルのスコアが返る
-                # koheiduckモデルはデフォルトで最もスコアの高いラベルのみ
-            )
+            logger.info(f"Loading model for {self.model_name} (backend: {self.backend})...")
+            if self.backend == "fp32":
+                self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+                # GPUが利用可能ならGPUを使う設定
+                self.device = 0 if torch.cuda.is_available() else -1 
+            else:
+                # 量子化モデルは CPU でのみ動作する
+                self.model = self._load_quantized_model()
+                self.device = -1
+            self.id2label = AutoConfig.from_pretrained(self.model_name).id2label
+
+            if not isinstance(self.model, torch.jit.ScriptModule):
+                # pipelineを初期化 (TorchScript のグラフは pipeline に渡せないので analyze_batch のみ使用)
+                self.sentiment_pipeline = pipeline(
+                    "sentiment-analysis",
+                    model=self.model,
+                    tokenizer=self.tokenizer,
+                    device=self.device,
+                    # モデルによっては return_all_scores=True を設定すると全ラベルのスコアが返る
+                    # koheiduckモデルはデフォルトで最もスコアの高いラベルのみ
+                )
             if self.device == 0:
                 logger.info(f"Sentiment model '{self.model_name}' loaded successfully on GPU.")
             else:
-                logger.info(f"Sentiment model '{self.model_name}' loaded successfully on CPU.")
+                logger.info(f"Sentiment model '{self.model_name}' loaded successfully on CPU ({self.backend}).")
 
         except Exception as e:
             logger.error(f"Error loading sentiment model '{self.model_name}': {e}", exc_info=True)
-            # sentiment_pipeline は None のままになる
+            # model / sentiment_pipeline は None のままになる
+            self.load_error = str(e)
+            self.model = None
+            self.sentiment_pipeline = None
+
+    @property
+    def is_loaded(self):
+        return self.model is not None
+
+    def warm_up(self, texts=WARMUP_TEXTS, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        短いテキストと長いテキストでバッチ推論を空回しする。
+        最初の数回の推論はメモリ確保や (TorchScript の場合) グラフの最適化で遅いため、
+        リクエストを受け付ける前に済ませておく。推論に失敗した場合は RuntimeError を送出する。
+        """
+        if not self.is_loaded:
+            raise RuntimeError(f"Sentiment model is not loaded: {self.load_error}")
+        for _ in range(2):
+            results = self.analyze_batch(list(texts), batch_size=batch_size)
+        errors = [result.get("error_message") for result in results if result.get("label") == "ERROR"]
+        if errors:
+            raise RuntimeError(f"Warm-up inference failed: {errors[0]}")
+
+    def _cache_path(self):
+        import torch
+        if not self.model_cache_dir:
+            return None
+        # torch のバージョンが変わると保存形式の互換性がなくなるため、ファイル名に含める
+        safe_name = self.model_name.replace("/", "__")
+        suffix = "ts" if self.backend == "int8-torchscript" else "pt"
+        return os.path.join(self.model_cache_dir, f"{safe_name}.{self.backend}.torch-{torch.__version__}.{suffix}")
+
+    def _example_inputs(self):
+        # トレース用の入力 (長さはトレース後も可変)
+        # analyze_batch と同じく input_ids をパディングした形 (input_ids, attention_mask) にそろえる
+        encoded = self.tokenizer(["トレース用のサンプル文です。", "サンプル"])["input_ids"]
+        return self.tokenizer.pad([{"input_ids": ids} for ids in encoded], return_tensors="pt")
+
+    def _load_quantized_model(self):
+        """int8 (必要なら TorchScript) モデルをディスクキャッシュから読み込む。なければ作成して保存する"""
+        import torch
+        from transformers import AutoConfig, AutoModelForSequenceClassification
+
+        cache_path = self._cache_path()
+        if cache_path and os.path.exists(cache_path):
+            logger.info(f"Loading cached {self.backend} model from {cache_path}")
+            if self.backend == "int8-torchscript":
+                model = torch.jit.load(cache_path)
+                self._traced_input_names = list(self._example_inputs().keys())
+                return model
+            # 重みを読み込まずに構造だけ作り、量子化した構造に保存済みの重みを読み込む
+            config = AutoConfig.from_pretrained(self.model_name)
+            model = AutoModelForSequenceClassification.from_config(config).eval()
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            model.load_state_dict(torch.load(cache_path))
+            return model
+
+        logger.info(f"Building {self.backend} model for {self.model_name} (this is done once and cached)")
+        torchscript = self.backend == "int8-torchscript"
+        model = AutoModelForSequenceClassification.from_pretrained(self.model_name, torchscript=torchscript).eval()
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        if torchscript:
+            example = self._example_inputs()
+            self._traced_input_names = list(example.keys())
+            with torch.inference_mode():
+                model = torch.jit.freeze(torch.jit.trace(model, tuple(example.values()), strict=False))
+
+        if cache_path:
+            os.makedirs(self.model_cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+            if torchscript:
+                torch.jit.save(model, tmp_path)
+            else:
+                torch.save(model.state_dict(), tmp_path)
+            # 複数プロセスが同時に作成しても壊れたファイルを読まないよう、書き終えてから置き換える
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Saved {self.backend} model to {cache_path}")
+        return model
 
+    def _forward(self, features):
+        """トークナイズ済みのバッチを推論し、logits を返す"""
+        if self._traced_input_names is not None:
+            outputs = self.model(*(features[name] for name in self._traced_input_names))
+            return outputs[0]
+        return self.model(**features).logits
+
+    def _max_length(self):
+        # モデルが処理できる最大トークン長を取得 (なければデフォルト512)
+        max_len = getattr(self.tokenizer, 'model_max_length', 512)
+        # model_max_length が未設定のトークナイザーは巨大な値を返すので512に丸める
+        return max_len if max_len and max_len <= 4096 else 512
+
+    def map_pipeline_result(self, result):
+        """pipeline (または analyze_batch) の生の出力1件を {'label', 'score'} 形式に整形する"""
+        if not result or not isinstance(result, dict) or "label" not in result:
+            logger.warning(f"Unexpected output format from sentiment pipeline: {result}")
+            return {"label": "UNKNOWN", "score": 0.0, "raw_output": result}
+
+        # 大文字に変換して検索
+        final_label = LABEL_MAP.get(str(result["label"]).upper(), result["label"])
+        return {
+            "label": final_label,
+            "score": round(float(result["score"]), 4) # スコアを小数点以下4桁に丸める
+        }
+
+    def _build_batches(self, lengths, batch_size, max_tokens_per_batch):
+        """トークン長でソートしたインデックスを、パディングが少なくなるようにバッチへ分割する"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches = []
+        current = []
+        current_max = 0
+        for i in order:
+            longest = max(current_max, lengths[i])
+            # 件数上限 or (件数 x 最大長) のトークン上限を超える場合は新しいバッチを開始
+            if current and (len(current) >= batch_size or longest * (len(current) + 1) > max_tokens_per_batch):
+                batches.append(current)
+                current = []
+                longest = lengths[i]
+            current.append(i)
+            current_max = longest
+        if current:
+            batches.append(current)
+        return batches
+
+    def analyze_batch(self, texts, batch_size=DEFAULT_BATCH_SIZE, max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH):
+        """
+        複数テキストをまとめて感情分析し、入力と同じ順序で結果のリストを返す。
+        トークン長の近いテキスト同士をバッチにまとめることでパディングの無駄を減らす。
+        """
+        if not self.is_loaded:
+            logger.error("Sentiment model is not initialized. Cannot analyze.")
+            return [{"label": "ERROR", "score": 0.0, "error_message": "Model not loaded"} for _ in texts]
+        import torch
+
+        results = [None] * len(texts)
+        valid_indices = []
+        for i, text in enumerate(texts):
+            if not text or not isinstance(text, str) or len(text.strip()) == 0:
+                results[i] = {"label": LABEL_MAP["NEUTRAL"], "score": 0.0, "note": "Empty or invalid input text"}
+            else:
+                valid_indices.append(i)
+        if not valid_indices:
+            return results
+
+        max_len = self._max_length()
+        # 先にトークナイズだけ行い、長さを求める (パディングはバッチ単位で行う)
+        encodings = self.tokenizer(
+            [texts[i] for i in valid_indices], truncation=True, max_length=max_len
+        )["input_ids"]
+        lengths = [len(ids) for ids in encodings]
+        id2label = self.id2label
+        model_device = next(self.model.parameters()).device if self.device == 0 else torch.device("cpu")
+
+        for batch in self._build_batches(lengths, batch_size, max_tokens_per_batch):
+            batch_start = time.perf_counter()
+            longest = max(lengths[j] for j in batch)
+            INFERENCE_BATCH_SIZE.observe(len(batch))
+            INFERENCE_PADDING_RATIO.observe(1 - sum(lengths[j] for j in batch) / (longest * len(batch)))
+            try:
+                features = self.tokenizer.pad(
+                    [{"input_ids": encodings[j]} for j in batch], return_tensors="pt"
+                )
+                features = {k: v.to(model_device) for k, v in features.items()}
+                with torch.inference_mode():
+                    logits = self._forward(features)
+                probs = torch.softmax(logits.float(), dim=-1)
+                scores, label_ids = probs.max(dim=-1)
+                for j, score, label_id in zip(batch, scores.tolist(), label_ids.tolist()):
+                    results[valid_indices[j]] = self.map_pipeline_result(
+                        {"label": id2label[label_id], "score": score}
+                    )
+            except Exception as e:
+                logger.error(f"Error during batch sentiment analysis ({len(batch)} texts): {e}", exc_info=True)
+                for j in batch:
+                    results[valid_indices[j]] = {"label": "ERROR", "score": 0.0, "error_message": str(e)}
+            record_span('infer_batch', time.perf_counter() - batch_start, len(batch))
+        return results
+
+    def analyze_tweet_batch(self, batch, chunk_size=None, batch_size=DEFAULT_BATCH_SIZE,
+                            max_tokens_per_batch=DEFAULT_MAX_TOKENS_PER_BATCH):
+        """
+        TweetBatch のテキストを感情分析し、結果を label_codes / scores の列に書き込んで batch を返す。
+        chunk_size を指定した場合は、batch のビュー (コピーしない) を chunk_size 件ずつ推論する。
+        """
+        for chunk in (batch.iter_slices(chunk_size) if chunk_size else (batch,)):
+            results = self.analyze_batch(chunk.analysis_texts().tolist(), batch_size=batch_size,
+                                         max_tokens_per_batch=max_tokens_per_batch)
+            chunk.set_sentiments(results)
+        return batch
 
     def analyze_sentiment(self, text: str):
-        if not self.sentiment_pipeline:
+        if not self.is_loaded:
             logger.error("Sentiment pipeline is not initialized. Cannot analyze.")
             return {"label": "ERROR", "score": 0.0, "error_message": "Model not loaded"}
 
         if not text or not isinstance(text, str) or len(text.strip()) == 0:
             logger.warning("Input text for sentiment analysis is empty or invalid.")
-            return {"label": "NEUTRAL", "score": 0.0, "note": "Empty or invalid input text"}
+            # analyze_batch と同じく日本語のラベルで返す
+            return {"label": LABEL_MAP["NEUTRAL"], "score": 0.0, "note": "Empty or invalid input text"}
+
+        if self.sentiment_pipeline is None:
+            # TorchScript バックエンドは pipeline を使えないため analyze_batch で推論する
+            return self.analyze_batch([text])[0]
 
         try:
-            # モデルが処理できる最大トークン長を取得 (なければデフォルト512)
-            # koheiduck/bert-japanese-finetuned-sentiment は BERT ベースなので 512 が一般的
-            max_len = self.tokenizer.model_max_length if hasattr(self.tokenizer, 'model_max_length') else 512
-            
             # truncation=True を指定すると、長すぎるテキストは自動的に切り詰めてくれる
-            results = self.sentiment_pipeline(text, truncation=True, max_length=max_len)
+            results = self.sentiment_pipeline(text, truncation=True, max_length=self._max_length())
             
             # pipelineの出力は通常リスト (要素数1のことが多い)
             # 例: [{'label': 'POSITIVE', 'score': 0.99...}]
             if results and isinstance(results, list) and len(results) > 0:
-                result = results[0]
-                # ラベル名を日本語にマッピング (モデルの出力ラベルに合わせて調整)
-                # koheiduck/bert-japanese-finetuned-sentiment の出力は 'POSITIVE' or 'NEGATIVE'
-                label_map = {
-                    "POSITIVE": "ポジティブ",
-                    "NEGATIVE": "ネガティブ",
-                    "NEUTRAL": "ニュートラル",
-                }
-                
-                final_label = label_map.get(result["label"].upper(), result["label"]) # 大文字に変換して検索
-                
-                return {
-                    "label": final_label,
-                    "score": round(result["score"], 4) # スコアを小数点以下4桁に丸める
-                }
+                return self.map_pipeline_result(results[0])
             else:
                 logger.warning(f"Unexpected output format from sentiment pipeline for text: {text[:50]}... Output: {results}")
                 return {"label": "UNKNOWN", "score": 0.0, "raw_output": results}
@@ -84,6 +309,29 @@ class SentimentAnalyzer:
             logger.error(f"Error during sentiment analysis for text '{text[:50]}...': {e}", exc_info=True)
             return {"label": "ERROR", "score": 0.0, "error_message": str(e)}
 
+class AnalyzerWrapper:
+    """
+    SentimentAnalyzer (または同じインターフェースのラッパー) を包むクラスの基底クラス
+    (推論ワーカー・キャッシュ・カスケード・モデルサーバーのクライアント)。
+    モデルの情報 (model_name / backend / sentiment_pipeline) は包んでいる analyzer のものを返す。
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+
+    @property
+    def model_name(self):
+        return self.analyzer.model_name
+
+    @property
+    def backend(self):
+        return self.analyzer.backend
+
+    @property
+    def sentiment_pipeline(self):
+        return self.analyzer.sentiment_pipeline
+
+
 # テスト用 (main.pyから呼ばれるので、ここでの直接実行は必須ではない)
 if __name__ == '__main__':
     # ロガーの基本設定 (テスト実行時のみ)
@@ -91,7 +339,7 @@ if __name__ == '__main__':
 
     analyzer = SentimentAnalyzer()
 
-    if analyzer.sentiment_pipeline:
+    if analyzer.is_loaded:
         test_texts = [
             "この映画、本当に感動した！素晴らしいストーリーだった。", # ポジティブ
             "今日のランチは最悪だった。味がひどいし、サービスも悪い。", # ネガティブ
@@ -107,5 +355,10 @@ if __name__ == '__main__':
             sentiment = analyzer.analyze_sentiment(text_input)
             print(f"Text: {text_input[:70]}...")
             print(f"Sentiment: {sentiment}\n")
+
+        # バッチ推論 (1件ずつの結果と一致することを確認)
+        batch_results = analyzer.analyze_batch(test_texts, batch_size=4)
+        for text_input, sentiment in zip(test_texts, batch_results):
+            print(f"[batch] Text: {text_input[:30]}... Sentiment: {sentiment}")
     else:
         print("Sentiment analyzer could not be initialized.")
\ No newline at end of file
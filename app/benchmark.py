@@ -0,0 +1,527 @@
+# app/benchmark.py
+"""
+処理段階ごとのベンチマーク (ネットワークにも実際の感情分析モデルにもアクセスせずに実行できる)。
+
+- 収集: API のレスポンスを合成コーパスから返すスタブの DataCollector
+- 前処理: Preprocessor.clean_text / tokenize / tokenize_batch
+- 推論: ランダムな重みの小さな BERT (--model で実際のモデルも指定できる) をバッチサイズごとに
+- レポート: ReportGenerator.generate_report (グラフは描画データのみ)
+- グラフ: 円グラフ・推移のグラフの描画 (png / svg)
+- 全体: app.main.process_analysis (収集から結果の保存まで) をバッチサイズごとに
+
+使い方:
+    python -m app.benchmark --size 2000 --out data/benchmark.json
+    python -m app.benchmark --save-baseline data/benchmark_baseline.json
+    python -m app.benchmark --baseline data/benchmark_baseline.json --max-regression 0.2
+
+段階ごとのスループット (件/秒) とレイテンシのパーセンタイル (ミリ秒) を JSON で出力する。
+--baseline を指定した場合は基準と比較し、スループットの低下または p90 の増加がしきい値を超えた段階があれば
+終了コード 1 で終了する。しきい値は基準ファイルの "thresholds" ({段階名: 割合}) で段階ごとに上書きできる。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 計測する段階 (--stages で絞り込める)
+STAGES = ("collect", "clean", "tokenize", "inference", "report", "chart", "pipeline")
+DEFAULT_BATCH_SIZES = (1, 8, 16, 32)
+# 基準からの悪化をどこまで許容するか (0.2 = スループット 20% 低下 / p90 20% 増加まで)
+DEFAULT_MAX_REGRESSION = 0.2
+# ベンチマーク用のキーワード (スタブの収集はキーワードによらず同じコーパスを返す)
+BENCHMARK_KEYWORD = "AIエージェント"
+
+# ランダムな重みの小さな BERT の設定 (ラベルは実際のモデルと同じ3クラス)
+TINY_MODEL_CONFIG = {
+    "hidden_size": 64,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 2,
+    "intermediate_size": 128,
+    "max_position_embeddings": 512,
+    # 出力が3クラスに散らばるよう、初期値のばらつきを大きめにする
+    "initializer_range": 0.5,
+}
+TINY_MODEL_LABELS = ("NEGATIVE", "NEUTRAL", "POSITIVE")
+
+# 合成コーパスの材料
+CORPUS_SUBJECTS = (
+    "AIエージェント", "生成AI", "新しいスマホ", "今日のランチ", "この映画", "在宅勤務", "雇用の未来",
+    "新作ゲーム", "駅前のカフェ", "週末の天気", "会社の新制度", "プログラミング学習", "ＡＩ導入",
+)
+CORPUS_PREDICATES = {
+    "positive": ("本当に素晴らしい！", "めちゃくちゃ便利で助かる。", "期待以上だった。感動した", "最高すぎる",
+                 "おかげで仕事がかなり楽になった。"),
+    "negative": ("最悪だった。", "正直がっかりした…", "不安で仕方ない。", "全然使えないし高い。",
+                 "仕事を奪われるのではと心配だ。"),
+    "neutral": ("について調べてみた。", "の発表があったらしい。", "はまだよく分からない。",
+                "について会議で話題になった。", "、明日試してみる予定。"),
+}
+CORPUS_FILLERS = ("", "みんなはどう思う？", "詳しくはリンク先で。", "とりあえずメモ。", "続報を待ちたい。")
+CORPUS_HASHTAGS = ("#AI", "#生成AI", "#働き方", "#ランチ", "#映画好きと繋がりたい", "#今日の一枚")
+CORPUS_EMOJI = ("😊", "🔥", "😢", "👍🏻", "🇯🇵", "👨‍💻", "✨", "🤔", "💡")
+
+
+def generate_corpus(size, seed=42, duplicate_rate=0.1, hours=48):
+    """
+    API のレスポンス (data の要素) と同じ形式の合成ツイートを size 件生成する (seed が同じなら同じ内容)。
+    URL・ハッシュタグ・メンション・絵文字・全角英数字を含み、duplicate_rate の割合でコピペ (bot) の投稿を混ぜる。
+    created_at は hours 時間の範囲に分布し、新しい順 (API と同じ順) に並ぶ。
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    texts = []
+    for _ in range(size):
+        if texts and rng.random() < duplicate_rate:
+            # 既存の投稿に URL やタグだけ付け替えたもの
+            texts.append(rng.choice(texts).split(" http")[0] + f" https://t.co/{rng.getrandbits(40):x}")
+            continue
+        parts = []
+        for _ in range(rng.randint(1, 4)):
+            polarity = rng.choice(tuple(CORPUS_PREDICATES))
+            parts.append(rng.choice(CORPUS_SUBJECTS) + rng.choice(CORPUS_PREDICATES[polarity]))
+            parts.append(rng.choice(CORPUS_FILLERS))
+        if rng.random() < 0.3:
+            parts.insert(0, f"@user_{rng.randint(1, 999)}")
+        if rng.random() < 0.5:
+            parts.append("".join(rng.choices(CORPUS_EMOJI, k=rng.randint(1, 3))))
+        if rng.random() < 0.5:
+            parts.append(" ".join(rng.sample(CORPUS_HASHTAGS, rng.randint(1, 3))))
+        if rng.random() < 0.4:
+            parts.append(f"https://t.co/{rng.getrandbits(40):x}")
+        texts.append(" ".join(part for part in parts if part))
+
+    offsets = sorted((rng.uniform(0, hours * 3600) for _ in range(size)), reverse=True)
+    return [
+        {
+            "id": str(10 ** 18 + size - i),
+            "text": text,
+            "created_at": (start + timedelta(seconds=offset)).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "author_id": str(rng.randint(10 ** 6, 10 ** 7)),
+        }
+        for i, (text, offset) in enumerate(zip(texts, offsets))
+    ]
+
+
+def stub_data_collector(corpus, latency_ms=0):
+    """
+    合成コーパスをページ単位で返す DataCollector を作る (リクエストの送信だけを置き換える)。
+    ページング・ツイートの変換は実際の DataCollector の処理を通る。latency_ms で API の応答時間を模擬できる。
+    """
+    from app.data_collector import DataCollector
+
+    class StubDataCollector(DataCollector):
+        def _request_page(self, params):
+            if latency_ms:
+                time.sleep(latency_ms / 1000)
+            tweets = corpus
+            if params.get('since_id'):
+                tweets = [tweet for tweet in corpus if int(tweet['id']) > int(params['since_id'])]
+            offset = int(params.get('next_token') or 0)
+            page = tweets[offset:offset + params['max_results']]
+            meta = {"result_count": len(page)}
+            if offset + len(page) < len(tweets):
+                meta["next_token"] = str(offset + len(page))
+            return {"data": page, "meta": meta}
+
+    return StubDataCollector(bearer_token="benchmark", max_retries=0)
+
+
+def build_tiny_model(out_dir, texts, seed=0):
+    """
+    texts に現れる文字を語彙にした文字単位のトークナイザーと、ランダムな重みの小さな BERT を out_dir に保存する。
+    推論の計算量は実際のモデルより小さいが、トークナイズ・バッチ分割・パディングの処理は同じ経路を通る。
+    """
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    chars = sorted({char for text in texts for char in text if not char.isspace()})
+    # 単語の途中の文字 (## 付き) も1文字ずつ語彙に含め、未知語 ([UNK]) にまとめられないようにする
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars + [f"##{char}" for char in chars]
+    os.makedirs(out_dir, exist_ok=True)
+    vocab_path = os.path.join(out_dir, "vocab.txt")
+    with open(vocab_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(vocab))
+    tokenizer = BertTokenizerFast(vocab_path, do_lower_case=False, strip_accents=False,
+                                  model_max_length=TINY_MODEL_CONFIG["max_position_embeddings"])
+    tokenizer.save_pretrained(out_dir)
+
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=len(vocab),
+        num_labels=len(TINY_MODEL_LABELS),
+        id2label=dict(enumerate(TINY_MODEL_LABELS)),
+        label2id={label: i for i, label in enumerate(TINY_MODEL_LABELS)},
+        **TINY_MODEL_CONFIG,
+    )
+    BertForSequenceClassification(config).save_pretrained(out_dir)
+    return out_dir
+
+
+def summarize(latencies, items, seconds):
+    """呼び出しごとのレイテンシ (秒) から、スループットとレイテンシのパーセンタイル (ミリ秒) を求める"""
+    latencies_ms = np.asarray(latencies, dtype=float) * 1000
+    return {
+        "calls": len(latencies),
+        "items": items,
+        "seconds": round(seconds, 4),
+        "throughput_per_second": round(items / seconds, 2) if seconds > 0 else None,
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 4),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 4),
+            "p90": round(float(np.percentile(latencies_ms, 90)), 4),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 4),
+            "max": round(float(latencies_ms.max()), 4),
+        },
+    }
+
+
+def timed_calls(calls, repeat=1, warmup=True):
+    """
+    calls は (処理する件数, 引数なしの関数) のリスト。全体を repeat 回実行して summarize の結果を返す。
+    warmup=True の場合は、最初の1回 (辞書やモデルの遅延ロードを含む) を計測から除く。
+    """
+    if warmup and calls:
+        calls[0][1]()
+    latencies = []
+    items = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for count, function in calls:
+            call_start = time.perf_counter()
+            function()
+            latencies.append(time.perf_counter() - call_start)
+            items += count
+    return summarize(latencies, items, time.perf_counter() - start)
+
+
+def chunked(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def benchmark_collect(corpus, repeat):
+    """1ページの取得 (スタブ) とツイートへの変換"""
+    collector = stub_data_collector(corpus)
+    latencies = []
+    items = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        pages = collector.iter_pages(BENCHMARK_KEYWORD, max_results=len(corpus))
+        while True:
+            call_start = time.perf_counter()
+            page = next(pages, None)
+            if page is None:
+                break
+            latencies.append(time.perf_counter() - call_start)
+            items += len(page)
+    return {"collect": summarize(latencies, items, time.perf_counter() - start)}
+
+
+def benchmark_clean(preprocessor, raw_texts, repeat):
+    return {
+        "clean_text": timed_calls([(1, lambda text=text: preprocessor.clean_text(text)) for text in raw_texts], repeat),
+    }
+
+
+def benchmark_tokenize(preprocessor, texts, repeat):
+    from app.preprocessor import PARALLEL_TOKENIZE_MIN_TEXTS
+    # tokenize_batch は PARALLEL_TOKENIZE_MIN_TEXTS 件未満のチャンクで呼ぶので、プロセスプールは使わない
+    return {
+        "tokenize": timed_calls([(1, lambda text=text: preprocessor.tokenize(text)) for text in texts], repeat),
+        "tokenize_batch": timed_calls([(len(chunk), lambda chunk=chunk: preprocessor.tokenize_batch(chunk))
+                                       for chunk in chunked(texts, PARALLEL_TOKENIZE_MIN_TEXTS - 1)], repeat),
+    }
+
+
+def benchmark_inference(analyzer, texts, batch_sizes, repeat):
+    """analyze_batch を1回の呼び出しで batch_size 件ずつ実行する"""
+    results = {}
+    for batch_size in batch_sizes:
+        calls = [(len(chunk), lambda chunk=chunk: analyzer.analyze_batch(chunk, batch_size=batch_size))
+                 for chunk in chunked(texts, batch_size)]
+        results[f"inference[batch_size={batch_size}]"] = timed_calls(calls, repeat)
+    return results
+
+
+def benchmark_report(analyzed_tweets, repeat):
+    from app.charts import ChartRenderer
+    from app.reporter import ReportGenerator
+    # グラフの描画は chart 段階で別に計測するので、ここでは描画データだけを作る (キャッシュもしない)
+    report_generator = ReportGenerator(chart_renderer=ChartRenderer("json", processes=0, cache_size=0))
+    return {"report": timed_calls(
+        [(len(analyzed_tweets), lambda: report_generator.generate_report(BENCHMARK_KEYWORD, analyzed_tweets))],
+        repeat,
+    )}
+
+
+def benchmark_chart(analyzed_tweets, repeat):
+    from collections import Counter
+    from app.charts import render_pie_chart, render_trend_chart
+    from app.trends import SentimentTrend
+    counts = Counter(tweet['sentiment']['label'] for tweet in analyzed_tweets)
+    trend = SentimentTrend().update(analyzed_tweets).result(max_buckets=24)
+    results = {}
+    for chart_format in ("png", "svg"):
+        results[f"chart[{chart_format}]"] = timed_calls([
+            (1, lambda: render_pie_chart(counts, BENCHMARK_KEYWORD, chart_format)),
+            (1, lambda: render_trend_chart(trend, BENCHMARK_KEYWORD, chart_format)),
+        ], repeat)
+    return results
+
+
+def configure_app(model_dir, backend, work_dir):
+    """
+    app.main を import する前に設定を上書きし、ベンチマークが外部の状態に左右されないようにする
+    (キャッシュ・カスケードは無効、タスクストアはメモリ、監視用 DB とグラフ描画は一時ディレクトリ/同じプロセス)
+    """
+    import config
+    overrides = {
+        "SENTIMENT_MODEL_NAME": model_dir,
+        "SENTIMENT_BACKEND": backend,
+        "SENTIMENT_MODEL_CACHE_DIR": os.path.join(work_dir, "models"),
+        "MODEL_SERVING_MODE": "local",
+        "SENTIMENT_CACHE_ENABLED": False,
+        "CASCADE_ENABLED": False,
+        "TASK_STORE_BACKEND": "memory",
+        "MONITOR_DB_PATH": os.path.join(work_dir, "monitor.sqlite3"),
+        "CHART_RENDER_PROCESSES": 0,
+    }
+    for name, value in overrides.items():
+        setattr(config, name, value)
+
+
+def benchmark_pipeline(corpus, batch_sizes, repeat):
+    """
+    収集からレポートの保存までの process_analysis 全体を、推論ワーカーのバッチサイズごとに計測する。
+    configure_app で設定を上書きしてから呼ぶ。
+    """
+    from app import main
+    from app.inference_worker import InferenceWorker
+    from app.model_loader import BackgroundModelLoader
+    from app.task_executor import new_task_id
+    from config import INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_NUM_THREADS
+
+    # import 時に始まるモデルのロードが終わってから差し替える (計測中に CPU を取り合わないように)
+    main.model_loader.wait()
+    default_worker = main.model_loader.get()
+    default_worker.stop()
+    analyzer = default_worker.analyzer
+    main.data_collector = stub_data_collector(corpus)
+    main.COLLECT_MAX_RESULTS = len(corpus)
+    # 計測の出力にタスクごとの開始/完了ログを混ぜない
+    logging.getLogger(main.__name__).setLevel(logging.WARNING)
+
+    def run():
+        task_id = new_task_id()
+        main.task_store.create(task_id, "pending")
+        main.process_analysis(task_id, BENCHMARK_KEYWORD)
+        task = main.task_store.get(task_id)
+        if task["status"] != "completed":
+            raise RuntimeError(f"Pipeline run failed: {task['result']}")
+
+    results = {}
+    for batch_size in batch_sizes:
+        worker = InferenceWorker(
+            analyzer,
+            max_batch_size=max(INFERENCE_MAX_BATCH_SIZE, batch_size),
+            max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            num_threads=INFERENCE_NUM_THREADS,
+            batch_size=batch_size,
+        )
+        worker.start()
+        main.model_loader = BackgroundModelLoader(lambda: worker)
+        main.model_loader.start()
+        main.model_loader.wait()
+        try:
+            results[f"pipeline[batch_size={batch_size}]"] = timed_calls([(len(corpus), run)], repeat)
+        finally:
+            worker.stop()
+    return results
+
+
+def compare_with_baseline(results, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """
+    段階ごとに基準と比べ、{段階名: {throughput_change, p90_change, threshold, regressed}} を返す。
+    変化は割合 (-0.1 = 10% 減)。基準にない段階は比較しない。
+    """
+    thresholds = baseline.get("thresholds", {})
+    comparison = {}
+    for name, current in results["stages"].items():
+        reference = baseline.get("stages", {}).get(name)
+        if not reference:
+            continue
+        threshold = thresholds.get(name, max_regression)
+        throughput_change = None
+        if current["throughput_per_second"] and reference["throughput_per_second"]:
+            throughput_change = current["throughput_per_second"] / reference["throughput_per_second"] - 1
+        p90_change = None
+        if reference["latency_ms"]["p90"] > 0:
+            p90_change = current["latency_ms"]["p90"] / reference["latency_ms"]["p90"] - 1
+        comparison[name] = {
+            "throughput_change": None if throughput_change is None else round(throughput_change, 4),
+            "p90_change": None if p90_change is None else round(p90_change, 4),
+            "threshold": threshold,
+            "regressed": bool((throughput_change is not None and throughput_change < -threshold)
+                              or (p90_change is not None and p90_change > threshold)),
+        }
+    return comparison
+
+
+def environment_info():
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        import torch
+        info["torch"] = torch.__version__
+        info["torch_threads"] = torch.get_num_threads()
+    except ImportError:
+        pass
+    return info
+
+
+def run_benchmark(size=2000, seed=42, batch_sizes=DEFAULT_BATCH_SIZES, repeat=3, stages=STAGES,
+                  model=None, backend="fp32", tokenize_limit=1000):
+    """ベンチマークを実行し、JSON に変換できる結果を返す"""
+    from app.preprocessor import Preprocessor
+
+    model_label = model or "tiny-random-bert"
+    corpus = generate_corpus(size, seed=seed)
+    raw_texts = [tweet["text"] for tweet in corpus]
+    preprocessor = Preprocessor()
+    cleaned_texts = [text for text in map(preprocessor.clean_text, raw_texts) if text]
+
+    stage_results = {}
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as work_dir:
+        if "collect" in stages:
+            stage_results.update(benchmark_collect(corpus, repeat))
+        if "clean" in stages:
+            stage_results.update(benchmark_clean(preprocessor, raw_texts, repeat))
+        if "tokenize" in stages:
+            # 形態素解析は遅いので件数を絞る
+            stage_results.update(benchmark_tokenize(preprocessor, cleaned_texts[:tokenize_limit], repeat))
+
+        needs_model = {"inference", "report", "chart", "pipeline"} & set(stages)
+        if needs_model:
+            from app.analyzer import SentimentAnalyzer, WARMUP_TEXTS
+            if model is None:
+                logger.info("Building a tiny random-weight BERT model...")
+                model = build_tiny_model(os.path.join(work_dir, "tiny-bert"), [*cleaned_texts, *WARMUP_TEXTS],
+                                         seed=seed)
+            analyzer = SentimentAnalyzer(model, backend=backend, model_cache_dir=os.path.join(work_dir, "models"))
+            if not analyzer.is_loaded:
+                raise RuntimeError(f"Failed to load sentiment model '{model}': {analyzer.load_error}")
+            analyzer.warm_up()
+
+            if "inference" in stages:
+                stage_results.update(benchmark_inference(analyzer, cleaned_texts, batch_sizes, repeat))
+            if {"report", "chart"} & set(stages):
+                # レポートとグラフの入力は、前処理と推論を済ませたツイート
+                from app.data_collector import DataCollector
+                analyzed_tweets = preprocessor.preprocess_batch([DataCollector._to_tweet(tweet) for tweet in corpus])
+                for tweet, tokens in zip(analyzed_tweets,
+                                         preprocessor.tokenize_batch([t['cleaned_text'] for t in analyzed_tweets])):
+                    tweet['tokens'] = tokens
+                for tweet, result in zip(analyzed_tweets,
+                                         analyzer.analyze_batch([t['cleaned_text'] for t in analyzed_tweets])):
+                    tweet['sentiment'] = result
+                if "report" in stages:
+                    stage_results.update(benchmark_report(analyzed_tweets, repeat))
+                if "chart" in stages:
+                    stage_results.update(benchmark_chart(analyzed_tweets, repeat))
+            if "pipeline" in stages:
+                configure_app(model, backend, work_dir)
+                stage_results.update(benchmark_pipeline(corpus, batch_sizes, repeat))
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "parameters": {
+            "size": size,
+            "seed": seed,
+            "batch_sizes": list(batch_sizes),
+            "repeat": repeat,
+            "model": model_label,
+            "backend": backend,
+            "tokenize_limit": tokenize_limit,
+        },
+        "environment": environment_info(),
+        "stages": stage_results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="処理段階ごとのベンチマーク (スタブの収集と小さな BERT を使用)")
+    parser.add_argument("--size", type=int, default=2000, help="合成コーパスのツイート数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-sizes", default=",".join(map(str, DEFAULT_BATCH_SIZES)),
+                        help="推論と全体の計測に使うバッチサイズ (カンマ区切り)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"計測する段階 (カンマ区切り: {', '.join(STAGES)})")
+    parser.add_argument("--model", default=None, help="小さな BERT の代わりに使うモデル (Hugging Face のモデル名またはディレクトリ)")
+    parser.add_argument("--backend", default="fp32")
+    parser.add_argument("--tokenize-limit", type=int, default=1000, help="形態素解析を計測する件数")
+    parser.add_argument("--out", default=None, help="結果の JSON の保存先 (省略時は標準出力のみ)")
+    parser.add_argument("--baseline", default=None, help="比較する基準の JSON")
+    parser.add_argument("--max-regression", type=float, default=DEFAULT_MAX_REGRESSION)
+    parser.add_argument("--save-baseline", default=None, help="結果を基準として保存する (既存の thresholds は引き継ぐ)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    results = run_benchmark(
+        size=args.size,
+        seed=args.seed,
+        batch_sizes=[int(size) for size in args.batch_sizes.split(",") if size.strip()],
+        repeat=args.repeat,
+        stages=stages,
+        model=args.model,
+        backend=args.backend,
+        tokenize_limit=args.tokenize_limit,
+    )
+
+    regressed = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("parameters", {}).get("size") != args.size or baseline.get("parameters", {}).get("seed") != args.seed:
+            logger.warning("Baseline was recorded with a different corpus (size/seed). Comparison may be misleading.")
+        results["comparison"] = compare_with_baseline(results, baseline, args.max_regression)
+        regressed = [name for name, change in results["comparison"].items() if change["regressed"]]
+        results["regressed"] = regressed
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(output)
+    if args.save_baseline:
+        thresholds = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline, encoding="utf-8") as f:
+                thresholds = json.load(f).get("thresholds", {})
+        baseline = {key: results[key] for key in ("created_at", "parameters", "environment", "stages")}
+        baseline["thresholds"] = thresholds
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+    if regressed:
+        logger.error(f"Performance regression in: {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+# app/bulk.py
+"""
+保存済みの大量のツイート (JSONL / Parquet) をまとめて感情分析するバッチ処理 (Flask を経由しない)。
+
+使い方:
+    python -m app.bulk --input archive.jsonl --output data/bulk/scored.jsonl --processes 4
+    python -m app.bulk --input archive.parquet --output data/bulk/scored.parquet --report data/bulk/report.json
+
+- 入力はチャンク単位で読み、プロセスプールの各プロセス (それぞれモデルを1つロードする) に
+  チャンクを振り分けて前処理と感情分析を行う。実行中のチャンク数には上限があり、
+  チャンクごとの集計 (SentimentAggregator / SentimentTrend) だけを残すので、入力の大きさによらずメモリ使用量は一定。
+- 結果は入力の順に追記する (JSONL は1ファイル、Parquet はチャンクごとの part-*.parquet をディレクトリに出力)。
+- 一定のチャンク数ごとにチェックポイント (書き込み済みの件数・出力の位置・集計) を保存し、
+  中断後に同じコマンドを再実行すると続きから再開する (最初からやり直す場合は --restart)。
+- 最後に集計全体から ReportGenerator でレポートを作る。
+
+入力の各レコードは "text" を含む必要がある ("id", "created_at", "source_url" などはそのまま出力に残る)。
+Parquet の読み書きには pyarrow が必要。
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from app.aggregator import SentimentAggregator
+from app.pools import spawn_pool
+from app.trends import SentimentTrend
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+# 何チャンクごとにチェックポイントを保存するか
+DEFAULT_CHECKPOINT_EVERY = 10
+# ワーカープロセスごとに同時に投入しておくチャンク数 (待ち時間を作らない程度に、メモリを使いすぎない程度に)
+CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+CHECKPOINT_VERSION = 1
+
+# ワーカープロセスごとに1つだけ作る前処理器・感情分析器 (_init_worker で初期化する)
+_worker = {}
+
+
+def _is_parquet(path):
+    return path.endswith(".parquet")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as e:
+        raise SystemExit("Parquet input/output requires pyarrow (pip install pyarrow)") from e
+
+
+def iter_chunks(path, chunk_size, skip=0):
+    """入力ファイルのレコード (辞書) を chunk_size 件ずつのリストで返す。先頭の skip 件は読み飛ばす"""
+    if _is_parquet(path):
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            records = batch.to_pylist()
+            if skip >= len(records):
+                skip -= len(records)
+                continue
+            records, skip = records[skip:], 0
+            yield records
+        return
+
+    chunk = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            chunk.append(json.loads(line))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class JsonlResultWriter:
+    """結果を1つの JSONL ファイルに追記する。位置 (バイト数) はチェックポイントに保存し、再開時にそこまで切り詰める"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = None
+
+    def open(self, position=0):
+        self._file = open(self.path, "a+b")
+        # 前回のチェックポイント以降に書かれた分 (途中で中断したチャンク) は捨てる
+        self._file.truncate(position)
+        self._file.seek(position)
+
+    def write(self, index, records):
+        for record in records:
+            # Parquet 由来の日時などはそのまま JSON にできないので文字列にする
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n")
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetResultWriter:
+    """結果をチャンクごとの part-XXXXXX.parquet としてディレクトリに書き出す"""
+
+    def __init__(self, path):
+        _require_pyarrow()
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _part_path(self, index):
+        return os.path.join(self.path, f"part-{index:06d}.parquet")
+
+    def open(self, position=0):
+        # position は書き込み済みのチャンク数。それ以降の (中断時に書かれた) ファイルは捨てる
+        for name in os.listdir(self.path):
+            if name.startswith("part-") and name.endswith(".parquet") and int(name[5:11]) >= position:
+                os.remove(os.path.join(self.path, name))
+        self._written = position
+
+    def write(self, index, records):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if records:
+            pq.write_table(pa.Table.from_pylist(records), self._part_path(index))
+        self._written = index + 1
+
+    def flush(self):
+        return self._written
+
+    def close(self):
+        pass
+
+
+def _init_worker(model_name, backend, model_cache_dir, batch_size, num_threads, tokenize):
+    import torch
+    from app.analyzer import SentimentAnalyzer
+    from app.preprocessor import Preprocessor
+
+    if num_threads:
+        # プロセスごとにモデルを持つので、torch のスレッド数はコア数をプロセス数で分けた値にする
+        torch.set_num_threads(num_threads)
+    analyzer = SentimentAnalyzer(model_name, backend=backend, model_cache_dir=model_cache_dir)
+    if not analyzer.is_loaded:
+        raise RuntimeError(f"Failed to load sentiment model '{model_name}': {analyzer.load_error}")
+    _worker.update(
+        analyzer=analyzer,
+        preprocessor=Preprocessor(tokenize_processes=1),
+        batch_size=batch_size,
+        tokenize=tokenize,
+    )
+
+
+def _analyze_chunk(index, records, trend_interval):
+    """
+    ワーカープロセスで1チャンクを前処理・感情分析する。
+    (チャンク番号, 出力レコード, SentimentAggregator.to_dict(), SentimentTrend.bucket_rows()) を返す。
+    """
+    preprocessor = _worker["preprocessor"]
+    tweets = preprocessor.preprocess_batch([record for record in records if record.get("text")])
+    if _worker["tokenize"]:
+        for tweet, tokens in zip(tweets, preprocessor.tokenize_batch([t["cleaned_text"] for t in tweets])):
+            tweet["tokens"] = tokens
+
+    # 同じテキスト (コピペ・bot の投稿) は1回だけ推論する
+    unique_texts = list(dict.fromkeys(tweet["cleaned_text"] for tweet in tweets if tweet["cleaned_text"]))
+    results = dict(zip(unique_texts, _worker["analyzer"].analyze_batch(unique_texts, batch_size=_worker["batch_size"])))
+    for tweet in tweets:
+        if tweet["cleaned_text"]:
+            tweet["sentiment"] = dict(results[tweet["cleaned_text"]])
+        else:
+            tweet["sentiment"] = {"label": "ニュートラル", "score": 0.0, "note": "Empty after cleaning"}
+
+    aggregator = SentimentAggregator().add_many(tweets)
+    trend_rows = SentimentTrend(trend_interval).update(tweets).bucket_rows() if trend_interval else []
+    return index, tweets, aggregator.to_dict(), trend_rows
+
+
+class BulkAnalysis:
+    """
+    入力ファイルをチャンク単位でプロセスプールに流し、結果の書き込み・集計・チェックポイントを行う。
+    チャンクの結果は完了順に届くが、書き込みと集計は入力の順 (チャンク番号順) に行う。
+    """
+
+    def __init__(self, input_path, output_path, checkpoint_path=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 processes=1, checkpoint_every=DEFAULT_CHECKPOINT_EVERY, trend_interval="1h",
+                 worker_args=()):
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint_path = checkpoint_path or f"{output_path.rstrip('/')}.checkpoint.json"
+        self.chunk_size = chunk_size
+        self.processes = processes
+        self.checkpoint_every = checkpoint_every
+        self.trend_interval = trend_interval
+        self.worker_args = worker_args
+        self.writer = ParquetResultWriter(output_path) if _is_parquet(output_path) else JsonlResultWriter(output_path)
+
+        self.next_chunk = 0
+        self.records_done = 0
+        self.output_position = 0
+        self.aggregator = SentimentAggregator()
+        self.trend = SentimentTrend(trend_interval) if trend_interval else None
+        self.completed = False
+
+    def _parameters(self):
+        return {
+            "input": os.path.abspath(self.input_path),
+            "output": os.path.abspath(self.output_path),
+            "chunk_size": self.chunk_size,
+            "trend_interval": self.trend_interval,
+        }
+
+    def load_checkpoint(self):
+        """チェックポイントがあれば状態を復元し、True を返す"""
+        if not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION or checkpoint.get("parameters") != self._parameters():
+            raise SystemExit(
+                f"Checkpoint '{self.checkpoint_path}' was created with different parameters. "
+                "Use the same input/output/chunk size, or --restart to start over."
+            )
+        self.next_chunk = checkpoint["next_chunk"]
+        self.records_done = checkpoint["records_done"]
+        self.output_position = checkpoint["output_position"]
+        self.aggregator = SentimentAggregator.from_dict(checkpoint["aggregator"])
+        if self.trend_interval:
+            self.trend = SentimentTrend.from_bucket_rows(checkpoint["trend_rows"], interval=self.trend_interval)
+        self.completed = checkpoint.get("completed", False)
+        return True
+
+    def save_checkpoint(self):
+        """出力を書き込み済みにしてから、チェックポイントを一時ファイル経由で置き換える (途中で壊れないように)"""
+        self.output_position = self.writer.flush()
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "parameters": self._parameters(),
+            "next_chunk": self.next_chunk,
+            "records_done": self.records_done,
+            "output_position": self.output_position,
+            "completed": self.completed,
+            "aggregator": self.aggregator.to_dict(),
+            "trend_rows": self.trend.bucket_rows() if self.trend is not None else [],
+            "saved_at": time.time(),
+        }
+        temporary_path = f"{self.checkpoint_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False, default=str)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def _get_pool(self):
+        return spawn_pool(self.processes, initializer=_init_worker, initargs=self.worker_args)
+
+    def _apply(self, records, aggregator_dict, trend_rows):
+        """チャンク番号順に、結果の書き込みと集計への取り込みを行う"""
+        # 途中で中断されると出力・集計・件数が食い違うので、終わるまでは run の終了時にチェックポイントを保存しない
+        # (再開時は前回のチェックポイントの出力の位置まで切り詰めて、そのチャンクからやり直す)
+        self._applying = True
+        self.writer.write(self.next_chunk, records)
+        self.aggregator.merge(SentimentAggregator.from_dict(aggregator_dict))
+        if self.trend is not None and trend_rows:
+            self.trend.merge(SentimentTrend.from_bucket_rows(trend_rows, interval=self.trend_interval))
+        self.next_chunk += 1
+        self.records_done += self._chunk_sizes.pop(self.next_chunk - 1)
+        if self.next_chunk % self.checkpoint_every == 0:
+            self.save_checkpoint()
+            elapsed = time.monotonic() - self._started
+            rate = (self.records_done - self._records_at_start) / elapsed if elapsed > 0 else 0.0
+            logger.info(f"Checkpoint: {self.records_done} records ({self.next_chunk} chunks) done, {rate:.1f} records/s")
+        self._applying = False
+
+    def run(self):
+        if self.completed:
+            logger.info("All chunks were already processed. Building the report from the checkpoint.")
+            return self
+        if self.next_chunk:
+            logger.info(f"Resuming from chunk {self.next_chunk} ({self.records_done} records done)")
+        self.writer.open(self.output_position)
+        self._started = time.monotonic()
+        self._records_at_start = self.records_done
+        self._chunk_sizes = {}
+        self._applying = False
+        max_in_flight = self.processes * CHUNKS_IN_FLIGHT_PER_PROCESS
+        finished = {}  # 完了したが、前のチャンクが終わっていないため書き込めない結果
+        in_flight = set()
+        pool = self._get_pool()
+        try:
+            index = self.next_chunk
+            for chunk in iter_chunks(self.input_path, self.chunk_size, skip=self.records_done):
+                self._chunk_sizes[index] = len(chunk)
+                in_flight.add(pool.submit(_analyze_chunk, index, chunk, self.trend_interval))
+                index += 1
+                # 投入済みのチャンク (未書き込みの結果を含む) が上限に達したら、完了を待つ
+                while len(in_flight) + len(finished) >= max_in_flight:
+                    in_flight = self._drain(in_flight, finished)
+            while in_flight or finished:
+                in_flight = self._drain(in_flight, finished)
+            self.completed = True
+        finally:
+            # 中断された場合は実行中のチャンクを待たずに終了する (書き込み済みのところまでを保存する)
+            pool.shutdown(wait=self.completed, cancel_futures=True)
+            if self._applying:
+                logger.warning(f"Interrupted while writing chunk {self.next_chunk}. "
+                               "The next run resumes from the last checkpoint.")
+            else:
+                self.save_checkpoint()
+            self.writer.close()
+        return self
+
+    def _drain(self, in_flight, finished):
+        """少なくとも1チャンクの完了を待ち、先頭から連続して完了したチャンクを反映する。未完了の Future を返す"""
+        if in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, records, aggregator_dict, trend_rows = future.result()
+                finished[index] = (records, aggregator_dict, trend_rows)
+        while self.next_chunk in finished:
+            self._apply(*finished.pop(self.next_chunk))
+        return in_flight
+
+    def report(self, keyword, chart_format="png", trend_max_buckets=24):
+        """集計全体からレポート (ReportGenerator.render_report と同じ形式の辞書) を作る"""
+        from app.charts import ChartRenderer
+        from app.reporter import ReportGenerator
+        report_generator = ReportGenerator(
+            chart_renderer=ChartRenderer(chart_format, processes=0),
+            trend_interval=self.trend_interval,
+            trend_max_buckets=trend_max_buckets,
+        )
+        report = report_generator.generate_report_from_aggregate(keyword, self.aggregator, trend=self.trend)
+        report["records"] = self.records_done
+        report["mean_scores"] = {label: round(score, 4) for label, score in self.aggregator.mean_scores().items()}
+        report["score_histograms"] = self.aggregator.histograms
+        return report
+
+
+def main():
+    from app.analyzer import BACKENDS, MODEL_NAME
+    from config import (
+        SENTIMENT_MODEL_NAME, SENTIMENT_BACKEND, SENTIMENT_MODEL_CACHE_DIR, SENTIMENT_BATCH_SIZE,
+        TREND_INTERVAL, TREND_MAX_BUCKETS, CHART_FORMAT,
+    )
+
+    parser = argparse.ArgumentParser(description="JSONL / Parquet のツイートをまとめて感情分析する")
+    parser.add_argument("--input", required=True, help="入力ファイル (.jsonl または .parquet)")
+    parser.add_argument("--output", required=True,
+                        help="出力先 (.jsonl はファイル、.parquet はチャンクごとのファイルを置くディレクトリ)")
+    parser.add_argument("--checkpoint", default=None, help="チェックポイントのパス (省略時は <output>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="チェックポイントを無視して最初からやり直す")
+    parser.add_argument("--report", default=None, help="レポート (JSON) の保存先")
+    parser.add_argument("--keyword", default=None, help="レポートの調査テーマ (省略時は入力ファイル名)")
+    parser.add_argument("--processes", type=int, default=1, help="ワーカープロセス数 (プロセスごとにモデルをロードする)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY, help="チェックポイントの間隔 (チャンク数)")
+    parser.add_argument("--model", default=SENTIMENT_MODEL_NAME or MODEL_NAME)
+    parser.add_argument("--backend", choices=BACKENDS, default=SENTIMENT_BACKEND)
+    parser.add_argument("--batch-size", type=int, default=SENTIMENT_BATCH_SIZE)
+    parser.add_argument("--tokenize", action="store_true", help="形態素解析の結果 (tokens) も出力する")
+    parser.add_argument("--trend-interval", default=TREND_INTERVAL, help="時間帯ごとの推移の間隔 (空文字で無効)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    threads_per_process = max(1, (os.cpu_count() or 1) // args.processes)
+    bulk = BulkAnalysis(
+        args.input,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        chunk_size=args.chunk_size,
+        processes=args.processes,
+        checkpoint_every=args.checkpoint_every,
+        trend_interval=args.trend_interval or None,
+        worker_args=(args.model, args.backend, SENTIMENT_MODEL_CACHE_DIR, args.batch_size,
+                     threads_per_process, args.tokenize),
+    )
+    if args.restart and os.path.exists(bulk.checkpoint_path):
+        os.remove(bulk.checkpoint_path)
+    elif bulk.load_checkpoint():
+        logger.info(f"Loaded checkpoint '{bulk.checkpoint_path}'")
+
+    started = time.monotonic()
+    bulk.run()
+    logger.info(f"Processed {bulk.records_done} records in {time.monotonic() - started:.1f}s")
+
+    keyword = args.keyword or os.path.splitext(os.path.basename(args.input))[0]
+    report = bulk.report(keyword, chart_format=CHART_FORMAT, trend_max_buckets=TREND_MAX_BUCKETS)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print(report["text_report"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+# app/cache.py
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from app.analyzer import AnalyzerWrapper
+
+logger = logging.getLogger(__name__)
+
+# キャッシュに保存しないラベル (一時的な失敗を固定化しないため)
+UNCACHEABLE_LABELS = {"ERROR", "UNKNOWN"}
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化する (NFKC + 空白の正規化)"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+def make_cache_key(model_name, text):
+    """(モデル名, 正規化済みテキスト) から内容アドレスのキーを作る"""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SentimentCache:
+    """
+    感情分析結果のキャッシュ。
+    メモリ上の LRU (件数上限あり) と、SQLite による永続化層の2段構成。
+    SQLite 層は件数上限 (max_rows) と保存期間 (max_age_seconds) で古いものから削除する。
+    """
+
+    def __init__(self, db_path=None, memory_size=10000, max_rows=200000, max_age_seconds=7 * 24 * 3600,
+                 evict_every=500):
+        self.db_path = db_path
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_evict = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS sentiment_cache ("
+                    " key TEXT PRIMARY KEY,"
+                    " label TEXT NOT NULL,"
+                    " score REAL NOT NULL,"
+                    " created_at REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_sentiment_cache_created ON sentiment_cache (created_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # 接続はスレッド/プロセスごとに都度作成する (sqlite3 の接続はスレッド間で共有しない)
+        # sqlite3 の接続の with はコミットするだけで閉じないため、ここで明示的に閉じる
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn: # 正常終了時はコミット、例外時はロールバック
+                yield conn
+        finally:
+            conn.close()
+
+    def _remember(self, key, value):
+        """メモリ LRU に登録する (呼び出し側でロックを取得していること)"""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """キーのリストを受け取り、ヒットしたものだけを {key: result} で返す"""
+        found = {}
+        disk_lookup = []
+        with self._lock:
+            for key in keys:
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = value
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.append(key)
+
+        if disk_lookup and self.db_path:
+            min_created = time.time() - self.max_age_seconds if self.max_age_seconds else 0
+            unique_keys = list(dict.fromkeys(disk_lookup))
+            rows = []
+            try:
+                with self._connect() as conn:
+                    # SQLite のプレースホルダ数上限を超えないよう分割して問い合わせる
+                    for start in range(0, len(unique_keys), 500):
+                        chunk = unique_keys[start:start + 500]
+                        placeholders = ",".join("?" * len(chunk))
+                        rows.extend(conn.execute(
+                            f"SELECT key, label, score FROM sentiment_cache WHERE key IN ({placeholders}) AND created_at >= ?",
+                            (*chunk, min_created),
+                        ).fetchall())
+            except sqlite3.Error as e:
+                logger.error(f"Error reading sentiment cache '{self.db_path}': {e}", exc_info=True)
+            with self._lock:
+                for key, label, score in rows:
+                    value = {"label": label, "score": score}
+                    found[key] = value
+                    self._remember(key, value)
+
+        with self._lock:
+            for key in disk_lookup:
+                if key in found:
+                    self.disk_hits += 1
+                else:
+                    self.misses += 1
+        return found
+
+    def put_many(self, items):
+        """{key: result} を保存する。ERROR などの結果は保存しない"""
+        entries = [
+            (key, result["label"], float(result["score"]))
+            for key, result in items.items()
+            if result and result.get("label") not in UNCACHEABLE_LABELS and "note" not in result
+        ]
+        if not entries:
+            return
+        with self._lock:
+            for key, label, score in entries:
+                self._remember(key, {"label": label, "score": score})
+            self._writes_since_evict += len(entries)
+            should_evict = self._writes_since_evict >= self.evict_every
+            if should_evict:
+                self._writes_since_evict = 0
+
+        if not self.db_path:
+            return
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO sentiment_cache (key, label, score, created_at) VALUES (?, ?, ?, ?)",
+                    [(key, label, score, now) for key, label, score in entries],
+                )
+            if should_evict:
+                self.evict()
+        except sqlite3.Error as e:
+            logger.error(f"Error writing sentiment cache '{self.db_path}': {e}", exc_info=True)
+
+    def evict(self):
+        """SQLite 層から期限切れ・上限超過のエントリを削除する"""
+        if not self.db_path:
+            return
+        with self._connect() as conn:
+            if self.max_age_seconds:
+                conn.execute("DELETE FROM sentiment_cache WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            if self.max_rows:
+                conn.execute(
+                    "DELETE FROM sentiment_cache WHERE key IN ("
+                    " SELECT key FROM sentiment_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+class CachedSentimentAnalyzer(AnalyzerWrapper):
+    """
+    SentimentAnalyzer の前段にキャッシュを置くラッパー。
+    analyze_batch / analyze_sentiment は SentimentAnalyzer と同じ形式で結果を返し、
+    キャッシュミスしたテキストだけを実際のモデルに渡す。
+    """
+
+    def __init__(self, analyzer, cache):
+        super().__init__(analyzer)
+        self.cache = cache
+
+    def _cache_namespace(self):
+        # 量子化バックエンドはスコアがわずかに異なるため、fp32 とは別のキーにする
+        backend = getattr(self.analyzer, 'backend', 'fp32')
+        return self.analyzer.model_name if backend == 'fp32' else f"{self.analyzer.model_name}#{backend}"
+
+    def analyze_batch(self, texts, **kwargs):
+        results = [None] * len(texts)
+        keys = [None] * len(texts)
+        namespace = self._cache_namespace()
+        for i, text in enumerate(texts):
+            if text and isinstance(text, str) and text.strip():
+                keys[i] = make_cache_key(namespace, text)
+
+        cached = self.cache.get_many([key for key in keys if key is not None])
+
+        # キャッシュミスしたテキストは、同じキーの重複をまとめて1回だけ推論する
+        miss_keys = []
+        miss_texts = []
+        seen = set()
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            if key in cached:
+                results[i] = dict(cached[key])
+            elif key not in seen:
+                seen.add(key)
+                miss_keys.append(key)
+                miss_texts.append(texts[i])
+
+        computed = {}
+        if miss_texts:
+            for key, result in zip(miss_keys, self.analyzer.analyze_batch(miss_texts, **kwargs)):
+                computed[key] = result
+            self.cache.put_many(computed)
+
+        empty_texts = [texts[i] for i, key in enumerate(keys) if key is None]
+        empty_results = iter(self.analyzer.analyze_batch(empty_texts, **kwargs) if empty_texts else [])
+        for i, key in enumerate(keys):
+            if key is None:
+                results[i] = next(empty_results)
+            elif results[i] is None:
+                results[i] = dict(computed[key])
+        return results
+
+    def analyze_sentiment(self, text):
+        return self.analyze_batch([text])[0]
+
+    def cache_stats(self):
+        return self.cache.stats()
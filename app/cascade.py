@@ -0,0 +1,192 @@
+# app/cascade.py
+"""
+軽量な1段目の分類器で確信度の高いテキストだけを判定し、残りを大きな BERT モデルに回すカスケード。
+
+1段目は BERT 自身のラベルで事前に学習した scikit-learn のモデル (文字 n-gram + ロジスティック回帰)。
+学習としきい値の検討:
+    python -m app.cascade --corpus tweets.jsonl --out data/models/cascade.joblib
+
+コーパスは parity と同じ形式 (1行1テキスト、または "text" / "cleaned_text" を含む JSONL)。
+ホールドアウトしたテキストで、しきい値ごとの1段目の処理割合と BERT との一致率を JSON で出力する。
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import zlib
+
+from app.analyzer import AnalyzerWrapper
+
+logger = logging.getLogger(__name__)
+
+# 学習結果の評価に使うしきい値の候補
+CANDIDATE_THRESHOLDS = (0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98)
+
+
+def build_first_stage_model():
+    """文字 n-gram (ハッシュ) + TF-IDF + ロジスティック回帰。語彙を持たないので保存サイズが小さい"""
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    return make_pipeline(
+        HashingVectorizer(analyzer="char_wb", ngram_range=(1, 3), n_features=2 ** 18, alternate_sign=False),
+        TfidfTransformer(sublinear_tf=True),
+        LogisticRegression(max_iter=1000, C=4.0),
+    )
+
+
+def load_first_stage_model(path):
+    import joblib
+    return joblib.load(path)
+
+
+class CascadeSentimentAnalyzer(AnalyzerWrapper):
+    """
+    1段目の分類器の確信度 (予測ラベルの確率) が threshold 以上のテキストはその結果を返し、
+    それ未満のテキストだけを analyzer (BERT) に渡す。SentimentAnalyzer と同じ形式で結果を返す。
+    audit_rate の割合で1段目が判定したテキストも BERT で確認し、一致率を集計する (結果は BERT を採用)。
+    """
+
+    def __init__(self, analyzer, first_stage, threshold=0.9, audit_rate=0.05):
+        super().__init__(analyzer)
+        self.first_stage = first_stage
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+
+        self._lock = threading.Lock()
+        self.total = 0
+        self.first_stage_count = 0
+        self.model_count = 0
+        self.audited = 0
+        self.audit_agreed = 0
+
+    def _is_audited(self, text):
+        # 同じテキストは常に同じ扱いになるよう、乱数ではなくハッシュで抽出する
+        return (zlib.crc32(text.encode("utf-8")) % 10000) < self.audit_rate * 10000
+
+    def analyze_batch(self, texts, **kwargs):
+        results = [None] * len(texts)
+        valid_indices = [i for i, text in enumerate(texts) if text and isinstance(text, str) and text.strip()]
+
+        confident = {}
+        if valid_indices:
+            probabilities = self.first_stage.predict_proba([texts[i] for i in valid_indices])
+            classes = self.first_stage.classes_
+            for i, probs in zip(valid_indices, probabilities):
+                best = int(probs.argmax())
+                if probs[best] >= self.threshold:
+                    confident[i] = {"label": str(classes[best]), "score": round(float(probs[best]), 4)}
+
+        audited = [i for i in confident if self._is_audited(texts[i])]
+        # 空のテキストも含め、1段目で確定しなかったものは BERT 側の扱いに任せる
+        to_model = [i for i in range(len(texts)) if i not in confident or i in audited]
+        model_results = self.analyzer.analyze_batch([texts[i] for i in to_model], **kwargs) if to_model else []
+        for i, result in zip(to_model, model_results):
+            results[i] = result
+        for i, result in confident.items():
+            if results[i] is None:
+                results[i] = result
+
+        with self._lock:
+            self.total += len(valid_indices)
+            self.first_stage_count += len(confident) - len(audited)
+            self.model_count += len(valid_indices) - len(confident) + len(audited)
+            self.audited += len(audited)
+            self.audit_agreed += sum(1 for i in audited if results[i].get("label") == confident[i]["label"])
+        return results
+
+    def analyze_sentiment(self, text):
+        return self.analyze_batch([text])[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "total": self.total,
+                "first_stage": self.first_stage_count,
+                "model": self.model_count,
+                "first_stage_rate": round(self.first_stage_count / self.total, 4) if self.total else 0.0,
+                "audited": self.audited,
+                "audit_agreement": round(self.audit_agreed / self.audited, 4) if self.audited else None,
+            }
+
+
+def evaluate_thresholds(model, texts, labels, thresholds=CANDIDATE_THRESHOLDS):
+    """しきい値ごとに、1段目で確定する割合 (coverage) と、そのテキストでの BERT との一致率を返す"""
+    probabilities = model.predict_proba(texts)
+    predicted = model.classes_[probabilities.argmax(axis=1)]
+    confidence = probabilities.max(axis=1)
+    report = []
+    for threshold in thresholds:
+        mask = confidence >= threshold
+        covered = int(mask.sum())
+        agreed = int((predicted[mask] == labels[mask]).sum()) if covered else 0
+        report.append({
+            "threshold": threshold,
+            "coverage": round(covered / len(texts), 4) if len(texts) else 0.0,
+            "agreement": round(agreed / covered, 4) if covered else None,
+            # 1段目を使わない場合と比べた BERT の呼び出し回数の削減倍率
+            "model_call_reduction": round(len(texts) / (len(texts) - covered), 2) if covered < len(texts) else None,
+        })
+    return report
+
+
+def main():
+    import joblib
+    import numpy as np
+    from sklearn.model_selection import train_test_split
+
+    from app.analyzer import SentimentAnalyzer, MODEL_NAME, BACKENDS, DEFAULT_BATCH_SIZE
+    from app.parity import load_corpus
+    from config import SENTIMENT_MODEL_CACHE_DIR, CASCADE_MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="BERT のラベルでカスケードの1段目の分類器を学習する")
+    parser.add_argument("--corpus", required=True, help="1行1テキストのファイル、または JSONL")
+    parser.add_argument("--out", default=CASCADE_MODEL_PATH)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--backend", choices=BACKENDS, default="fp32")
+    parser.add_argument("--limit", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    texts = list(dict.fromkeys(load_corpus(args.corpus, args.limit))) # 重複を除く
+
+    teacher = SentimentAnalyzer(args.model, backend=args.backend, model_cache_dir=SENTIMENT_MODEL_CACHE_DIR)
+    if not teacher.is_loaded:
+        raise SystemExit("Failed to load the sentiment model")
+    logger.info(f"Labelling {len(texts)} texts with {args.model} ({args.backend})...")
+    results = teacher.analyze_batch(texts, batch_size=args.batch_size)
+    pairs = [(text, result["label"]) for text, result in zip(texts, results)
+             if result.get("label") not in ("ERROR", "UNKNOWN") and "note" not in result]
+    if len(pairs) < 10 or len({label for _, label in pairs}) < 2:
+        raise SystemExit("Not enough labelled texts (or labels) to train the first stage")
+    texts = [text for text, _ in pairs]
+    labels = np.asarray([label for _, label in pairs])
+
+    train_texts, test_texts, train_labels, test_labels = train_test_split(
+        texts, labels, test_size=args.test_size, random_state=42)
+    model = build_first_stage_model()
+    model.fit(train_texts, train_labels)
+
+    out_dir = os.path.dirname(args.out)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    joblib.dump(model, args.out)
+
+    report = {
+        "teacher_model": args.model,
+        "backend": args.backend,
+        "train": len(train_texts),
+        "test": len(test_texts),
+        "labels": {str(label): int(count) for label, count in zip(*np.unique(labels, return_counts=True))},
+        "thresholds": evaluate_thresholds(model, test_texts, test_labels),
+        "saved_to": args.out,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+# app/charts.py
+import atexit
+import base64
+import functools
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.metrics import span
+from app.pools import spawn_pool
+
+logger = logging.getLogger(__name__)
+
+# 出力形式
+# - png: PNG 画像 (data URI)
+# - svg: SVG 画像 (data URI)。文字はフォントを埋め込まずテキストのまま出力するので小さい
+# - json: 描画用のデータだけを返し、ブラウザ側で描画する
+CHART_FORMATS = ("png", "svg", "json")
+
+# 円グラフに表示するラベルと色 (表示順)
+PIE_SLICES = (
+    ("ポジティブ", "lightgreen"),
+    ("ネガティブ", "lightcoral"),
+    ("ニュートラル", "lightskyblue"),
+)
+
+# 日本語フォントの候補 (システムにインストールされているものを使用)
+JAPANESE_FONT_CANDIDATES = ('IPAexGothic', 'Hiragino Sans', 'Yu Gothic', 'MS Gothic', 'Noto Sans CJK JP')
+
+
+@functools.lru_cache(maxsize=1)
+def resolve_font_family():
+    """
+    インストール済みの日本語フォントをプロセスごとに1回だけ調べ、font.family に指定するリストを返す。
+    (候補をそのまま渡すと、描画のたびに見つからないフォントの探索と警告が発生する)
+    """
+    from matplotlib import font_manager
+    installed = {font.name for font in font_manager.fontManager.ttflist}
+    found = [name for name in JAPANESE_FONT_CANDIDATES if name in installed]
+    if not found:
+        logger.warning("No Japanese font found. Chart labels may not render correctly.")
+    return found + ['sans-serif']
+
+
+def pie_chart_data(sentiment_counts, keyword, total=None):
+    """
+    円グラフの描画データ (ラベル・件数・割合・色) を返す。有効な件数がない場合は None。
+    割合の分母は total (レポートの分析件数。UNKNOWN なども含む)、省略した場合は表示するラベルの件数の合計
+    """
+    total = total or sum(sentiment_counts.get(label, 0) for label, _ in PIE_SLICES)
+    slices = [
+        {
+            "label": label,
+            "count": sentiment_counts[label],
+            "share": round(sentiment_counts[label] / total * 100, 1),
+            "color": color,
+        }
+        for label, color in PIE_SLICES if sentiment_counts.get(label, 0) > 0
+    ]
+    if not slices:
+        return None
+    return {"type": "pie", "title": f"「{keyword}」に関する感情分析結果", "slices": slices}
+
+
+def render_pie_chart(sentiment_counts, keyword, chart_format="png", total=None):
+    """
+    円グラフを描画して、png / svg の場合は data URI、json の場合は描画データの辞書を返す。
+    pyplot のグローバル状態を使わず Figure を直接作るので、複数スレッド・プロセスから同時に呼べる。
+    """
+    data = pie_chart_data(sentiment_counts, keyword, total=total)
+    if data is None or chart_format == "json":
+        return data
+    # 扇形の中の割合もラベルと同じ分母 (total) で表示する
+    shown = sum(s["count"] for s in data["slices"])
+    scale = shown / total if total else 1.0
+
+    from matplotlib.figure import Figure
+    from matplotlib import rc_context
+
+    # rcParams の変更は with の中だけに限定する (他の描画に影響させない)
+    with rc_context({'font.family': resolve_font_family(), 'svg.fonttype': 'none'}):
+        fig = Figure(figsize=(8, 7)) # グラフサイズを少し調整
+        ax = fig.add_subplot()
+        # autopct でパーセンテージ表示、startangle で開始角度調整
+        # wedgeprops で円グラフの線のスタイルを指定
+        ax.pie([s["count"] for s in data["slices"]],
+               labels=[f"{s['label']}\n({s['share']:.1f}%)" for s in data["slices"]],
+               colors=[s["color"] for s in data["slices"]],
+               autopct=lambda pct: f"{pct * scale:.1f}%",
+               startangle=90,
+               pctdistance=0.85, # パーセンテージ表示位置
+               labeldistance=1.05, # ラベル表示位置
+               wedgeprops={'linewidth': 0.5, 'edgecolor': 'grey'}) # 境界線
+        ax.axis('equal')  # 円を真円に
+        ax.set_title(data["title"], pad=20, fontsize=14)
+
+        # 画像をメモリ上のバッファに保存
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=chart_format, bbox_inches='tight', dpi=100) # dpiで解像度調整
+
+    mime = "image/svg+xml" if chart_format == "svg" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+
+def render_trend_chart(trend, keyword, chart_format="png"):
+    """
+    時間帯ごとの件数 (ラベル別の積み上げ棒) と、ポジティブ - ネガティブの割合 (折れ線) を描画する。
+    trend は SentimentTrend.result() の形式。png / svg の場合は data URI、json の場合は描画データの辞書を返す。
+    """
+    buckets = trend.get("buckets") if trend else None
+    if not buckets:
+        return None
+    data = {
+        "type": "trend",
+        "title": f"「{keyword}」に関する感情の推移",
+        "interval": trend.get("interval"),
+        "starts": [bucket["start"] for bucket in buckets],
+        "series": [
+            {"label": label, "color": color, "counts": [bucket["counts"].get(label, 0) for bucket in buckets]}
+            for label, color in PIE_SLICES
+        ],
+        "net": [bucket["net"] for bucket in buckets],
+        "spikes": [i for i, bucket in enumerate(buckets) if bucket["spike"]],
+    }
+    if chart_format == "json":
+        return data
+
+    from matplotlib.figure import Figure
+    from matplotlib import rc_context
+
+    positions = np.arange(len(buckets))
+    # 時間帯の開始時刻を「月-日 時:分」で表示する
+    tick_labels = [start[5:16].replace("T", " ") for start in data["starts"]]
+    with rc_context({'font.family': resolve_font_family(), 'svg.fonttype': 'none'}):
+        fig = Figure(figsize=(10, 5))
+        ax = fig.add_subplot()
+        bottom = np.zeros(len(buckets))
+        for series in data["series"]:
+            counts = np.asarray(series["counts"], dtype=float)
+            ax.bar(positions, counts, bottom=bottom, color=series["color"], label=series["label"],
+                   edgecolor='grey', linewidth=0.3)
+            bottom += counts
+        for i in data["spikes"]:
+            ax.annotate("▲", (positions[i], bottom[i]), ha='center', va='bottom', color='red')
+        ax.set_ylabel("件数")
+        step = max(1, len(buckets) // 12) # 目盛りのラベルが重ならないよう間引く
+        ax.set_xticks(positions[::step])
+        ax.set_xticklabels(tick_labels[::step], rotation=45, ha='right', fontsize=8)
+
+        net_ax = ax.twinx()
+        net_ax.plot(positions, data["net"], color='dimgrey', marker='o', markersize=3, linewidth=1,
+                    label="ポジティブ - ネガティブ")
+        net_ax.set_ylim(-1, 1)
+        net_ax.axhline(0, color='lightgrey', linewidth=0.5)
+        handles, labels = ax.get_legend_handles_labels()
+        net_handles, net_labels = net_ax.get_legend_handles_labels()
+        ax.legend(handles + net_handles, labels + net_labels, loc='upper left', fontsize=8)
+        ax.set_title(data["title"], pad=15, fontsize=14)
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=chart_format, bbox_inches='tight', dpi=100)
+
+    mime = "image/svg+xml" if chart_format == "svg" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+
+def render_comparison_chart(summaries, chart_format="png"):
+    """
+    キーワードごとの感情の割合を横向きの100%積み上げ棒で並べて描画する。
+    summaries は {'keyword', 'counts', 'analyzed'} のリスト (ReportGenerator.generate_comparison_report の keywords)。
+    割合の分母はレポートと同じ analyzed (省略した場合は表示するラベルの件数の合計)。
+    png / svg の場合は data URI、json の場合は描画データの辞書を返す。
+    """
+    rows = [summary for summary in summaries if sum(summary["counts"].get(label, 0) for label, _ in PIE_SLICES)]
+    if not rows:
+        return None
+    totals = [row.get("analyzed") or sum(row["counts"].get(label, 0) for label, _ in PIE_SLICES) for row in rows]
+    data = {
+        "type": "comparison",
+        "title": "キーワード別の感情の割合",
+        "keywords": [row["keyword"] for row in rows],
+        "totals": totals,
+        "series": [
+            {
+                "label": label,
+                "color": color,
+                "counts": [row["counts"].get(label, 0) for row in rows],
+                "shares": [round(row["counts"].get(label, 0) / total * 100, 1) for row, total in zip(rows, totals)],
+            }
+            for label, color in PIE_SLICES
+        ],
+    }
+    if chart_format == "json":
+        return data
+
+    from matplotlib.figure import Figure
+    from matplotlib import rc_context
+
+    positions = np.arange(len(rows))
+    with rc_context({'font.family': resolve_font_family(), 'svg.fonttype': 'none'}):
+        fig = Figure(figsize=(10, 1.5 + 0.8 * len(rows)))
+        ax = fig.add_subplot()
+        left = np.zeros(len(rows))
+        for series in data["series"]:
+            shares = np.asarray(series["shares"], dtype=float)
+            ax.barh(positions, shares, left=left, color=series["color"], label=series["label"],
+                    edgecolor='grey', linewidth=0.3)
+            for i, share in enumerate(shares):
+                if share >= 8: # 狭い区間には割合を書かない
+                    ax.text(left[i] + share / 2, positions[i], f"{share:.0f}%", ha='center', va='center', fontsize=8)
+            left += shares
+        ax.set_yticks(positions)
+        ax.set_yticklabels([f"{keyword}\n({total}件)" for keyword, total in zip(data["keywords"], totals)])
+        ax.invert_yaxis() # 指定されたキーワードの順に上から並べる
+        ax.set_xlim(0, 100)
+        ax.set_xlabel("割合 (%)")
+        ax.legend(loc='upper center', bbox_to_anchor=(0.5, -0.15 if len(rows) > 2 else -0.3), ncol=3, fontsize=8)
+        ax.set_title(data["title"], pad=15, fontsize=14)
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=chart_format, bbox_inches='tight', dpi=100)
+
+    mime = "image/svg+xml" if chart_format == "svg" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
+
+
+class ChartRenderer:
+    """
+    グラフの描画を担当する。同じ (件数, キーワード, 形式) の結果はメモリにキャッシュする。
+    processes > 0 の場合は描画を専用のプロセスプールで行い、分析スレッド (推論) と GIL を取り合わないようにする。
+    """
+
+    def __init__(self, chart_format="png", processes=0, cache_size=256):
+        if chart_format not in CHART_FORMATS:
+            raise ValueError(f"Unknown chart format '{chart_format}'. Choose from {CHART_FORMATS}")
+        self.chart_format = chart_format
+        self.processes = processes
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = spawn_pool(self.processes)
+                atexit.register(self._pool.shutdown, wait=False)
+            return self._pool
+
+    def _render_cached(self, key, function, *args):
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        chart_format = args[-1]
+        with span('render'):
+            if chart_format == "json" or not self.processes:
+                chart = function(*args)
+            else:
+                chart = self._get_pool().submit(function, *args).result()
+
+        with self._cache_lock:
+            self._cache[key] = chart
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return chart
+
+    def render(self, sentiment_counts, keyword, chart_format=None, total=None):
+        """感情の割合の円グラフ (割合の分母は total。省略した場合は sentiment_counts の全ラベルの合計)"""
+        chart_format = chart_format or self.chart_format
+        counts = {label: sentiment_counts.get(label, 0) for label, _ in PIE_SLICES}
+        total = total if total is not None else sum(sentiment_counts.values())
+        key = ("pie", tuple(counts.values()), total, keyword, chart_format)
+        return self._render_cached(key, render_pie_chart, counts, keyword, chart_format, total)
+
+    def render_trend(self, trend, keyword, chart_format=None):
+        """時間帯ごとの推移のグラフ (trend は SentimentTrend.result() の形式)"""
+        chart_format = chart_format or self.chart_format
+        buckets = tuple(
+            (bucket["start"], tuple(sorted(bucket["counts"].items())), bucket["spike"])
+            for bucket in (trend or {}).get("buckets", [])
+        )
+        key = ("trend", buckets, keyword, chart_format)
+        return self._render_cached(key, render_trend_chart, trend, keyword, chart_format)
+
+    def render_comparison(self, summaries, chart_format=None):
+        """キーワードごとの感情の割合の比較グラフ (summaries は {'keyword', 'counts', 'analyzed'} のリスト)"""
+        chart_format = chart_format or self.chart_format
+        rows = [
+            {"keyword": summary["keyword"],
+             "counts": {label: summary["counts"].get(label, 0) for label, _ in PIE_SLICES},
+             "analyzed": summary.get("analyzed")}
+            for summary in summaries
+        ]
+        key = ("comparison", tuple((row["keyword"], tuple(row["counts"].values()), row["analyzed"]) for row in rows),
+               chart_format)
+        return self._render_cached(key, render_comparison_chart, rows, chart_format)
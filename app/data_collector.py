@@ -1,57 +1,240 @@
 # app/data_collector.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import json
-from config import TWITTER_BEARER_TOKEN # config.py から読み込み
+from requests.adapters import HTTPAdapter
+
+from app.metrics import API_REQUESTS
+from app.tweet_batch import TweetBatch
+from config import TWITTER_BEARER_TOKEN, TWITTER_SEARCH_URL # config.py から読み込み
+
+logger = logging.getLogger(__name__)
+
+# recent search API の1ページあたりの件数の範囲
+MIN_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+
+class DataCollectionError(Exception):
+    """リトライしても API からデータを取得できなかった場合に送出される"""
+
+
+class RateLimiter:
+    """
+    x-rate-limit-* ヘッダーから残りリクエスト数とリセット時刻を追跡し、
+    複数スレッド・複数クエリで共有する API の利用枠を管理する。
+    """
 
-class DataCollector:
     def __init__(self):
-        self.bearer_token = TWITTER_BEARER_TOKEN
-        self.search_url = "https://api.twitter.com/2/tweets/search/recent"
+        self.remaining = None
+        self.reset_at = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """利用枠を使い切っている場合はリセット時刻まで待つ"""
+        while True:
+            with self._lock:
+                if self.remaining is None or self.remaining > 0 or self.reset_at is None:
+                    if self.remaining is not None:
+                        # 並行リクエスト分をあらかじめ差し引いておく
+                        self.remaining -= 1
+                    return
+                delay = self.reset_at - time.time()
+                if delay <= 0:
+                    self.remaining = None
+                    continue
+            logger.info(f"Rate limit exhausted, waiting {delay:.1f}s until reset")
+            time.sleep(min(delay, 60))
+
+    def update(self, headers):
+        remaining = headers.get("x-rate-limit-remaining")
+        reset = headers.get("x-rate-limit-reset")
+        with self._lock:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset_at = float(reset)
+
+    def exhaust(self, reset_at=None):
+        """429 を受け取った場合に、リセット時刻まで枠を使い切った状態にする"""
+        with self._lock:
+            self.remaining = 0
+            if reset_at is not None:
+                self.reset_at = reset_at
+
+    def snapshot(self):
+        with self._lock:
+            return {"remaining": self.remaining, "reset_at": self.reset_at}
+
+
+class DataCollector:
+    def __init__(self, bearer_token=None, search_url=None, max_retries=5, backoff_seconds=1.0,
+                 max_concurrent_queries=4, timeout=30):
+        self.bearer_token = bearer_token or TWITTER_BEARER_TOKEN
+        self.search_url = search_url or TWITTER_SEARCH_URL
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_concurrent_queries = max_concurrent_queries
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter()
+
+        # コネクションを使い回すためにセッションを共有する
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_concurrent_queries, pool_maxsize=max_concurrent_queries)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {self.bearer_token}"
+        self.session.headers["User-Agent"] = "v2RecentSearchPython"
+
+    def _request_page(self, params):
+        """1ページ分のレスポンス (JSON) を取得する。レート制限とサーバーエラーはバックオフしてリトライする"""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            try:
+                response = self.session.get(self.search_url, params=params, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                API_REQUESTS.inc(status="error")
+                logger.warning(f"Twitter API request failed (attempt {attempt + 1}): {e}")
+                time.sleep(self.backoff_seconds * (2 ** attempt))
+                continue
+
+            API_REQUESTS.inc(status=response.status_code)
+            self.rate_limiter.update(response.headers)
+            if response.status_code == 429:
+                reset = response.headers.get("x-rate-limit-reset")
+                reset_at = float(reset) if reset else time.time() + self.backoff_seconds * (2 ** attempt)
+                logger.warning(f"Twitter API rate limited, retrying after {max(reset_at - time.time(), 0):.1f}s")
+                self.rate_limiter.exhaust(reset_at)
+                continue
+            if response.status_code >= 500:
+                logger.warning(f"Twitter API server error {response.status_code} (attempt {attempt + 1})")
+                time.sleep(self.backoff_seconds * (2 ** attempt))
+                continue
+            if response.status_code >= 400:
+                # 認証エラーやクエリ不正はリトライしても解決しない
+                raise DataCollectionError(f"Twitter API error {response.status_code}: {response.text[:200]}")
+            try:
+                return response.json()
+            except ValueError as e:
+                raise DataCollectionError(f"Error decoding JSON response: {e}") from e
+        raise DataCollectionError(f"Twitter API request failed after {self.max_retries + 1} attempts")
 
-    def _bearer_oauth(self, r):
-        r.headers["Authorization"] = f"Bearer {self.bearer_token}"
-        r.headers["User-Agent"] = "v2RecentSearchPython"
-        return r
+    @staticmethod
+    def _to_tweet(tweet_data):
+        return {
+            'id': tweet_data['id'],
+            'text': tweet_data['text'],
+            'created_at': tweet_data.get('created_at'),
+            'author_id': tweet_data.get('author_id'),
+            'source_url': f"https://twitter.com/{tweet_data.get('author_id')}/status/{tweet_data['id']}"
+            # 必要に応じて他の情報も追加
+        }
 
-    def search_tweets(self, keyword, max_results=100):
+    def _iter_page_data(self, keyword, max_results=100, since_id=None, until_id=None):
+        """
+        next_token をたどって最大 max_results 件まで、1ページ分のレスポンスの data を返すジェネレーター。
+        since_id / until_id を指定した場合は、その間 (両端を含まない) の ID のツイートだけを新しい順に取得する。
+        """
         params = {
             'query': f'{keyword} lang:ja -is:retweet', # 日本語、リツイート除外
-            'max_results': max_results,
             'tweet.fields': 'created_at,text,author_id,id,public_metrics,source' # 取得したい情報
         }
-        try:
-            response = requests.get(self.search_url, auth=self._bearer_oauth, params=params)
-            response.raise_for_status() # エラーがあれば例外を発生させる
-            json_response = response.json()
-            
-            tweets = []
-            if 'data' in json_response:
-                for tweet_data in json_response['data']:
-                    tweets.append({
-                        'id': tweet_data['id'],
-                        'text': tweet_data['text'],
-                        'created_at': tweet_data['created_at'],
-                        'author_id': tweet_data['author_id'],
-                        'source_url': f"https://twitter.com/{tweet_data['author_id']}/status/{tweet_data['id']}"
-                        # 必要に応じて他の情報も追加
-                    })
-            return tweets
-        except requests.exceptions.RequestException as e:
-            print(f"Error during Twitter API request: {e}")
-            print(f"Response content: {response.content if 'response' in locals() else 'N/A'}") # エラー時のレスポンス内容を確認
-            return []
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON response: {e}")
-            print(f"Response content: {response.content if 'response' in locals() else 'N/A'}")
-            return []
+        if since_id:
+            params['since_id'] = since_id
+        if until_id:
+            params['until_id'] = until_id
+
+        collected = 0
+        next_token = None
+        while collected < max_results:
+            params['max_results'] = min(max(max_results - collected, MIN_PAGE_SIZE), MAX_PAGE_SIZE)
+            if next_token:
+                params['next_token'] = next_token
+            json_response = self._request_page(params)
+
+            data = json_response.get('data', [])[:max_results - collected]
+            if data:
+                collected += len(data)
+                yield data
+            next_token = json_response.get('meta', {}).get('next_token')
+            if not next_token:
+                break
+
+    def iter_pages(self, keyword, max_results=100, since_id=None, until_id=None):
+        """next_token をたどって最大 max_results 件まで、1ページ (ツイートのリスト) ずつ返すジェネレーター"""
+        for data in self._iter_page_data(keyword, max_results=max_results, since_id=since_id, until_id=until_id):
+            yield [self._to_tweet(tweet_data) for tweet_data in data]
+
+    def iter_batches(self, keyword, max_results=100, since_id=None, until_id=None):
+        """iter_pages と同じだが、1ページ分を TweetBatch (列指向) で返す"""
+        for data in self._iter_page_data(keyword, max_results=max_results, since_id=since_id, until_id=until_id):
+            yield TweetBatch.from_api(data)
+
+    def iter_tweets(self, keyword, max_results=100, since_id=None):
+        """ツイートを1件ずつ返すジェネレーター (最初のページを受け取った時点から処理を始められる)"""
+        for page in self.iter_pages(keyword, max_results=max_results, since_id=since_id):
+            yield from page
+
+    def search_tweets(self, keyword, max_results=100, since_id=None):
+        return list(self.iter_tweets(keyword, max_results=max_results, since_id=since_id))
+
+    def iter_many(self, keywords, max_results=100, since_ids=None, as_batches=False):
+        """
+        複数クエリを共有のレート枠で並行に取得し、(keyword, page) を到着順に返すジェネレーター。
+        as_batches=True の場合、page は TweetBatch になる。
+        いずれかのクエリが失敗した場合は、取得済みのページを返した後に例外を送出する。
+        """
+        since_ids = since_ids or {}
+        iter_pages = self.iter_batches if as_batches else self.iter_pages
+        results = queue.Queue()
+        done = object()
+
+        def fetch(keyword):
+            try:
+                for page in iter_pages(keyword, max_results=max_results, since_id=since_ids.get(keyword)):
+                    results.put((keyword, page))
+            except Exception as e:
+                results.put((keyword, e))
+            finally:
+                results.put((keyword, done))
+
+        unique_keywords = list(dict.fromkeys(keywords))
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrent_queries, len(unique_keywords) or 1)) as pool:
+            for keyword in unique_keywords:
+                pool.submit(fetch, keyword)
+            finished = 0
+            while finished < len(unique_keywords):
+                keyword, item = results.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    logger.error(f"Error collecting tweets for '{keyword}': {item}")
+                    errors.append(item)
+                else:
+                    yield keyword, item
+        if errors:
+            raise errors[0]
+
+    def search_many(self, keywords, max_results=100, since_ids=None):
+        """複数クエリを並行に取得し、{keyword: [tweet, ...]} を返す"""
+        tweets_by_keyword = {keyword: [] for keyword in keywords}
+        for keyword, page in self.iter_many(keywords, max_results=max_results, since_ids=since_ids):
+            tweets_by_keyword[keyword].extend(page)
+        return tweets_by_keyword
 
 # テスト用
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     collector = DataCollector()
     keyword_to_search = "AIエージェント 雇用"
-    tweets_data = collector.search_tweets(keyword_to_search, max_results=10)
-    if tweets_data:
-        for tweet in tweets_data:
+    try:
+        for tweet in collector.iter_tweets(keyword_to_search, max_results=10):
             print(f"ID: {tweet['id']}, Text: {tweet['text'][:50]}..., URL: {tweet['source_url']}")
-    else:
-        print("No tweets found or error occurred.")
\ No newline at end of file
+    except DataCollectionError as e:
+        print(f"Error occurred: {e}")
+    print(f"Rate limit: {collector.rate_limiter.snapshot()}")
@@ -0,0 +1,85 @@
+# app/events.py
+import json
+import threading
+import time
+
+# これらのイベントを受け取った時点でストリームを終了する
+TERMINAL_EVENTS = ("completed", "failed")
+
+
+def format_sse(event, data):
+    """Server-Sent Events 形式の1メッセージを組み立てる"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _TaskChannel:
+    def __init__(self):
+        self.events = []
+        self.cond = threading.Condition()
+        self.finished_at = None
+
+
+class TaskEventBroker:
+    """
+    分析タスクの進捗イベントをプロセス内で配信するブローカー。
+    イベントは履歴として保持するので、途中から購読したクライアントにも最初から再送される。
+    終了したタスクの履歴は retention_seconds 経過後に削除する。
+    """
+
+    def __init__(self, retention_seconds=600):
+        self.retention_seconds = retention_seconds
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def _channel(self, task_id, create=True):
+        with self._lock:
+            channel = self._channels.get(task_id)
+            if channel is None and create:
+                channel = self._channels[task_id] = _TaskChannel()
+            return channel
+
+    def has_task(self, task_id):
+        with self._lock:
+            return task_id in self._channels
+
+    def publish(self, task_id, event, data=None):
+        channel = self._channel(task_id)
+        with channel.cond:
+            channel.events.append((event, data or {}))
+            if event in TERMINAL_EVENTS:
+                channel.finished_at = time.time()
+            channel.cond.notify_all()
+        if event in TERMINAL_EVENTS:
+            self._purge()
+
+    def subscribe(self, task_id, heartbeat_seconds=15):
+        """
+        (event, data) を順に返すジェネレーター。
+        heartbeat_seconds の間イベントがなければ (None, None) を返す (接続維持用)。
+        終了イベントを返した後にジェネレーターは終了する。
+        """
+        channel = self._channel(task_id)
+        index = 0
+        while True:
+            with channel.cond:
+                if index >= len(channel.events):
+                    channel.cond.wait(heartbeat_seconds)
+                pending = channel.events[index:]
+                index += len(pending)
+            if not pending:
+                yield None, None
+                continue
+            for event, data in pending:
+                yield event, data
+                if event in TERMINAL_EVENTS:
+                    return
+
+    def _purge(self):
+        threshold = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [
+                task_id for task_id, channel in self._channels.items()
+                if channel.finished_at is not None and channel.finished_at < threshold
+            ]
+            for task_id in expired:
+                del self._channels[task_id]
@@ -0,0 +1,170 @@
+# app/inference_worker.py
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.analyzer import AnalyzerWrapper
+
+logger = logging.getLogger(__name__)
+
+# キュー停止用の番兵
+_STOP = object()
+
+
+class InferenceWorkerStoppedError(RuntimeError):
+    """停止した (または異常終了した) 推論ワーカーにテキストを渡した場合に、Future に設定される"""
+
+
+class InferenceWorker(AnalyzerWrapper):
+    """
+    感情分析モデルを専有する単一の推論ワーカー。
+    全ての分析タスクからテキストをキューで受け取り、
+    max_batch_size 件たまるか max_wait_ms 経過した時点でまとめて推論する。
+    呼び出し側には Future を返すので、複数タスクのテキストが同じバッチで処理される。
+    analyze_batch / analyze_sentiment は最大 result_timeout 秒だけ結果を待つ (None の場合は無制限)。
+    """
+
+    def __init__(self, analyzer, max_batch_size=64, max_wait_ms=20, num_threads=0,
+                 batch_size=None, max_tokens_per_batch=None, result_timeout=None):
+        super().__init__(analyzer)
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.num_threads = num_threads
+        self.result_timeout = result_timeout
+        # analyzer.analyze_batch に渡すバッチ設定 (None の場合は analyzer のデフォルト)
+        self.batch_kwargs = {}
+        if batch_size:
+            self.batch_kwargs['batch_size'] = batch_size
+        if max_tokens_per_batch:
+            self.batch_kwargs['max_tokens_per_batch'] = max_tokens_per_batch
+
+        self._queue = queue.Queue()
+        self._thread = None
+        # 起動・停止とキューへの投入を直列化する (停止後に投入されたテキストが取り残されないように)
+        self._start_lock = threading.Lock()
+        self._stopped = False
+
+    def start(self):
+        with self._start_lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._stopped or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        キューに入っているテキストを処理してからワーカーを停止する。
+        停止後に投入されたテキストと、timeout までに処理されなかったテキストの Future は失敗させる。
+        """
+        with self._start_lock:
+            self._stopped = True
+            if self._thread and self._thread.is_alive():
+                self._queue.put(_STOP)
+        if self._thread:
+            self._thread.join(timeout)
+        self._fail_pending()
+
+    def pending(self):
+        """キューで推論待ちのテキスト数"""
+        return self._queue.qsize()
+
+    def submit(self, text):
+        """テキスト1件を推論キューに入れ、結果 ({'label', 'score'}) を返す Future を返す"""
+        return self.submit_many([text])[0]
+
+    def submit_many(self, texts):
+        futures = [Future() for _ in texts]
+        with self._start_lock:
+            if self._stopped:
+                error = InferenceWorkerStoppedError("Inference worker has been stopped")
+                for future in futures:
+                    future.set_exception(error)
+                return futures
+            self._start_locked()
+            for text, future in zip(texts, futures):
+                self._queue.put((text, future))
+        return futures
+
+    def analyze_batch(self, texts, **kwargs):
+        """
+        SentimentAnalyzer.analyze_batch と同じ形式で結果を返す (完了までブロックする)。
+        バッチサイズはワーカー側の設定で決まるため、kwargs は無視される。
+        result_timeout 秒以内に全件の結果がそろわない場合は concurrent.futures.TimeoutError を送出する。
+        """
+        futures = self.submit_many(texts)
+        if self.result_timeout is None:
+            return [future.result() for future in futures]
+        deadline = time.monotonic() + self.result_timeout
+        return [future.result(timeout=max(deadline - time.monotonic(), 0)) for future in futures]
+
+    def analyze_sentiment(self, text):
+        return self.analyze_batch([text])[0]
+
+    def _fail_pending(self):
+        """キューに残っているテキストの Future を失敗させる (推論中のバッチはそのまま完了させる)"""
+        error = InferenceWorkerStoppedError("Inference worker stopped before the text was analyzed")
+        stop_requested = False
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop_requested = True
+            elif not item[1].done():
+                item[1].set_exception(error)
+        if stop_requested:
+            # 推論中のワーカーが現在のバッチの後に停止できるよう、番兵は戻しておく
+            self._queue.put(_STOP)
+
+    def _collect_batch(self, first_item):
+        """最初の1件を受け取った後、件数上限か待ち時間上限に達するまで追加で取り出す"""
+        batch = [first_item]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # 停止要求は現在のバッチを処理した後に反映する
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        if self.num_threads:
+            # プロセス内で推論するのはこのスレッドだけなので、torch のスレッド数を固定して過剰な並列を防ぐ
+            import torch
+            torch.set_num_threads(self.num_threads)
+        logger.info(f"Inference worker started (max_batch_size={self.max_batch_size}, max_wait_ms={self.max_wait_ms})")
+
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = self._collect_batch(item)
+                texts = [text for text, _ in batch]
+                try:
+                    results = self.analyzer.analyze_batch(texts, **self.batch_kwargs)
+                    for (_, future), result in zip(batch, results):
+                        future.set_result(result)
+                except Exception as e:
+                    logger.error(f"Error in inference worker for batch of {len(batch)} texts: {e}", exc_info=True)
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            # 異常終了した場合も、待っている呼び出し側をブロックしたままにしない
+            with self._start_lock:
+                self._stopped = True
+            self._fail_pending()
+        logger.info("Inference worker stopped")
@@ -1,128 +1,592 @@
 # app/main.py
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
+import logging
+import os
 import time
-import threading # 非同期処理のため
+
+import numpy as np
 
 # プロジェクトルートからの相対パスでモジュールをインポート
 from app.data_collector import DataCollector
-from app.preprocessor import Preprocessor
-from app.analyzer import SentimentAnalyzer
-from app.reporter import ReportGenerator
-# pandasをインポート (reporter.pyで使っているため)
-import pandas as pd 
+from app.tweet_batch import TweetBatch, object_array
+from app.preprocessor import Preprocessor, NearDuplicateGrouper
+from app.reporter import ReportGenerator, REPORTS_KEY
+from app.charts import ChartRenderer
+from app.cache import SentimentCache, CachedSentimentAnalyzer
+from app.task_executor import TaskExecutor, TaskQueueFullError, new_task_id
+from app.task_store import create_task_store
+from app.events import TaskEventBroker, format_sse, TERMINAL_EVENTS
+from app.monitor import KeywordMonitor
+from app.model_loader import (
+    BackgroundModelLoader, STATE_LOADING, load_sentiment_model, load_inference_worker, process_memory,
+)
+from app.model_server import ModelServerClient
+from app.cascade import CascadeSentimentAnalyzer, load_first_stage_model
+from app import metrics
+from config import (
+    MODEL_LOADING_RETRY_AFTER_SECONDS,
+    MODEL_SERVING_MODE, MODEL_SERVER_SOCKET, MODEL_SERVER_STARTUP_TIMEOUT_SECONDS,
+    CASCADE_ENABLED, CASCADE_MODEL_PATH, CASCADE_THRESHOLD, CASCADE_AUDIT_RATE,
+    SENTIMENT_CACHE_ENABLED, SENTIMENT_CACHE_PATH, SENTIMENT_CACHE_MEMORY_SIZE,
+    SENTIMENT_CACHE_MAX_ROWS, SENTIMENT_CACHE_MAX_AGE_SECONDS,
+    TASK_MAX_WORKERS, TASK_MAX_PENDING, TASK_MAX_CONCURRENT_COLLECT,
+    TASK_MAX_CONCURRENT_INFERENCE, TASK_RETRY_AFTER_SECONDS,
+    TASK_STORE_BACKEND, TASK_STORE_PATH, TASK_TTL_SECONDS, TASK_MAX_STORED,
+    STREAM_PROGRESS_CHUNK_SIZE, STREAM_HEARTBEAT_SECONDS,
+    COLLECT_MAX_RESULTS, COLLECT_MAX_CONCURRENT_QUERIES, COLLECT_MAX_RETRIES, ANALYZE_BATCH_MAX_KEYWORDS,
+    MONITOR_DB_PATH, MONITOR_RETENTION_SECONDS, MONITOR_MAX_RESULTS,
+    NEAR_DUPLICATE_ENABLED, NEAR_DUPLICATE_THRESHOLD,
+    TOKENIZE_ENABLED, TOKENIZE_PROCESSES,
+    CHART_FORMAT, CHART_RENDER_PROCESSES,
+    TREND_INTERVAL, TREND_MAX_BUCKETS,
+    TASK_PROFILING_ENABLED,
+)
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
 # 各モジュールのインスタンス化 (アプリケーション起動時に一度だけ行う)
 # これらはスレッドセーフではない場合があるので、リクエスト毎に生成するか、
 # スレッドセーフな設計にするか、Gunicorn等のWSGIサーバーでプロセス数を調整する
 # ここでは簡略化のためグローバルに持つが、大規模アプリでは注意
-data_collector = DataCollector()
-preprocessor = Preprocessor()
-sentiment_analyzer = SentimentAnalyzer() # モデルのロードに時間がかかる
-report_generator = ReportGenerator()
-
-# 処理状況を格納する辞書 (デモ用、本番ではDBやキャッシュストアを使う)
-analysis_status = {}
-analysis_results = {}
-
-def process_analysis(task_id, keyword):
-    """実際の分析処理を行う関数 (バックグラウンドスレッドで実行)"""
-    analysis_status[task_id] = "processing"
-    try:
-        print(f"Task {task_id}: Starting analysis for '{keyword}'")
-        # 1. データ収集
-        raw_tweets = data_collector.search_tweets(keyword, max_results=50) # max_resultsは調整
-        if not raw_tweets:
-            analysis_results[task_id] = "該当するツイートは見つかりませんでした。"
-            analysis_status[task_id] = "completed"
-            return
-        
-        # 2. 前処理
-        processed_tweets_for_analysis = []
-        cleaned_texts_for_sentiment = []
-        for tweet_data in raw_tweets:
-            processed_data = preprocessor.preprocess_tweet(tweet_data)
-            if processed_data.get('cleaned_text'):
-                cleaned_texts_for_sentiment.append(processed_data['cleaned_text'])
-            processed_tweets_for_analysis.append(processed_data) # 元のデータも保持
-
-        # 感情分析 (バッチ処理)
-        sentiment_results = []
-        if cleaned_texts_for_sentiment:
-            # pipelineにテキストのリストを渡す
-            # モデルやpipelineの実装によっては、バッチサイズを指定できる場合がある
-            # (例: sentiment_pipeline(cleaned_texts_for_sentiment, batch_size=8))
-            sentiment_pipeline_results = sentiment_analyzer.sentiment_pipeline(
-                cleaned_texts_for_sentiment, truncation=True, max_length=512
+# セッションとレート枠は全タスクで共有する
+data_collector = DataCollector(
+    max_retries=COLLECT_MAX_RETRIES,
+    max_concurrent_queries=COLLECT_MAX_CONCURRENT_QUERIES,
+)
+preprocessor = Preprocessor(tokenize_processes=TOKENIZE_PROCESSES or None)
+# 近似重複のグループ化 (有効な場合は代表テキストだけを感情分析する)
+near_duplicate_grouper = NearDuplicateGrouper(threshold=NEAR_DUPLICATE_THRESHOLD) if NEAR_DUPLICATE_ENABLED else None
+# 感情分析結果のキャッシュ (モデルのロード完了を待たずに統計を参照できるよう先に作る)
+sentiment_cache = SentimentCache(
+    db_path=SENTIMENT_CACHE_PATH,
+    memory_size=SENTIMENT_CACHE_MEMORY_SIZE,
+    max_rows=SENTIMENT_CACHE_MAX_ROWS,
+    max_age_seconds=SENTIMENT_CACHE_MAX_AGE_SECONDS,
+) if SENTIMENT_CACHE_ENABLED else None
+
+
+# 複数ワーカープロセスでのモデルの持ち方 (config.MODEL_SERVING_MODE)
+if MODEL_SERVING_MODE == "preload":
+    # gunicorn --preload では fork 前のこの時点で重みを一度だけロードし、全ワーカーで共有する (copy-on-write)
+    # 推論 (ウォームアップ) やスレッドの起動は fork 後に各ワーカーで行う
+    preloaded_sentiment_model = load_sentiment_model()
+elif MODEL_SERVING_MODE not in ("local", "server"):
+    raise ValueError(f"Unknown MODEL_SERVING_MODE '{MODEL_SERVING_MODE}'. Choose from local / preload / server")
+
+
+def load_sentiment_analyzer():
+    """
+    感情分析モデルをロードしてウォームアップし、推論ワーカー (+キャッシュ) で包んで返す。
+    server モードではモデルサーバーの起動を待ち、そのクライアントを使う。
+    バックグラウンドスレッドで実行する。ロードに失敗した場合は例外を送出する。
+    """
+    if MODEL_SERVING_MODE == "server":
+        analyzer = ModelServerClient(MODEL_SERVER_SOCKET).wait_until_ready(MODEL_SERVER_STARTUP_TIMEOUT_SECONDS)
+    elif MODEL_SERVING_MODE == "preload":
+        analyzer = load_inference_worker(preloaded_sentiment_model)
+    else:
+        analyzer = load_inference_worker()
+    if sentiment_cache is not None:
+        # 同じ(または正規化後に同一の)テキストはキャッシュから返し、ミスしたものだけ推論する
+        analyzer = CachedSentimentAnalyzer(analyzer, sentiment_cache)
+    if CASCADE_ENABLED:
+        # 1段目の分類器で確信度の高いテキストを判定し、残りだけをキャッシュ/BERT に回す
+        # (キャッシュには BERT の結果だけが保存される)
+        if os.path.exists(CASCADE_MODEL_PATH):
+            analyzer = CascadeSentimentAnalyzer(
+                analyzer, load_first_stage_model(CASCADE_MODEL_PATH),
+                threshold=CASCADE_THRESHOLD, audit_rate=CASCADE_AUDIT_RATE,
+            )
+        else:
+            logger.warning(f"Cascade model '{CASCADE_MODEL_PATH}' not found. Running without the cascade.")
+    return analyzer
+
+
+# モデルのロード中もヘルスチェックや画面表示には応答し、/readyz で準備完了を通知する
+model_loader = BackgroundModelLoader(load_sentiment_analyzer)
+if MODEL_SERVING_MODE == "preload":
+    # スレッドは fork で引き継がれないため、ワーカープロセスの起動後に開始する
+    os.register_at_fork(after_in_child=model_loader.start)
+else:
+    model_loader.start()
+# グラフは専用のプロセスで描画し、同じ集計結果のグラフはキャッシュから返す
+report_generator = ReportGenerator(
+    chart_renderer=ChartRenderer(CHART_FORMAT, processes=CHART_RENDER_PROCESSES),
+    trend_interval=TREND_INTERVAL or None,
+    trend_max_buckets=TREND_MAX_BUCKETS,
+)
+
+# 分析タスクは上限付きのワーカープールで実行する (リクエストごとにスレッドを立てない)
+# 収集と推論はステージごとに同時実行数を制限する
+task_executor = TaskExecutor(
+    max_workers=TASK_MAX_WORKERS,
+    max_pending=TASK_MAX_PENDING,
+    stage_limits={
+        'collect': TASK_MAX_CONCURRENT_COLLECT,
+        'inference': TASK_MAX_CONCURRENT_INFERENCE,
+    },
+)
+
+# 処理状況と結果はタスクストアに保存する (TTL と最大件数で古いタスクは削除される)
+# SQLite バックエンドなら複数の gunicorn ワーカー間で共有できる
+task_store = create_task_store(
+    TASK_STORE_BACKEND,
+    db_path=TASK_STORE_PATH,
+    ttl_seconds=TASK_TTL_SECONDS,
+    max_tasks=TASK_MAX_STORED,
+)
+
+# キーワード監視モード用のチェックポイントと集計
+keyword_monitor = KeywordMonitor(
+    MONITOR_DB_PATH,
+    retention_seconds=MONITOR_RETENTION_SECONDS or None,
+    trend_interval=TREND_INTERVAL or None,
+)
+
+# レポートに載せるラベルごとの例の件数 (generate_report のデフォルトと同じ)
+REPORT_EXAMPLES_PER_LABEL = {"ポジティブ": 5, "ネガティブ": 5, "ニュートラル": 3}
+
+# 分析の進捗イベント (SSE で /stream/<task_id> に配信する)
+task_events = TaskEventBroker()
+
+
+def inference_queue_depth():
+    """推論ワーカーのキューで待っているテキスト数 (キャッシュ・カスケードの内側のワーカーを探す)"""
+    analyzer = model_loader.get() if model_loader.is_ready else None
+    while analyzer is not None and not hasattr(analyzer, "pending"):
+        analyzer = getattr(analyzer, "analyzer", None)
+    return analyzer.pending() if analyzer is not None else None
+
+
+# 既に各コンポーネントが数えている値は /metrics の取得時に読み出す
+metrics.REGISTRY.gauge("social_listening_active_tasks", "Analysis tasks currently running",
+                       function=lambda: task_executor.stats()["running"])
+metrics.REGISTRY.gauge("social_listening_pending_tasks", "Analysis tasks waiting for a worker",
+                       function=lambda: task_executor.stats()["pending"])
+metrics.REGISTRY.gauge("social_listening_inference_queue_depth", "Texts waiting in the inference worker queue",
+                       function=inference_queue_depth)
+metrics.REGISTRY.gauge("social_listening_api_rate_limit_remaining", "Remaining Twitter API requests in the window",
+                       function=lambda: data_collector.rate_limiter.snapshot()["remaining"])
+metrics.REGISTRY.gauge("social_listening_model_ready", "1 when the sentiment model is loaded and warmed up",
+                       function=lambda: int(model_loader.is_ready))
+if sentiment_cache is not None:
+    metrics.REGISTRY.counter(
+        "social_listening_sentiment_cache_lookups_total", "Sentiment cache lookups by result", ("result",),
+        function=lambda: {
+            (result,): sentiment_cache.stats()[key]
+            for result, key in (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))
+        },
+    )
+    metrics.REGISTRY.gauge("social_listening_sentiment_cache_hit_rate", "Sentiment cache hit rate since start",
+                           function=lambda: sentiment_cache.stats()["hit_rate"])
+
+
+def add_chart_urls(data, task_id, task):
+    """
+    保存されているグラフの URL を追加する (円グラフは chart_url、推移のグラフは trend_chart_url)。
+    複数キーワードの結果では、比較のグラフを comparison_chart_url に、キーワードごとのグラフを
+    result["reports"] の各レポートに追加する (保存されている結果自体は書き換えない)。
+    """
+    charts = task.get("charts", ())
+    if task["has_chart"]:
+        data["chart_url"] = f"/chart/{task_id}"
+    if "trend" in charts:
+        data["trend_chart_url"] = f"/chart/{task_id}?name=trend"
+    if "comparison" in charts:
+        data["comparison_chart_url"] = f"/chart/{task_id}?name=comparison"
+    result = data.get("result")
+    if isinstance(result, dict) and isinstance(result.get(REPORTS_KEY), list):
+        reports = []
+        for i, report in enumerate(result[REPORTS_KEY]):
+            report = dict(report)
+            if f"pie-{i}" in charts:
+                report["chart_url"] = f"/chart/{task_id}?name=pie-{i}"
+            if f"trend-{i}" in charts:
+                report["trend_chart_url"] = f"/chart/{task_id}?name=trend-{i}"
+            reports.append(report)
+        data["result"] = {**result, REPORTS_KEY: reports}
+    return data
+
+
+def finish_task(task_id, status, result):
+    """結果をタスクストアに保存し、終了イベントを1回だけ配信する (グラフは chart_url で参照させる)"""
+    task_store.set_result(task_id, status, result)
+    task = task_store.get(task_id) or {"result": result, "has_chart": False}
+    data = {"task_id": task_id, "status": status, "result": task["result"]}
+    task_events.publish(task_id, status, add_chart_urls(data, task_id, task))
+
+
+def collect_and_analyze(task_id, keyword, since_id=None, until_id=None, max_results=None):
+    """
+    ツイートを収集・前処理・感情分析し、感情分析の結果の列を埋めた TweetBatch を返す
+    (max_results を省略した場合は COLLECT_MAX_RESULTS 件まで収集する)
+    """
+    # 1. データ収集 + 2. 前処理
+    # ページ単位 (列指向の TweetBatch) で受け取り、最初のページが届いた時点から前処理を始める
+    pages = []
+    collected = 0
+    with task_executor.stage('collect'):
+        page_batches = data_collector.iter_batches(
+            keyword, max_results=max_results or COLLECT_MAX_RESULTS, since_id=since_id, until_id=until_id,
+        )
+        for page in metrics.timed_iter('collect', page_batches):
+            with metrics.span('clean', len(page)):
+                pages.append(preprocessor.preprocess_tweet_batch(page))
+            collected += len(page)
+            task_events.publish(task_id, "collected", {"count": collected})
+    tweets = TweetBatch.concat(pages)
+    if not len(tweets):
+        task_events.publish(task_id, "collected", {"count": 0})
+        return tweets
+    return analyze_collected(task_id, tweets)
+
+
+def collect_many(task_id, keywords):
+    """
+    複数キーワードの検索を共有のレート枠で並行に実行し、ツイート ID で統合する。
+    複数のキーワードで取得されたツイートも前処理は1回だけ行う。
+    (重複を除いた TweetBatch, {keyword: TweetBatch 内の位置の配列}, {keyword: 取得件数}) を返す
+    """
+    pages = []
+    position_of = {} # ツイート ID -> 統合後の TweetBatch 内の位置
+    members = {keyword: [] for keyword in keywords}
+    fetched = dict.fromkeys(keywords, 0)
+    with task_executor.stage('collect'):
+        page_batches = data_collector.iter_many(keywords, max_results=COLLECT_MAX_RESULTS, as_batches=True)
+        for keyword, page in metrics.timed_iter('collect', page_batches, count=lambda item: len(item[1])):
+            fetched[keyword] += len(page)
+            new_rows = []
+            for row, tweet_id in enumerate(page.ids):
+                position = position_of.get(tweet_id)
+                if position is None:
+                    position = position_of[tweet_id] = len(position_of)
+                    new_rows.append(row)
+                members[keyword].append(position)
+            if new_rows:
+                # 既に他のキーワードで取得済みのツイートは取り除いてから前処理する
+                new_tweets = page if len(new_rows) == len(page) else page[np.asarray(new_rows)]
+                with metrics.span('clean', len(new_tweets)):
+                    pages.append(preprocessor.preprocess_tweet_batch(new_tweets))
+            task_events.publish(task_id, "collected", {
+                "count": len(position_of), "fetched": sum(fetched.values()), "keyword": keyword,
+            })
+    if not position_of:
+        task_events.publish(task_id, "collected", {"count": 0, "fetched": 0})
+    members = {keyword: np.unique(np.asarray(positions, dtype=np.intp)) for keyword, positions in members.items()}
+    return TweetBatch.concat(pages), members, fetched
+
+
+def analyze_collected(task_id, tweets):
+    """前処理済みの TweetBatch を感情分析し (近似重複はグループの代表だけを推論する)、結果の列を埋めて返す"""
+    if not len(tweets):
+        return tweets
+    empty = tweets.cleaned_texts == ""
+    tweets.set_sentiment(empty, 'ニュートラル', 0.0, note='Empty after cleaning')
+    to_score = np.flatnonzero(~empty)
+    cleaned_texts_for_sentiment = tweets.cleaned_texts[to_score]
+
+    # 近似重複 (コピペや bot の投稿) はグループの代表だけを感情分析し、結果をグループ全体に配る
+    if near_duplicate_grouper:
+        with metrics.span('dedup', len(cleaned_texts_for_sentiment)):
+            representative_of = np.asarray(near_duplicate_grouper.group(cleaned_texts_for_sentiment.tolist()),
+                                           dtype=np.intp)
+    else:
+        representative_of = np.arange(len(cleaned_texts_for_sentiment))
+    # representatives: 代表の位置 (昇順)、group_of: 各ツイートの代表が representatives の何番目か
+    representatives, group_of, group_sizes = np.unique(representative_of, return_inverse=True, return_counts=True)
+    # 代表だけを取り出した TweetBatch (推論結果はここに書き込み、最後にグループ全体へ写す)
+    unique_tweets = tweets[to_score[representatives]]
+
+    # 話題の語を集計するための形態素解析 (代表テキストだけを解析し、件数が多い場合はプロセスプールで並列に処理される)
+    if TOKENIZE_ENABLED:
+        with metrics.span('tokenize', len(unique_tweets)):
+            token_lists = preprocessor.tokenize_batch(unique_tweets.cleaned_texts.tolist())
+        tweets.set_tokens(object_array(token_lists)[group_of], index=to_score)
+    task_events.publish(task_id, "preprocessed", {
+        "count": len(cleaned_texts_for_sentiment),
+        "unique": len(unique_tweets),
+    })
+
+    # 感情分析 (バッチ処理)
+    # トークン長の近いテキスト同士をまとめて推論し、結果は入力順で返る
+    # 推論ワーカー経由のため、同時に実行中の他タスクのテキストと同じバッチで処理される
+    # 代表の TweetBatch のビュー (コピーなし) をチャンクごとに推論し、途中集計を配信する
+    running_counts = tweets.label_counts()
+    analyzed_count = 0
+    for start, chunk in zip(range(0, len(unique_tweets), STREAM_PROGRESS_CHUNK_SIZE),
+                            unique_tweets.iter_slices(STREAM_PROGRESS_CHUNK_SIZE)):
+        # 推論待ち (ステージの上限・ワーカーのキュー) も含めた時間を記録する
+        with task_executor.stage('inference'), metrics.span('inference', len(chunk)):
+            chunk.set_sentiments(model_loader.get().analyze_batch(chunk.cleaned_texts.tolist()))
+        sizes = group_sizes[start:start + len(chunk)]
+        for label, count in chunk.label_counts(weights=sizes).items():
+            running_counts[label] = running_counts.get(label, 0) + count
+        analyzed_count += int(sizes.sum())
+        task_events.publish(task_id, "progress", {
+            "analyzed": analyzed_count,
+            "total": len(cleaned_texts_for_sentiment),
+            "positive": running_counts.get("ポジティブ", 0),
+            "negative": running_counts.get("ネガティブ", 0),
+            "neutral": running_counts.get("ニュートラル", 0),
+        })
+
+    tweets.copy_sentiments(unique_tweets, group_of, index=to_score)
+    return tweets
+
+
+def run_task(task_id, description, body, profile=False):
+    """
+    分析タスクの共通の流れ (TaskExecutor のワーカースレッドで実行)。
+    状態を processing にして body() を実行し、その戻り値 (失敗した場合はエラーメッセージ) を結果として保存し、
+    終了イベントを配信する。
+    profile=True (または TASK_PROFILING_ENABLED) の場合は、段階ごとの処理時間の内訳を結果の "profile" に含める
+    """
+    task_store.set_status(task_id, "processing")
+    task_events.publish(task_id, "processing", {"task_id": task_id})
+    with metrics.profiling(profile or TASK_PROFILING_ENABLED) as task_profile:
+        try:
+            logger.info(f"Task {task_id}: Starting {description}")
+            status, result = "completed", body()
+            logger.info(f"Task {task_id}: Completed {description}")
+        except Exception as e:
+            logger.error(f"Task {task_id}: Error during {description}: {e}", exc_info=True)
+            status, result = "failed", f"分析中にエラーが発生しました: {e}"
+
+        if task_profile is not None:
+            breakdown = task_profile.to_dict()
+            logger.debug(f"Task {task_id}: Timing breakdown {breakdown}")
+            if isinstance(result, dict):
+                result["profile"] = breakdown
+    metrics.TASKS.inc(status=status)
+    finish_task(task_id, status, result)
+
+
+def process_analysis(task_id, keyword, incremental=False, profile=False):
+    """
+    1つのキーワードを分析する (/analyze)。
+    incremental=True の場合は、前回のチェックポイント以降の新しいツイートだけを分析して
+    保存済みの集計にマージし、集計全体からレポートを再構築する (監視モード)
+    """
+    def analyze():
+        if incremental:
+            # 前回以降の新しいツイートを (取得しきれなかった範囲があればその範囲を) 上限までたどって取得する
+            since_id, until_id = keyword_monitor.get_window(keyword)
+            analyzed_tweets = collect_and_analyze(
+                task_id, keyword, since_id=since_id, until_id=until_id, max_results=MONITOR_MAX_RESULTS,
             )
-            # sentiment_pipeline_results の形式を確認して、元のツイートデータと結合する
-            # sentiment_analyzer.analyze_sentiment を少し変更して、リストを受け付けるようにするのも手
-            # ここでは簡易的に、1件ずつ呼び出す形に戻すが、上記を参考に改良できる
-            idx = 0
-            for p_tweet in processed_tweets_for_analysis:
-                if p_tweet.get('cleaned_text'):
-                    # sentiment_pipeline_results から対応する結果を取得
-                    # analyze_sentiment を少し改修して、pipelineの直接結果を整形する形にしても良い
-                    current_sentiment_result = sentiment_analyzer.map_pipeline_result(sentiment_pipeline_results[idx])
-                    p_tweet['sentiment'] = current_sentiment_result
-                    idx += 1
-                else:
-                    p_tweet['sentiment'] = {'label': 'ニュートラル', 'score': 0.0, 'note': 'Empty after cleaning'}
-        analyzed_tweets = processed_tweets_for_analysis
-
-        
+        else:
+            analyzed_tweets = collect_and_analyze(task_id, keyword)
 
         # 3. レポート生成
-        report = report_generator.generate_report(keyword, analyzed_tweets)
-        analysis_results[task_id] = report
-        analysis_status[task_id] = "completed"
-        print(f"Task {task_id}: Analysis completed for '{keyword}'")
+        if sentiment_cache is not None:
+            logger.debug(f"Task {task_id}: Sentiment cache stats {sentiment_cache.stats()}")
+        analyzer = model_loader.get()
+        if isinstance(analyzer, CascadeSentimentAnalyzer):
+            logger.debug(f"Task {task_id}: Cascade routing stats {analyzer.stats()}")
+
+        if incremental:
+            with metrics.span('aggregate', len(analyzed_tweets)):
+                # 上限まで取得した場合は、それより古いツイートが残っている可能性がある
+                added = keyword_monitor.record(
+                    keyword, analyzed_tweets.to_dicts(), complete=len(analyzed_tweets) < MONITOR_MAX_RESULTS,
+                )
+                snapshot = keyword_monitor.snapshot(keyword, examples_per_label=REPORT_EXAMPLES_PER_LABEL)
+            logger.debug(f"Task {task_id}: Merged {added} new tweets into monitoring aggregates (since_id={since_id})")
+            return report_generator.render_report(
+                keyword, snapshot['counts'], snapshot['examples'], trend=snapshot['trend'],
+            )
+        if not analyzed_tweets:
+            return "該当するツイートは見つかりませんでした。"
+        return report_generator.generate_report(keyword, analyzed_tweets)
 
-    except Exception as e:
-        print(f"Task {task_id}: Error during analysis for '{keyword}': {e}")
-        analysis_results[task_id] = f"分析中にエラーが発生しました: {e}"
-        analysis_status[task_id] = "failed"
+    run_task(task_id, f"{'incremental ' if incremental else ''}analysis for '{keyword}'", analyze, profile)
+
+
+def process_batch_analysis(task_id, keywords, profile=False):
+    """
+    複数キーワードをまとめて分析する (/analyze_batch)。
+    収集は共有のレート枠で並行に行い、ツイート ID で統合してから前処理・感情分析を1回だけ行うので、
+    処理量はキーワードごとの件数の合計ではなく、重複を除いたツイート数に比例する。
+    結果はキーワードごとのレポート ("reports") と、キーワード間の比較 ("comparison")。
+    """
+    def analyze():
+        tweets, members, fetched = collect_many(task_id, keywords)
+        logger.debug(f"Task {task_id}: Collected {sum(fetched.values())} tweets ({len(tweets)} unique)")
+        tweets = analyze_collected(task_id, tweets)
+        return report_generator.generate_comparison_report(tweets, members, fetched=fetched)
+
+    run_task(task_id, f"batch analysis for {keywords}", analyze, profile)
 
 
 @app.route('/', methods=['GET'])
 def index():
     return render_template('index.html') # 簡単な入力フォームを表示
 
+def submit_task(function, *args):
+    """
+    分析タスクを受け付けて (レスポンス, ステータスコード) を返す。
+    モデルの準備ができていない場合と、待ち行列が満杯の場合は 503 + Retry-After を返す。
+    """
+    # モデルの準備ができるまでは受け付けない (ロード中なら Retry-After を返す)
+    if not model_loader.is_ready:
+        loader_status = model_loader.status()
+        response = jsonify({"error": "感情分析モデルの準備ができていません。", **loader_status})
+        if loader_status["status"] == STATE_LOADING:
+            response.headers['Retry-After'] = str(MODEL_LOADING_RETRY_AFTER_SECONDS)
+        return response, 503
+
+    task_id = new_task_id() # 衝突しないタスクIDを生成
+    task_store.create(task_id, "pending")
+    task_events.publish(task_id, "pending", {"task_id": task_id})
+
+    # ワーカープールで重い処理を実行 (待ち行列が満杯なら 503 + Retry-After を返す)
+    try:
+        task_executor.submit(task_id, function, task_id, *args)
+    except TaskQueueFullError:
+        task_store.delete(task_id)
+        task_events.publish(task_id, "failed", {"task_id": task_id, "status": "rejected"})
+        response = jsonify({"error": "現在混み合っています。しばらくしてから再度お試しください。"})
+        response.headers['Retry-After'] = str(TASK_RETRY_AFTER_SECONDS)
+        return response, 503
+
+    return jsonify({"message": "分析リクエストを受け付けました。", "task_id": task_id}), 202
+
+
 @app.route('/analyze', methods=['POST'])
 def analyze_keyword_async():
     data = request.json
     keyword = data.get('keyword')
+    # incremental=true の場合は監視モード (前回以降の新しいツイートだけを分析して集計にマージ)
+    incremental = bool(data.get('incremental'))
+    # profile=true の場合は、段階ごとの処理時間の内訳を結果に含める
+    profile = bool(data.get('profile'))
     if not keyword:
         return jsonify({"error": "キーワードが指定されていません"}), 400
+    return submit_task(process_analysis, keyword, incremental, profile)
 
-    task_id = str(int(time.time() * 1000)) # ユニークなタスクIDを生成
-    analysis_status[task_id] = "pending"
-    analysis_results[task_id] = None
 
-    # バックグラウンドスレッドで重い処理を実行
-    thread = threading.Thread(target=process_analysis, args=(task_id, keyword))
-    thread.start()
-    
-    return jsonify({"message": "分析リクエストを受け付けました。", "task_id": task_id}), 202
+@app.route('/analyze_batch', methods=['POST'])
+def analyze_keywords_async():
+    """複数キーワードをまとめて分析し、キーワードごとのレポートと比較を返すタスクを受け付ける"""
+    data = request.json or {}
+    keywords = data.get('keywords')
+    profile = bool(data.get('profile'))
+    if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
+        return jsonify({"error": "keywords にはキーワードのリストを指定してください"}), 400
+    # 前後の空白を除き、重複したキーワードは1つにまとめる (指定された順序は保つ)
+    keywords = list(dict.fromkeys(keyword.strip() for keyword in keywords if keyword.strip()))
+    if not keywords:
+        return jsonify({"error": "キーワードが指定されていません"}), 400
+    if len(keywords) > ANALYZE_BATCH_MAX_KEYWORDS:
+        return jsonify({"error": f"キーワードは{ANALYZE_BATCH_MAX_KEYWORDS}個まで指定できます"}), 400
+    return submit_task(process_batch_analysis, keywords, profile)
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """プロセスが応答できるか (liveness)。モデルのロード状態には依存しない"""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """モデルのロードとウォームアップが完了し、分析を受け付けられるか (readiness)"""
+    loader_status = model_loader.status()
+    # ワーカーごとのメモリ使用量 (モデルの共有方式の比較用)。server モードではモデルサーバーの値も返す
+    loader_status["serving_mode"] = MODEL_SERVING_MODE
+    loader_status["memory"] = process_memory()
+    if model_loader.is_ready and MODEL_SERVING_MODE == "server":
+        try:
+            loader_status["model_server"] = ModelServerClient(MODEL_SERVER_SOCKET, timeout=5).status()
+        except (ConnectionError, OSError, RuntimeError) as e:
+            return jsonify({**loader_status, "status": "failed", "error": f"Model server unavailable: {e}"}), 503
+    return jsonify(loader_status), (200 if model_loader.is_ready else 503)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """処理段階ごとの時間・件数、推論のバッチ、キュー、API の利用枠、キャッシュのメトリクス (Prometheus 形式)"""
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    if sentiment_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **sentiment_cache.stats()})
+
+
+@app.route('/cascade/stats', methods=['GET'])
+def get_cascade_stats():
+    """カスケードの段ごとの処理件数と、抽出確認での BERT との一致率 (しきい値の調整用)"""
+    analyzer = model_loader.get() if model_loader.is_ready else None
+    if not isinstance(analyzer, CascadeSentimentAnalyzer):
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **analyzer.stats()})
 
 
 @app.route('/status/<task_id>', methods=['GET'])
 def get_status(task_id):
-    status = analysis_status.get(task_id)
-    if not status:
+    # グラフ画像は ?include_chart=1 の場合のみ読み込む (通常は /chart/<task_id> で取得)
+    include_chart = request.args.get('include_chart') == '1'
+    task = task_store.get(task_id, include_chart=include_chart)
+    if not task:
         return jsonify({"error": "タスクが見つかりません"}), 404
-    
-    result = None
+
+    status = task["status"]
+    response = {"task_id": task_id, "status": status, "result": None}
     if status == "completed" or status == "failed":
-        result = analysis_results.get(task_id)
-        # メモリリークを防ぐため、取得後は削除する（本番ではDBなどで永続化）
-        # del analysis_status[task_id]
-        # del analysis_results[task_id]
+        response["result"] = task["result"]
+        add_chart_urls(response, task_id, task)
+    if status == "pending":
+        response["queue_position"] = task_executor.queue_position(task_id)
+    return jsonify(response)
+
+
+@app.route('/stream/<task_id>', methods=['GET'])
+def stream_status(task_id):
+    """分析の進捗を Server-Sent Events で配信する (最終結果は終了イベントで1回だけ送る)"""
+    if not task_events.has_task(task_id) and not task_store.get_status(task_id):
+        return jsonify({"error": "タスクが見つかりません"}), 404
+
+    def generate():
+        if task_events.has_task(task_id):
+            for event, data in task_events.subscribe(task_id, heartbeat_seconds=STREAM_HEARTBEAT_SECONDS):
+                # イベントがない間はコメント行を送って接続を維持する
+                yield ": keep-alive\n\n" if event is None else format_sse(event, data)
+            return
+        # 別のワーカープロセスで実行中のタスクは、ストアを定期的に確認して終了時に結果を送る
+        while True:
+            task = task_store.get(task_id)
+            if not task:
+                yield format_sse("failed", {"task_id": task_id, "status": "failed", "result": "タスクが見つかりません"})
+                return
+            if task["status"] in TERMINAL_EVENTS:
+                data = {"task_id": task_id, "status": task["status"], "result": task["result"]}
+                yield format_sse(task["status"], add_chart_urls(data, task_id, task))
+                return
+            yield format_sse(task["status"], {"task_id": task_id})
+            time.sleep(STREAM_HEARTBEAT_SECONDS)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # nginx 等でのバッファリングを無効化
+    return response
+
 
-    return jsonify({"task_id": task_id, "status": status, "result": result})
+@app.route('/chart/<task_id>', methods=['GET'])
+def get_chart(task_id):
+    # ?name=trend で推移のグラフを返す (省略時は円グラフ)
+    chart = task_store.get_chart(task_id, request.args.get('name', 'pie'))
+    if not chart:
+        return jsonify({"error": "グラフが見つかりません"}), 404
+    mime, data = chart
+    return Response(data, mimetype=mime)
 
 
 if __name__ == '__main__':
     # 開発用サーバーの起動。本番環境ではGunicornなどを使用
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    model_loader.start() # preload モードでは fork しないので、ここでロードを開始する
     app.run(debug=True, host='0.0.0.0', port=5001) # portは適宜変更
\ No newline at end of file
@@ -0,0 +1,288 @@
+# app/metrics.py
+"""
+処理のメトリクス (カウンター・ゲージ・ヒストグラム) と段階ごとの計測スパン。
+
+/metrics で Prometheus のテキスト形式 (0.0.4) で公開する。記録はロックを取って値を足すだけなので、
+推論のバッチごとなどホットパスで呼んでも負荷は小さい。キューの長さやキャッシュのヒット数のように
+既に別の場所で数えている値は、記録せずに公開時に関数を呼んで読み出す (function を指定したメトリクス)。
+値はプロセスごとに持つため、複数の gunicorn ワーカーではワーカーごとに集計される。
+
+span で計測した時間は、profiling() の中であればタスクごとの内訳 (TaskProfile) にも記録される。
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 処理時間のヒストグラムの境界 (秒)
+DEFAULT_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 推論のバッチサイズのヒストグラムの境界 (件)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+# パディングの割合 (パディングのトークン数 / バッチ全体のトークン数) のヒストグラムの境界
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1.0)
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 公開時に値を読み出す関数 (数値、またはラベルの値 (のタプル) -> 数値 の辞書を返す)
+        self.function = function
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _collected_values(self):
+        if self.function is None:
+            with self._lock:
+                return dict(self._values)
+        value = self.function()
+        if not isinstance(value, dict):
+            return {(): value}
+        return {key if isinstance(key, tuple) else (key,): item for key, item in value.items()}
+
+    def samples(self):
+        """(サフィックス, [(ラベル名, 値)], 値) のリスト"""
+        return [
+            ("", list(zip(self.labelnames, key)), value)
+            for key, value in sorted(self._collected_values().items())
+            if value is not None
+        ]
+
+
+class Counter(_Metric):
+    """単調増加する値 (処理件数・リクエスト数など)"""
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """増減する値 (実行中のタスク数・キューの長さなど)"""
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """値の分布 (処理時間・バッチサイズなど)。境界ごとの累積件数と合計を持つ"""
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # 境界ごとの件数 (最後は +Inf) と合計
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                samples.append(("_bucket", labels + [("le", _format_value(float(bound)))], cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function=function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function=function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_SECONDS_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render(self):
+        """Prometheus のテキスト形式で全メトリクスを返す"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # 読み出し用の関数が失敗しても、他のメトリクスは返す
+                lines.append(f"# {metric.name} unavailable: {_escape(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# アプリケーション全体で使うレジストリと、処理段階で記録するメトリクス
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "social_listening_stage_seconds", "Time spent in each processing stage", ("stage",))
+STAGE_ITEMS = REGISTRY.counter(
+    "social_listening_stage_items_total", "Items (tweets or texts) processed by each stage", ("stage",))
+INFERENCE_BATCH_SIZE = REGISTRY.histogram(
+    "social_listening_inference_batch_size", "Texts per model forward pass", buckets=BATCH_SIZE_BUCKETS)
+INFERENCE_PADDING_RATIO = REGISTRY.histogram(
+    "social_listening_inference_padding_ratio", "Share of padding tokens in each model forward pass",
+    buckets=RATIO_BUCKETS)
+TASKS = REGISTRY.counter(
+    "social_listening_tasks_total", "Finished analysis tasks by status", ("status",))
+API_REQUESTS = REGISTRY.counter(
+    "social_listening_api_requests_total", "Twitter API requests by HTTP status (error = connection failure)",
+    ("status",))
+
+
+class TaskProfile:
+    """1タスク分の段階ごとの処理時間の内訳"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, items=None):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0, "items": 0})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["items"] += items or 0
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "total_seconds": round(time.perf_counter() - self.started, 4),
+                "stages": {
+                    stage: {**entry, "seconds": round(entry["seconds"], 4)}
+                    for stage, entry in self.stages.items()
+                },
+            }
+
+
+# 実行中のタスクのプロファイル (profiling() の中だけ設定される)
+_current_profile = ContextVar("task_profile", default=None)
+
+
+@contextmanager
+def profiling(enabled=True):
+    """
+    with の中で記録したスパンを TaskProfile に集める (enabled=False の場合は None を返し、何もしない)。
+    同じスレッド (コンテキスト) で実行したスパンだけが対象で、推論ワーカーのスレッドの処理は含まれない。
+    """
+    if not enabled:
+        yield None
+        return
+    profile = TaskProfile()
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+
+
+def record_span(stage, seconds, items=None):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if items:
+        STAGE_ITEMS.inc(items, stage=stage)
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.add(stage, seconds, items)
+
+
+@contextmanager
+def span(stage, items=None):
+    """with の中の処理時間を stage の処理時間として記録する (items は処理した件数)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start, items)
+
+
+def timed_iter(stage, iterable, count=None):
+    """
+    iterable から要素を取り出すのにかかった時間を stage の処理時間として記録しながら要素を返す。
+    ページを返すジェネレーターの場合、ページの取得時間だけが計測され、呼び出し側の処理時間は含まれない。
+    count は要素から件数を求める関数 (省略時は len(要素)、長さのない要素は1件)。
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if count is not None:
+            items = count(item)
+        else:
+            items = len(item) if hasattr(item, "__len__") else 1
+        record_span(stage, time.perf_counter() - start, items)
+        yield item
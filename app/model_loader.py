@@ -0,0 +1,149 @@
+# app/model_loader.py
+import logging
+import os
+import threading
+import time
+
+from config import (
+    SENTIMENT_MODEL_NAME, SENTIMENT_BACKEND, SENTIMENT_MODEL_CACHE_DIR, MODEL_WARMUP_ENABLED,
+    SENTIMENT_BATCH_SIZE, SENTIMENT_MAX_TOKENS_PER_BATCH,
+    INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_NUM_THREADS, INFERENCE_RESULT_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# ロード状態
+STATE_LOADING = "loading"
+STATE_READY = "ready"
+STATE_FAILED = "failed"
+
+
+class ModelNotReadyError(Exception):
+    """モデルのロード (ウォームアップ) が完了していない、または失敗している"""
+
+
+class BackgroundModelLoader:
+    """
+    モデルのロードとウォームアップをバックグラウンドスレッドで行う。
+    load_fn は推論に使うオブジェクトを返す関数で、失敗した場合は例外を送出すること。
+    ロードが終わるまでの間もアプリは起動してリクエスト (ヘルスチェック等) を受け付けられる。
+    """
+
+    def __init__(self, load_fn, name="model-loader"):
+        self.load_fn = load_fn
+        self.name = name
+        self.state = STATE_LOADING
+        self.error = None
+        self._value = None
+        self._started_at = None
+        self._finished_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            value = self.load_fn()
+        except Exception as e:
+            logger.error(f"Model loading failed: {e}", exc_info=True)
+            with self._lock:
+                self.state = STATE_FAILED
+                self.error = str(e)
+        else:
+            with self._lock:
+                self._value = value
+                self.state = STATE_READY
+        finally:
+            self._finished_at = time.monotonic()
+            self._done.set()
+        if self.state == STATE_READY:
+            logger.info(f"Model ready in {self._finished_at - self._started_at:.1f}s")
+
+    @property
+    def is_ready(self):
+        return self.state == STATE_READY
+
+    def wait(self, timeout=None):
+        """ロードの完了 (成功・失敗どちらでも) を待つ。完了していれば True を返す"""
+        return self._done.wait(timeout)
+
+    def get(self):
+        """ロード済みのオブジェクトを返す。準備ができていない場合は ModelNotReadyError"""
+        if self.state != STATE_READY:
+            raise ModelNotReadyError(self.error or "Model is still loading")
+        return self._value
+
+    def status(self):
+        with self._lock:
+            status = {"status": self.state}
+            if self.error:
+                status["error"] = self.error
+            if self._started_at is not None:
+                end = self._finished_at if self._finished_at is not None else time.monotonic()
+                status["elapsed_seconds"] = round(end - self._started_at, 1)
+            return status
+
+
+def load_sentiment_model():
+    """
+    設定に従って感情分析モデルをロードする (ウォームアップはしない)。
+    モデルのロードに時間がかかる (量子化バックエンドは初回のみ作成し、以降はディスクから読み込む)。
+    ロードに失敗した場合は RuntimeError を送出する。
+    """
+    from app.analyzer import SentimentAnalyzer, MODEL_NAME
+    analyzer = SentimentAnalyzer(SENTIMENT_MODEL_NAME or MODEL_NAME, backend=SENTIMENT_BACKEND,
+                                 model_cache_dir=SENTIMENT_MODEL_CACHE_DIR)
+    if not analyzer.is_loaded:
+        raise RuntimeError(f"Failed to load sentiment model '{analyzer.model_name}': {analyzer.load_error}")
+    return analyzer
+
+
+def load_inference_worker(analyzer=None):
+    """
+    モデルをウォームアップし、推論ワーカーで包んで返す (analyzer を省略した場合はここでロードする)。
+    モデルは推論ワーカーが専有し、全タスクのテキストをキュー経由でまとめてバッチ推論する。
+    """
+    from app.inference_worker import InferenceWorker
+    analyzer = analyzer or load_sentiment_model()
+    if MODEL_WARMUP_ENABLED:
+        analyzer.warm_up(batch_size=SENTIMENT_BATCH_SIZE)
+    worker = InferenceWorker(
+        analyzer,
+        max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+        max_wait_ms=INFERENCE_MAX_WAIT_MS,
+        num_threads=INFERENCE_NUM_THREADS,
+        batch_size=SENTIMENT_BATCH_SIZE,
+        max_tokens_per_batch=SENTIMENT_MAX_TOKENS_PER_BATCH,
+        result_timeout=INFERENCE_RESULT_TIMEOUT_SECONDS or None,
+    )
+    worker.start()
+    return worker
+
+
+def process_memory():
+    """
+    このプロセスのメモリ使用量を返す (Linux の /proc から読めない場合は pid のみ)。
+    rss_bytes は共有ページも含むため、fork 後に共有しているモデルの重みは各ワーカーに重複して数えられる。
+    pss_bytes は共有ページをプロセス数で按分した値で、ワーカーごとの実質的な使用量の比較に使う。
+    """
+    memory = {"pid": os.getpid()}
+    fields = {"Rss:": "rss_bytes", "Pss:": "pss_bytes", "Shared_Clean:": "shared_clean_bytes",
+              "Shared_Dirty:": "shared_dirty_bytes", "Private_Clean:": "private_clean_bytes",
+              "Private_Dirty:": "private_dirty_bytes"}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] in fields:
+                    memory[fields[parts[0]]] = int(parts[1]) * 1024 # kB 単位
+    except OSError:
+        pass
+    return memory
@@ -0,0 +1,202 @@
+# app/model_server.py
+"""
+感情分析モデルを1プロセスだけでロードし、同じホストの Flask ワーカーに Unix ソケットで推論を提供するサーバー。
+
+使い方:
+    python -m app.model_server --socket data/model_server.sock
+    MODEL_SERVING_MODE=server gunicorn -w 4 app.main:app
+
+各 Flask ワーカーはモデルをロードせず ModelServerClient 経由で推論するため、
+ワーカー数を増やしてもモデルの重みは1つ分しかメモリに載らない。
+サーバー内では InferenceWorker が全ワーカーからのテキストをまとめてバッチ推論する。
+
+プロトコル: 4バイト (ビッグエンディアン) の長さ + UTF-8 の JSON を1メッセージとし、1接続で複数回やり取りする。
+    {"op": "analyze", "texts": [...]} -> {"results": [...]}
+    {"op": "status"} -> {"status": "ready", "model_name": ..., "backend": ..., "memory": {...}}
+エラーの場合は {"error": "..."} を返す。
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from types import SimpleNamespace
+
+from app.analyzer import AnalyzerWrapper
+from app.model_loader import load_inference_worker, process_memory
+from config import MODEL_SERVER_SOCKET, MODEL_SERVER_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct(">I")
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Connection closed by peer")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_message(sock, message):
+    payload = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(payload)) + payload)
+
+
+def recv_message(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size).decode("utf-8"))
+
+
+class _ModelRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        analyzer = self.server.analyzer
+        while True:
+            try:
+                request = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                op = request.get("op")
+                if op == "analyze":
+                    response = {"results": analyzer.analyze_batch(request.get("texts") or [])}
+                elif op == "status":
+                    response = {
+                        "status": "ready",
+                        "model_name": analyzer.model_name,
+                        "backend": analyzer.backend,
+                        "pending": analyzer.pending(),
+                        "memory": process_memory(),
+                    }
+                else:
+                    response = {"error": f"Unknown op '{op}'"}
+            except Exception as e:
+                logger.error(f"Error handling model server request: {e}", exc_info=True)
+                response = {"error": str(e)}
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """接続ごとにスレッドで応答し、推論は共有の InferenceWorker にまとめる"""
+    daemon_threads = True
+
+    def __init__(self, socket_path, analyzer):
+        self.analyzer = analyzer
+        socket_dir = os.path.dirname(socket_path)
+        if socket_dir:
+            os.makedirs(socket_dir, exist_ok=True)
+        # 前回のプロセスが残したソケットファイルを削除してから bind する
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _ModelRequestHandler)
+
+
+class ModelServerClient(AnalyzerWrapper):
+    """
+    モデルサーバーに推論を依頼するクライアント。SentimentAnalyzer と同じ analyze_batch / analyze_sentiment を持つ。
+    接続はスレッドごとに1本保持し、切断されていた場合は1回だけ再接続してやり直す。
+    model_name / backend はサーバーでロードされているモデルのもの (wait_until_ready で取得する)。
+    """
+
+    def __init__(self, socket_path=MODEL_SERVER_SOCKET, timeout=MODEL_SERVER_TIMEOUT_SECONDS):
+        super().__init__(SimpleNamespace(model_name=None, backend=None, sentiment_pipeline=None))
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _call(self, request):
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                send_message(sock, request)
+                response = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+        if "error" in response:
+            raise RuntimeError(f"Model server error: {response['error']}")
+        return response
+
+    def status(self):
+        return self._call({"op": "status"})
+
+    def wait_until_ready(self, timeout, interval=1.0):
+        """モデルサーバーが起動して応答するまで待ち、自身を返す (タイムアウトした場合は TimeoutError)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                status = self.status()
+            except (ConnectionError, OSError) as e:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Model server at '{self.socket_path}' is not available: {e}")
+                time.sleep(interval)
+                continue
+            self.analyzer.model_name = status["model_name"]
+            self.analyzer.backend = status["backend"]
+            return self
+
+    def analyze_batch(self, texts, **kwargs):
+        """バッチサイズはサーバー側の設定で決まるため、kwargs は無視される"""
+        if not texts:
+            return []
+        return self._call({"op": "analyze", "texts": list(texts)})["results"]
+
+    def analyze_sentiment(self, text):
+        return self.analyze_batch([text])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="感情分析モデルを Unix ソケットで提供するサーバー")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # モデルのロードとウォームアップが終わってから bind するので、接続できた時点で推論を受け付けられる
+    analyzer = load_inference_worker()
+    server = ModelServer(args.socket, analyzer)
+    logger.info(f"Model server listening on {args.socket} (pid={os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        analyzer.stop()
+
+
+if __name__ == '__main__':
+    main()
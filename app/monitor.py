@@ -0,0 +1,296 @@
+# app/monitor.py
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+
+from app.trends import SentimentTrend
+
+logger = logging.getLogger(__name__)
+
+# 集計対象のラベル (ERROR 等は集計に含めない)
+AGGREGATED_LABELS = ("ポジティブ", "ネガティブ", "ニュートラル")
+
+
+def advance_checkpoint(since_id, until_id, high_id, scored_ids, failed_ids, complete):
+    """
+    1回の取得・分析の結果から、新しいチェックポイント (since_id, until_id, high_id) を求める。
+    - since_id: これ以下の ID のツイートはすべて取り込み済み
+    - until_id / high_id: since_id より新しいが、[until_id, high_id] の範囲は取り込み済み
+      (間の (since_id, until_id) は取得しきれていない。ない場合は None)
+    今回は (since_id, until_id) の範囲を新しい順に取得している。complete=False (件数の上限で打ち切った) の場合は
+    取得したうち最も古いツイートより前が未取得。感情分析に失敗したツイート (failed_ids) は取り込んでいないので、
+    次回もう一度取得されるよう、チェックポイントはそれを越えて進めない。
+    """
+    scored = sorted(int(tweet_id) for tweet_id in scored_ids)
+    failed = sorted(int(tweet_id) for tweet_id in failed_ids)
+    since = int(since_id) if since_id else None
+    until = int(until_id) if until_id else None
+    high = int(high_id) if high_id else None
+
+    # 上側: 最も新しい失敗より新しいツイートは、すべて取り込み済みの範囲につながる
+    upper = [tweet_id for tweet_id in scored if not failed or tweet_id > failed[-1]]
+    if upper:
+        new_until = upper[0]
+        new_high = high if until is not None else upper[-1]
+    else:
+        new_until, new_high = until, high
+
+    if complete and not failed:
+        # 範囲をすべて取り込めたので、取得しきれていない範囲はなくなる
+        newest = new_high if new_high is not None else since
+        return (str(newest) if newest is not None else None), None, None
+    if complete:
+        # 最も古い失敗の直前までは取り込み済み
+        lower = [tweet_id for tweet_id in scored if tweet_id < failed[0]]
+        if lower:
+            since = lower[-1]
+    return (
+        str(since) if since is not None else None,
+        str(new_until) if new_until is not None else None,
+        str(new_high) if new_high is not None else None,
+    )
+
+
+class KeywordMonitor:
+    """
+    キーワードの継続監視用ストア (SQLite)。
+    - キーワードごとの since_id チェックポイント
+    - ツイートごとの感情分析結果
+    - ラベルごとの件数・スコア合計 (ローリング集計)
+    を保持し、毎回の実行では新しいツイートだけを分析して集計にマージする。
+    retention_seconds を指定すると、それより古いツイートは集計から差し引いて削除する。
+    trend_interval を指定すると、時間帯ごとの件数・スコア合計 (SentimentTrend) も同様に足し込んで保持する。
+    """
+
+    def __init__(self, db_path, retention_seconds=None, trend_interval=None):
+        self.db_path = db_path
+        self.retention_seconds = retention_seconds
+        self.trend_interval = trend_interval
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS monitor_checkpoints ("
+                " keyword TEXT PRIMARY KEY,"
+                " since_id TEXT,"
+                " updated_at REAL NOT NULL)"
+            )
+            # 以前のバージョンで作ったテーブルには、取得しきれなかった範囲の列がないので追加する
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(monitor_checkpoints)")}
+            for column in ("until_id", "high_id"):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE monitor_checkpoints ADD COLUMN {column} TEXT")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS monitor_tweets ("
+                " keyword TEXT NOT NULL,"
+                " tweet_id TEXT NOT NULL,"
+                " created_at TEXT,"
+                " cleaned_text TEXT,"
+                " source_url TEXT,"
+                " label TEXT NOT NULL,"
+                " score REAL NOT NULL,"
+                " recorded_at REAL NOT NULL,"
+                " PRIMARY KEY (keyword, tweet_id))"
+            )
+            # ラベルごとのスコア上位の例を索引で取り出せるようにする
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_monitor_tweets_label_score"
+                " ON monitor_tweets (keyword, label, score DESC)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_monitor_tweets_created ON monitor_tweets (keyword, created_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS monitor_aggregates ("
+                " keyword TEXT NOT NULL,"
+                " label TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " score_sum REAL NOT NULL,"
+                " PRIMARY KEY (keyword, label))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS monitor_trend ("
+                " keyword TEXT NOT NULL,"
+                " interval TEXT NOT NULL,"
+                " bucket TEXT NOT NULL,"
+                " label TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " score_sum REAL NOT NULL,"
+                " PRIMARY KEY (keyword, interval, bucket, label))"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # 接続は都度作成し、使い終わったら閉じる (sqlite3 の接続の with はコミットするだけで閉じない)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn: # 正常終了時はコミット、例外時はロールバック
+                yield conn
+        finally:
+            conn.close()
+
+    def get_checkpoint(self, keyword):
+        """前回までに取り込んだ最新のツイートID (since_id) を返す。未実行の場合は None"""
+        return self.get_window(keyword)[0]
+
+    def get_window(self, keyword):
+        """
+        次回取得する範囲 (since_id, until_id) を返す。
+        前回までに取得しきれなかった範囲がある場合は until_id (これより古いツイート) も返すので、
+        その範囲を埋めてから新しいツイートの取得に進む。
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT since_id, until_id FROM monitor_checkpoints WHERE keyword = ?", (keyword,)
+            ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def record(self, keyword, analyzed_tweets, complete=True):
+        """
+        新しく分析したツイートを保存し、集計にマージしてチェックポイントを進める (1トランザクション)。
+        analyzed_tweets は get_window の範囲を取得したもの。件数の上限で取得を打ち切った場合は complete=False を
+        指定する (取得しきれなかった古い範囲を次回取得する)。
+        感情分析に失敗したツイート (ERROR など) は取り込まず、次回もう一度取得されるようにする。
+        既に保存済みのツイートは重複して数えない。新規に取り込んだ件数を返す。
+        """
+        now = time.time()
+        added = 0
+        scored_ids = []
+        failed_ids = []
+        deltas = {}
+        added_tweets = []
+        with self._connect() as conn:
+            for tweet in analyzed_tweets:
+                tweet_id = str(tweet['id'])
+                sentiment = tweet.get('sentiment') or {}
+                label = sentiment.get('label')
+                if label not in AGGREGATED_LABELS:
+                    failed_ids.append(tweet_id)
+                    continue
+                scored_ids.append(tweet_id)
+                score = float(sentiment.get('score', 0.0))
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO monitor_tweets"
+                    " (keyword, tweet_id, created_at, cleaned_text, source_url, label, score, recorded_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (keyword, tweet_id, tweet.get('created_at'), tweet.get('cleaned_text'),
+                     tweet.get('source_url'), label, score, now),
+                )
+                if cursor.rowcount:
+                    added += 1
+                    count, score_sum = deltas.get(label, (0, 0.0))
+                    deltas[label] = (count + 1, score_sum + score)
+                    added_tweets.append(tweet)
+
+            self._apply_deltas(conn, keyword, deltas, sign=1)
+            if self.trend_interval and added_tweets:
+                # 新しく取り込んだツイートだけを時間帯ごとに集計して足し込む
+                trend = SentimentTrend(self.trend_interval).update(added_tweets)
+                conn.executemany(
+                    "INSERT INTO monitor_trend (keyword, interval, bucket, label, count, score_sum)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (keyword, interval, bucket, label)"
+                    " DO UPDATE SET count = count + excluded.count, score_sum = score_sum + excluded.score_sum",
+                    [(keyword, self.trend_interval, *row) for row in trend.bucket_rows()],
+                )
+
+            previous = conn.execute(
+                "SELECT since_id, until_id, high_id FROM monitor_checkpoints WHERE keyword = ?", (keyword,)
+            ).fetchone() or (None, None, None)
+            checkpoint = advance_checkpoint(*previous, scored_ids, failed_ids, complete)
+            if failed_ids:
+                logger.warning(f"{len(failed_ids)} tweets for '{keyword}' failed analysis and will be retried")
+            if checkpoint != tuple(previous):
+                conn.execute(
+                    "INSERT OR REPLACE INTO monitor_checkpoints (keyword, since_id, until_id, high_id, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (keyword, *checkpoint, now),
+                )
+
+            if self.retention_seconds:
+                self._prune(conn, keyword)
+        return added
+
+    @staticmethod
+    def _apply_deltas(conn, keyword, deltas, sign):
+        for label, (count, score_sum) in deltas.items():
+            conn.execute(
+                "INSERT INTO monitor_aggregates (keyword, label, count, score_sum) VALUES (?, ?, 0, 0.0)"
+                " ON CONFLICT (keyword, label) DO NOTHING",
+                (keyword, label),
+            )
+            conn.execute(
+                "UPDATE monitor_aggregates SET count = count + ?, score_sum = score_sum + ?"
+                " WHERE keyword = ? AND label = ?",
+                (sign * count, sign * score_sum, keyword, label),
+            )
+
+    def _prune(self, conn, keyword):
+        """保持期間を過ぎたツイートを集計から差し引いて削除する"""
+        threshold = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(time.time() - self.retention_seconds))
+        rows = conn.execute(
+            "SELECT label, COUNT(*), SUM(score) FROM monitor_tweets"
+            " WHERE keyword = ? AND created_at < ? GROUP BY label",
+            (keyword, threshold),
+        ).fetchall()
+        # 時間帯ごとの集計は、開始時刻が保持期間より前の時間帯を丸ごと削除する
+        conn.execute("DELETE FROM monitor_trend WHERE keyword = ? AND bucket < ?", (keyword, threshold))
+        if not rows:
+            return
+        self._apply_deltas(conn, keyword, {label: (count, score_sum) for label, count, score_sum in rows}, sign=-1)
+        conn.execute("DELETE FROM monitor_tweets WHERE keyword = ? AND created_at < ?", (keyword, threshold))
+
+    def snapshot(self, keyword, examples_per_label=None):
+        """
+        保存済みの集計を返す。
+        {'counts': {ラベル: 件数}, 'score_sums': {ラベル: スコア合計}, 'examples': {ラベル: [tweet, ...]},
+         'trend': SentimentTrend または None}
+        examples はスコアの高い順に examples_per_label ({ラベル: 件数}) 件ずつ。
+        """
+        examples_per_label = examples_per_label or {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT label, count, score_sum FROM monitor_aggregates WHERE keyword = ?", (keyword,)
+            ).fetchall()
+            examples = {}
+            for label in AGGREGATED_LABELS:
+                limit = examples_per_label.get(label, 0)
+                examples[label] = [
+                    {
+                        'id': tweet_id,
+                        'created_at': created_at,
+                        'cleaned_text': cleaned_text,
+                        'source_url': source_url,
+                        'sentiment': {'label': label, 'score': score},
+                    }
+                    for tweet_id, created_at, cleaned_text, source_url, score in conn.execute(
+                        "SELECT tweet_id, created_at, cleaned_text, source_url, score FROM monitor_tweets"
+                        " WHERE keyword = ? AND label = ? ORDER BY score DESC LIMIT ?",
+                        (keyword, label, limit),
+                    )
+                ] if limit else []
+            trend = None
+            if self.trend_interval:
+                trend = SentimentTrend.from_bucket_rows(conn.execute(
+                    "SELECT bucket, label, count, score_sum FROM monitor_trend WHERE keyword = ? AND interval = ?",
+                    (keyword, self.trend_interval),
+                ).fetchall(), interval=self.trend_interval)
+        return {
+            'counts': {label: count for label, count, _ in rows if count},
+            'score_sums': {label: score_sum for label, count, score_sum in rows if count},
+            'examples': examples,
+            'trend': trend,
+        }
+
+    def reset(self, keyword):
+        """キーワードのチェックポイントと集計をすべて削除する"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM monitor_checkpoints WHERE keyword = ?", (keyword,))
+            conn.execute("DELETE FROM monitor_tweets WHERE keyword = ?", (keyword,))
+            conn.execute("DELETE FROM monitor_aggregates WHERE keyword = ?", (keyword,))
+            conn.execute("DELETE FROM monitor_trend WHERE keyword = ?", (keyword,))
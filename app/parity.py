@@ -0,0 +1,121 @@
+# app/parity.py
+"""
+量子化バックエンドと fp32 の推論結果を比較するツール。
+
+使い方:
+    python -m app.parity --backend int8 --corpus tweets.txt --limit 500
+
+コーパスは1行1テキストのテキストファイル、または "text" (または "cleaned_text") を含む JSONL。
+ラベルの一致率、スコアの差 (平均・最大)、混同行列、バッチ推論の所要時間を JSON で出力する。
+"""
+import argparse
+import json
+import logging
+import time
+from collections import Counter
+
+from app.analyzer import SentimentAnalyzer, MODEL_NAME, BACKENDS, DEFAULT_BATCH_SIZE
+from config import SENTIMENT_MODEL_CACHE_DIR
+
+# コーパスを指定しない場合のサンプル
+SAMPLE_TEXTS = [
+    "この映画、本当に感動した！素晴らしいストーリーだった。",
+    "今日のランチは最悪だった。味がひどいし、サービスも悪い。",
+    "まあ、悪くはないけど、期待していたほどではなかったな。",
+    "特に何も感じなかった。",
+    "これはペンです。",
+    "AIエージェントのおかげで仕事がかなり楽になった。",
+    "AIに仕事を奪われるのではないかと不安で仕方ない。",
+    "新しいモデルが発表されたらしい。",
+]
+
+
+def load_corpus(path, limit=None):
+    texts = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                line = record.get("cleaned_text") or record.get("text") or ""
+            if line:
+                texts.append(line)
+            if limit and len(texts) >= limit:
+                break
+    return texts
+
+
+def timed_batch(analyzer, texts, batch_size):
+    start = time.perf_counter()
+    results = analyzer.analyze_batch(texts, batch_size=batch_size)
+    return results, time.perf_counter() - start
+
+
+def compare(reference_results, candidate_results):
+    """fp32 (reference) と候補バックエンドの結果を比較した統計を返す"""
+    pairs = [
+        (ref, cand) for ref, cand in zip(reference_results, candidate_results)
+        if ref.get("label") != "ERROR" and cand.get("label") != "ERROR"
+    ]
+    if not pairs:
+        return {"compared": 0}
+    agree = sum(1 for ref, cand in pairs if ref["label"] == cand["label"])
+    # 同じラベルの場合はスコアの差、異なるラベルの場合は確信度の差として扱う
+    drifts = [abs(ref["score"] - cand["score"]) for ref, cand in pairs]
+    confusion = Counter(f"{ref['label']} -> {cand['label']}" for ref, cand in pairs)
+    return {
+        "compared": len(pairs),
+        "label_agreement": round(agree / len(pairs), 4),
+        "score_drift_mean": round(sum(drifts) / len(drifts), 6),
+        "score_drift_max": round(max(drifts), 6),
+        "confusion": dict(confusion),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量子化バックエンドと fp32 の推論結果を比較する")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "fp32"], default="int8")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--corpus", help="1行1テキストのファイル、または JSONL")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--cache-dir", default=SENTIMENT_MODEL_CACHE_DIR)
+    parser.add_argument("--min-agreement", type=float, default=None,
+                        help="ラベル一致率がこの値を下回った場合に終了コード1で終了する")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    texts = load_corpus(args.corpus, args.limit) if args.corpus else SAMPLE_TEXTS
+
+    reference = SentimentAnalyzer(args.model, backend="fp32")
+    candidate = SentimentAnalyzer(args.model, backend=args.backend, model_cache_dir=args.cache_dir)
+    if not reference.is_loaded or not candidate.is_loaded:
+        raise SystemExit("Failed to load one of the models")
+
+    # TorchScript は最初の数回の呼び出しでグラフを最適化するため、計測前に空回しする
+    for analyzer in (reference, candidate):
+        for _ in range(2):
+            analyzer.analyze_batch(texts[:args.batch_size], batch_size=args.batch_size)
+
+    reference_results, reference_seconds = timed_batch(reference, texts, args.batch_size)
+    candidate_results, candidate_seconds = timed_batch(candidate, texts, args.batch_size)
+
+    report = {
+        "model": args.model,
+        "backend": args.backend,
+        "texts": len(texts),
+        "fp32_seconds": round(reference_seconds, 3),
+        f"{args.backend}_seconds": round(candidate_seconds, 3),
+        "speedup": round(reference_seconds / candidate_seconds, 2) if candidate_seconds else None,
+        **compare(reference_results, candidate_results),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.min_agreement is not None and report.get("label_agreement", 0) < args.min_agreement:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+# app/pools.py
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def spawn_pool(max_workers, initializer=None, initargs=()):
+    """
+    spawn で起動するプロセスプールを作る (形態素解析・グラフ描画・一括分析で使う)。
+    torch の推論スレッドやワーカースレッドが動いているプロセスを fork すると、
+    子プロセスにロック状態やスレッドプールが中途半端に引き継がれて固まることがあるため、fork は使わない。
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=initializer,
+        initargs=initargs,
+    )
@@ -1,24 +1,130 @@
 # app/preprocessor.py
+import atexit
+import os
 import re
-from janome.tokenizer import Tokenizer # 例としてJanomeを使用
+import threading
+import unicodedata
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from app.pools import spawn_pool
+from app.tweet_batch import object_array
+
+# 除去対象をまとめた正規表現 (1回の置換で処理するため、モジュール読み込み時に1度だけコンパイルする)
+# - URL
+# - ハッシュタグ (タグ自体は残しても良いが、ここでは#記号とタグ名を消す)
+# - メンション
+# - HTMLタグ (スクレイピングした場合など)
+# - 絵文字 (記号・絵文字ブロック、国旗、異体字セレクタ、ZWJ)
+REMOVAL_PATTERN = re.compile(
+    r'https?://\S+'
+    r'|#\S+'
+    r'|@\S+'
+    r'|<[^>]+>'
+    r'|[\U0001F000-\U0001FAFF\U00002600-\U000027BF\U00002B00-\U00002BFF\U0000FE00-\U0000FE0F\U0000200D\U000020E3]'
+)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 話題抽出で残す品詞 (内容語) と、その中でも除外する細分類
+DEFAULT_KEEP_POS = ('名詞', '動詞', '形容詞')
+EXCLUDED_POS_DETAILS = ('非自立', '代名詞', '数', '接尾')
+# 1文字のひらがな・記号はノイズになりやすいので除外する
+SINGLE_CHAR_NOISE_PATTERN = re.compile(r'[\u3040-\u309F\W]')
+
+# tokenize_batch で、これより少ない件数はプロセスプールを使わずにその場で処理する
+# (1件あたり 1.5〜2ms かかるので、1リクエスト分 (COLLECT_MAX_RESULTS 件程度) でも受け渡しの時間より並列化の効果が大きい)
+PARALLEL_TOKENIZE_MIN_TEXTS = 64
+# プロセスプールに渡すチャンクの最小件数
+MIN_TOKENIZE_CHUNK_SIZE = 16
+
+# ワーカープロセスごとに1つだけ作る形態素解析器 (辞書の読み込みは重いので使い回す)
+_worker_tokenizer = None
+
+
+def _new_tokenizer():
+    # janome は形態素解析を使う時点で import する (app.main の import だけでは読み込まれないようにする)
+    from janome.tokenizer import Tokenizer # 例としてJanomeを使用
+    return Tokenizer()
+
+
+def _init_tokenize_worker():
+    global _worker_tokenizer
+    _worker_tokenizer = _new_tokenizer()
+
+
+def _pos_rules(keep_pos):
+    """
+    品詞 (Token.part_of_speech の文字列) -> 語の扱い を返す関数を作る。
+    扱いは None (除外) / True (表層形を使う: 名詞) / False (基本形にそろえる: 動詞・形容詞)。
+    品詞の種類は限られるので、判定結果を品詞の文字列ごとに覚えておき、トークンごとに split しない。
+    """
+    rules = {}
+
+    def rule(part_of_speech):
+        result = rules.get(part_of_speech, rules)
+        if result is rules:
+            pos = part_of_speech.split(',')
+            excluded = pos[0] not in keep_pos or pos[1] in EXCLUDED_POS_DETAILS
+            result = rules[part_of_speech] = None if excluded else pos[0] == '名詞'
+        return result
+
+    return rule
+
+
+def _tokenize_texts(texts, keep_pos=DEFAULT_KEEP_POS, tokenizer=None):
+    """
+    テキストのリストを形態素解析し、テキストごとの語のリストを返す。
+    keep_pos を指定しない場合は wakati モード (表層形のみ) で高速に分かち書きする。
+    keep_pos を指定した場合は品詞でフィルタし、動詞・形容詞は基本形にそろえる。
+    """
+    tokenizer = tokenizer or _worker_tokenizer or _new_tokenizer()
+    rule = _pos_rules(keep_pos) if keep_pos else None
+    results = []
+    for text in texts:
+        if not text:
+            results.append([])
+        elif rule is None:
+            results.append([surface for surface in tokenizer.tokenize(text, wakati=True) if surface.strip()])
+        else:
+            terms = []
+            # tokenize はジェネレーターなので、トークンのリストは作らずに1つずつ判定する
+            for token in tokenizer.tokenize(text):
+                use_surface = rule(token.part_of_speech)
+                if use_surface is None:
+                    continue
+                term = token.surface if use_surface else token.base_form
+                if len(term) > 1 or not SINGLE_CHAR_NOISE_PATTERN.match(term):
+                    terms.append(term)
+            results.append(terms)
+    return results
+
 
 class Preprocessor:
-    def __init__(self):
-        self.tokenizer = Tokenizer() # 形態素解析器のインスタンス化
+    def __init__(self, tokenize_processes=None):
+        # 形態素解析器は辞書の読み込みが重いので、最初に使う時点でインスタンス化する
+        self._tokenizer = None
+        self._tokenizer_lock = threading.Lock()
+        # 形態素解析用のプロセス数 (None の場合は CPU コア数)
+        self.tokenize_processes = tokenize_processes or os.cpu_count() or 1
+        self._tokenize_pool = None
+        self._tokenize_pool_lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        with self._tokenizer_lock:
+            if self._tokenizer is None:
+                self._tokenizer = _new_tokenizer() # 形態素解析器のインスタンス化
+            return self._tokenizer
 
     def clean_text(self, text):
-        # URLの除去
-        text = re.sub(r'https?://\S+', '', text)
-        # ハッシュタグの除去 (タグ自体は残しても良いが、ここでは#記号とタグ名を消す)
-        text = re.sub(r'#\S+', '', text)
-        # メンションの除去
-        text = re.sub(r'@\S+', '', text)
-        # HTMLタグの除去 (スクレイピングした場合など)
-        text = re.sub(r'<[^>]+>', '', text)
-        # 絵文字の除去 (必要に応じて)
-        # ... (絵文字除去ライブラリや正規表現を使用)
+        # 全角英数字・記号の正規化 (＃ や ＠ も除去対象になるよう先に行う)
+        text = unicodedata.normalize('NFKC', text)
+        # URL・ハッシュタグ・メンション・HTMLタグ・絵文字の除去
+        text = REMOVAL_PATTERN.sub('', text)
         # 空白の正規化
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = WHITESPACE_PATTERN.sub(' ', text).strip()
         return text
 
     def anonymize_user_info(self, tweet_data):
@@ -33,6 +139,51 @@ class Preprocessor:
         tokens = [token.surface for token in self.tokenizer.tokenize(text)]
         return tokens
 
+    def _get_tokenize_pool(self):
+        with self._tokenize_pool_lock:
+            if self._tokenize_pool is None:
+                self._tokenize_pool = spawn_pool(self.tokenize_processes, initializer=_init_tokenize_worker)
+                atexit.register(self._tokenize_pool.shutdown, wait=False)
+            return self._tokenize_pool
+
+    def tokenize_batch(self, texts, keep_pos=DEFAULT_KEEP_POS, chunk_size=None):
+        """
+        複数テキストをまとめて形態素解析し、テキストごとの語のリストを返す。
+        件数が多い場合はテキストをチャンクに分けてプロセスプールで並列に処理する
+        (chunk_size を省略した場合は、全プロセスに行き渡るように件数をプロセス数で分ける)。
+        """
+        if len(texts) < PARALLEL_TOKENIZE_MIN_TEXTS or self.tokenize_processes <= 1:
+            return _tokenize_texts(texts, keep_pos=keep_pos, tokenizer=self.tokenizer)
+        pool = self._get_tokenize_pool()
+        chunk_size = chunk_size or max(MIN_TOKENIZE_CHUNK_SIZE, -(-len(texts) // self.tokenize_processes))
+        chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        results = []
+        for chunk_result in pool.map(_tokenize_texts, chunks, [keep_pos] * len(chunks)):
+            results.extend(chunk_result)
+        return results
+
+    def preprocess_batch(self, tweets):
+        """
+        収集したツイートの辞書をまとめて前処理する。
+        辞書はコピーせずにその場で cleaned_text の追加と匿名化を行うので、
+        呼び出し側が所有している辞書 (DataCollector の出力など) にだけ使うこと。
+        """
+        for tweet in tweets:
+            tweet['cleaned_text'] = self.clean_text(tweet['text'])
+            if 'author_id' in tweet:
+                tweet['author_id'] = "ANONYMIZED_USER"
+        return tweets
+
+    def preprocess_tweet_batch(self, batch):
+        """
+        TweetBatch をまとめて前処理する (cleaned_texts の列を作り、author_ids を匿名化する)。
+        preprocess_batch と同様に、バッチはその場で書き換える。
+        """
+        batch.cleaned_texts[:] = object_array([self.clean_text(text) for text in batch.texts])
+        has_author = np.array([author_id is not None for author_id in batch.author_ids], dtype=bool)
+        batch.author_ids[has_author] = "ANONYMIZED_USER"
+        return batch
+
     def preprocess_tweet(self, tweet_data):
         processed_tweet = tweet_data.copy()
         processed_tweet['cleaned_text'] = self.clean_text(tweet_data['text'])
@@ -40,6 +191,93 @@ class Preprocessor:
         processed_tweet = self.anonymize_user_info(processed_tweet)
         return processed_tweet
 
+class NearDuplicateGrouper:
+    """
+    MinHash + LSH で、コピペや bot による近似重複テキストをグループ化する。
+    各テキストに代表 (グループ内で最初に現れたテキスト) のインデックスを割り当てるので、
+    代表だけを感情分析して結果をグループ全体に配ればよい。
+    """
+
+    # MinHash 用のハッシュ関数 (a * x + b) mod p の法
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, num_perm=64, bands=16, shingle_size=3, threshold=0.8, seed=42):
+        if num_perm % bands != 0:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        # シングルのハッシュ (32bit) と係数を 32bit 未満に抑え、a * x + b が uint64 であふれないようにする
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def _shingle_hashes(self, text):
+        k = self.shingle_size
+        if len(text) <= k:
+            shingles = {text}
+        else:
+            shingles = {text[i:i + k] for i in range(len(text) - k + 1)}
+        return np.fromiter((zlib.crc32(sh.encode('utf-8')) for sh in shingles), dtype=np.uint64, count=len(shingles))
+
+    def _signature(self, text):
+        hashes = self._shingle_hashes(text)
+        # (num_perm, n_shingles) の行列で全ハッシュ関数を一度に計算して最小値を取る
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(self._PRIME)
+        return permuted.min(axis=1)
+
+    def group(self, texts):
+        """各テキストの代表インデックスのリストを返す (代表自身は自分のインデックス)"""
+        representative = list(range(len(texts)))
+
+        def find(i):
+            while representative[i] != i:
+                representative[i] = representative[representative[i]]
+                i = representative[i]
+            return i
+
+        def union(i, j):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                # 先に現れたテキストを代表にする
+                representative[max(ri, rj)] = min(ri, rj)
+
+        # 完全一致はハッシュで先にまとめる (MinHash の計算を省く)
+        first_seen = {}
+        unique_indices = []
+        for i, text in enumerate(texts):
+            if text in first_seen:
+                union(first_seen[text], i)
+            else:
+                first_seen[text] = i
+                unique_indices.append(i)
+
+        signatures = {i: self._signature(texts[i]) for i in unique_indices if texts[i]}
+        buckets = defaultdict(list)
+        for i, signature in signatures.items():
+            for band in range(self.bands):
+                key = (band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                buckets[key].append(i)
+
+        # 同じバケットに入った候補は全ペアを確認する (A と似ていない B・C 同士が似ている場合もまとめるため)
+        checked = set()
+        for members in buckets.values():
+            for a, i in enumerate(members):
+                for j in members[a + 1:]:
+                    pair = (i, j)
+                    if pair in checked or find(i) == find(j):
+                        continue
+                    checked.add(pair)
+                    # 推定 Jaccard 類似度 (一致する MinHash の割合) で確認する
+                    similarity = np.count_nonzero(signatures[i] == signatures[j]) / self.num_perm
+                    if similarity >= self.threshold:
+                        union(i, j)
+
+        return [find(i) for i in range(len(texts))]
+
+
 # テスト用
 if __name__ == '__main__':
     preproc = Preprocessor()
@@ -52,4 +290,14 @@ if __name__ == '__main__':
     processed = preproc.preprocess_tweet(sample_tweet)
     print(f"Original: {sample_tweet['text']}")
     print(f"Cleaned: {processed['cleaned_text']}")
-    print(f"Anonymized Author: {processed['author_id']}")
\ No newline at end of file
+    print(f"Anonymized Author: {processed['author_id']}")
+
+    batch = [
+        'ＡＩエージェントすごい😊 #AI https://example.com',
+        'AIエージェントすごい！！ @user1',
+        'AIエージェントすごい！！ @user2',
+        '雇用への影響が心配です。',
+    ]
+    cleaned_batch = [preproc.clean_text(text) for text in batch]
+    print(f"Cleaned batch: {cleaned_batch}")
+    print(f"Near-duplicate representatives: {NearDuplicateGrouper().group(cleaned_batch)}")
\ No newline at end of file
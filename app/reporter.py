@@ -1,93 +1,131 @@
-import matplotlib
-matplotlib.use('Agg') # バックエンドを指定 (GUIなし環境用)
-import matplotlib.pyplot as plt
-import io
-import base64
-from collections import Counter
-import pandas as pd # 分析日時のためにインポート
+import datetime
+
+import numpy as np
+
+from app.aggregator import SentimentAggregator
+from app.charts import ChartRenderer
+from app.metrics import span
+from app.trends import SentimentTrend, INTERVAL_NAMES
+from app.tweet_batch import TweetBatch
+
+# matplotlib (app.charts) / scikit-learn (app.term_stats) は読み込みに時間がかかるため、使う時点で import する
+# (アプリ起動時にレポート生成用のライブラリを読み込まないようにする)
+
+# 複数キーワードの結果 (generate_comparison_report) で、キーワードごとのレポートのリストを持つキー
+REPORTS_KEY = "reports"
+
 
 class ReportGenerator:
+    def __init__(self, chart_renderer=None, trend_interval="1h", trend_max_buckets=24):
+        # グラフの描画 (形式・プロセスプール・キャッシュ) は ChartRenderer に任せる
+        self.chart_renderer = chart_renderer or ChartRenderer()
+        # 時間帯ごとの推移の間隔 (None の場合は推移のセクションを出さない) と、レポートに載せる直近の時間帯の数
+        self.trend_interval = trend_interval
+        self.trend_max_buckets = trend_max_buckets
+
+    def new_trend(self):
+        return SentimentTrend(self.trend_interval) if self.trend_interval else None
+
     def generate_sentiment_pie_chart(self, sentiment_counts, total_analyzed, keyword):
-        """感情分析結果の円グラフを生成し、Base64エンコードされた画像文字列を返す"""
+        """
+        感情分析結果の円グラフを生成する。
+        png / svg の場合は data URI 文字列、json の場合は描画データの辞書を返す。
+        """
         if total_analyzed == 0:
             return None
+        return self.chart_renderer.render(sentiment_counts, keyword, total=total_analyzed)
 
-        labels = []
-        sizes = []
-        colors = []
-        # explodeは一部を切り出す場合に使う (今回は使わないが参考)
-        # explode_values = [] 
+    def generate_report(self, keyword, analyzed_tweets, positive_examples=5, negative_examples=5, neutral_examples=3):
+        """
+        分析結果のテキストレポートと、感情分析円グラフのBase64文字列を含む辞書を返す。
+        analyzed_tweets はリストでもイテレータでもよく、1回走査して SentimentAggregator に集計する
+        (例はラベルごとに上位 k 件だけを保持する)。TweetBatch の場合は列単位でまとめて集計する。
+        """
+        with span('aggregate'):
+            aggregator, term_stats, trend = self._aggregate(
+                analyzed_tweets, positive_examples, negative_examples, neutral_examples,
+            )
+        if not aggregator.seen:
+            return {
+                "text_report": "該当するツイートは見つかりませんでした。",
+                "pie_chart_base64": None
+            }
+        return self.generate_report_from_aggregate(keyword, aggregator, term_stats=term_stats, trend=trend)
 
-        positive_count = sentiment_counts.get("ポジティブ", 0)
-        negative_count = sentiment_counts.get("ネガティブ", 0)
-        neutral_count = sentiment_counts.get("ニュートラル", 0)
-
-        # グラフに表示するデータを準備
-        if positive_count > 0:
-            labels.append(f"ポジティブ\n({positive_count/total_analyzed*100:.1f}%)")
-            sizes.append(positive_count)
-            colors.append('lightgreen')
-            # explode_values.append(0)
-        if negative_count > 0:
-            labels.append(f"ネガティブ\n({negative_count/total_analyzed*100:.1f}%)")
-            sizes.append(negative_count)
-            colors.append('lightcoral')
-            # explode_values.append(0)
-        if neutral_count > 0:
-            labels.append(f"ニュートラル\n({neutral_count/total_analyzed*100:.1f}%)")
-            sizes.append(neutral_count)
-            colors.append('lightskyblue')
-            # explode_values.append(0)
-        
-        if not sizes: # 有効な感情分析結果がない場合
-            return None
+    def _aggregate(self, analyzed_tweets, positive_examples, negative_examples, neutral_examples):
+        """1回の走査で件数・例・話題の語・時間帯ごとの推移を集計し、(aggregator, term_stats, trend) を返す"""
+        aggregator = SentimentAggregator(examples_per_label={
+            "ポジティブ": positive_examples, "ネガティブ": negative_examples, "ニュートラル": neutral_examples,
+        })
+        if isinstance(analyzed_tweets, TweetBatch):
+            return self._aggregate_batch(analyzed_tweets, aggregator)
+        # 形態素解析済みの語 (tokens) があれば、話題の語と感情別の特徴語を集計する (同じ走査で集める)
+        token_lists = []
+        token_labels = []
+        # 時間帯ごとの推移用の列 (走査後に pandas でまとめて集計する)
+        created_at, trend_labels, trend_scores = [], [], []
+        for tweet in analyzed_tweets:
+            aggregator.add(tweet)
+            sentiment = tweet.get('sentiment')
+            if not sentiment or sentiment.get('label') == 'ERROR':
+                continue
+            if 'tokens' in tweet:
+                token_lists.append(tweet['tokens'])
+                token_labels.append(sentiment['label'])
+            if tweet.get('created_at'):
+                created_at.append(tweet['created_at'])
+                trend_labels.append(sentiment['label'])
+                trend_scores.append(sentiment.get('score', 0) or 0)
 
-        plt.figure(figsize=(8, 7)) # グラフサイズを少し調整
-        # 日本語フォント設定 (環境に合わせて調整)
-        # 一般的な日本語フォントのリスト。システムにインストールされているものを使用。
-        font_options = ['IPAexGothic', 'Hiragino Sans', 'Yu Gothic', 'MS Gothic', 'Noto Sans CJK JP', 'sans-serif']
-        plt.rcParams['font.family'] = font_options
-        
-        # autopct でパーセンテージ表示、startangle で開始角度調整
-        # wedgeprops で円グラフの線のスタイルを指定
-        plt.pie(sizes, 
-                labels=labels, 
-                colors=colors, 
-                autopct='%1.1f%%', 
-                startangle=90, 
-                pctdistance=0.85, # パーセンテージ表示位置
-                labeldistance=1.05, # ラベル表示位置
-                wedgeprops={'linewidth': 0.5, 'edgecolor': 'grey'}) # 境界線
-        
-        plt.axis('equal')  # 円を真円に
-        plt.title(f"「{keyword}」に関する感情分析結果", pad=20, fontsize=14) # タイトルにキーワード追加、フォントサイズ調整
+        term_stats = None
+        if token_lists:
+            from app.term_stats import TermStatistics
+            term_stats = TermStatistics().compute(
+                token_lists, token_labels, label_names=["ポジティブ", "ネガティブ", "ニュートラル"],
+            )
+        trend = self.new_trend()
+        if trend is not None:
+            trend.update_columns(created_at, trend_labels, trend_scores)
+        return aggregator, term_stats, trend
 
-        # 画像をメモリ上のバッファに保存
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='png', bbox_inches='tight', dpi=100) # dpiで解像度調整
-        img_buffer.seek(0)
-        
-        # Base64エンコード
-        img_base64 = base64.b64encode(img_buffer.getvalue()).decode('utf-8')
-        plt.close() # メモリ解放のため必ず閉じる
-        
-        return f"data:image/png;base64,{img_base64}"
+    def _aggregate_batch(self, batch, aggregator):
+        """_aggregate の TweetBatch 版 (行ごとの辞書を作らずに列から集計する)"""
+        aggregator.add_batch(batch)
+        term_stats = None
+        if batch.tokens is not None:
+            rows = batch.valid_mask() & np.not_equal(batch.tokens, None)
+            if rows.any():
+                from app.term_stats import TermStatistics
+                term_stats = TermStatistics().compute(
+                    batch.tokens[rows].tolist(), batch.labels[rows].tolist(),
+                    label_names=["ポジティブ", "ネガティブ", "ニュートラル"],
+                )
+        trend = self.new_trend()
+        if trend is not None:
+            trend.update_batch(batch)
+        return aggregator, term_stats, trend
 
-    def generate_report(self, keyword, analyzed_tweets, positive_examples=5, negative_examples=5, neutral_examples=3):
-        """分析結果のテキストレポートと、感情分析円グラフのBase64文字列を含む辞書を返す"""
+    def generate_report_from_aggregate(self, keyword, aggregator, term_stats=None, trend=None):
+        """SentimentAggregator (部分集計を merge したものでもよい) からレポートを組み立てる"""
+        return self.render_report(keyword, aggregator.counts, aggregator.examples(), term_stats=term_stats, trend=trend)
+
+    def render_report(self, keyword, sentiment_counts, examples, term_stats=None, trend=None):
+        """
+        集計済みの件数 ({ラベル: 件数}) と例 ({ラベル: [tweet, ...]} スコア順) からレポートを組み立てる。
+        generate_report のほか、保存済みの集計から再構築する場合 (監視モード) にも使う。
+        term_stats (TermStatistics.compute の結果) があれば話題の語のセクションを追加する。
+        trend (SentimentTrend) があれば時間帯ごとの推移のセクションとグラフを追加する。
+        """
         report_output = {
             "text_report": "",
             "pie_chart_base64": None
         }
 
-        if not analyzed_tweets:
+        total_analyzed = sum(sentiment_counts.values()) # エラーを除いた有効な分析数
+        if total_analyzed == 0 and not any(examples.values()):
             report_output["text_report"] = "該当するツイートは見つかりませんでした。"
             return report_output
-        
-        sentiments = [tweet['sentiment']['label'] for tweet in analyzed_tweets if tweet.get('sentiment') and tweet['sentiment'].get('label') != 'ERROR']
-        sentiment_counts = Counter(sentiments)
 
-        total_analyzed = len(sentiments) # エラーを除いた有効な分析数
         positive_count = sentiment_counts.get("ポジティブ", 0)
         negative_count = sentiment_counts.get("ネガティブ", 0)
         neutral_count = sentiment_counts.get("ニュートラル", 0) 
@@ -105,62 +143,179 @@ class ReportGenerator:
         report_parts.append(f"  - ニュートラルな意見の割合: {neutral_share:.2f}% ({neutral_count}件)")
         report_parts.append("-" * 40)
 
-        report_parts.append("\n【ポジティブな意見の例】:")
-        pos_examples_found = 0
-        # スコアが高い順にソートして表示する例
-        positive_tweets = sorted(
-            [t for t in analyzed_tweets if t.get('sentiment') and t['sentiment']['label'] == "ポジティブ"],
-            key=lambda x: x['sentiment'].get('score', 0), reverse=True
-        )
-        for tweet in positive_tweets:
-            if pos_examples_found < positive_examples:
-                report_parts.append(f"  - 「{tweet['cleaned_text']}」 (スコア: {tweet['sentiment'].get('score', 'N/A'):.2f}, 出所: {tweet['source_url']})")
-                pos_examples_found += 1
-        if pos_examples_found == 0:
-            report_parts.append("  (該当するポジティブな意見は見つかりませんでした)")
-
-        report_parts.append("\n【ネガティブな意見の例】:")
-        neg_examples_found = 0
-        negative_tweets = sorted(
-            [t for t in analyzed_tweets if t.get('sentiment') and t['sentiment']['label'] == "ネガティブ"],
-            key=lambda x: x['sentiment'].get('score', 0), reverse=True
-        )
-        for tweet in negative_tweets:
-            if neg_examples_found < negative_examples:
-                report_parts.append(f"  - 「{tweet['cleaned_text']}」 (スコア: {tweet['sentiment'].get('score', 'N/A'):.2f}, 出所: {tweet['source_url']})")
-                neg_examples_found += 1
-        if neg_examples_found == 0:
-            report_parts.append("  (該当するネガティブな意見は見つかりませんでした)")
-        
-        report_parts.append("\n【ニュートラルな意見の例】:")
-        neu_examples_found = 0
-        neutral_tweets = sorted(
-            [t for t in analyzed_tweets if t.get('sentiment') and t['sentiment']['label'] == "ニュートラル"],
-            key=lambda x: x['sentiment'].get('score', 0), reverse=True
-        )
-        for tweet in neutral_tweets:
-            if neu_examples_found < neutral_examples:
-                report_parts.append(f"  - 「{tweet['cleaned_text']}」 (スコア: {tweet['sentiment'].get('score', 'N/A'):.2f}, 出所: {tweet['source_url']})")
-                neu_examples_found += 1
-        if neu_examples_found == 0:
-            report_parts.append("  (該当するニュートラルな意見は見つかりませんでした)")
+        for label, heading, not_found in (
+            ("ポジティブ", "【ポジティブな意見の例】", "(該当するポジティブな意見は見つかりませんでした)"),
+            ("ネガティブ", "【ネガティブな意見の例】", "(該当するネガティブな意見は見つかりませんでした)"),
+            ("ニュートラル", "【ニュートラルな意見の例】", "(該当するニュートラルな意見は見つかりませんでした)"),
+        ):
+            report_parts.append(f"\n{heading}:")
+            label_examples = examples.get(label, [])
+            for tweet in label_examples:
+                report_parts.append(f"  - 「{tweet['cleaned_text']}」 (スコア: {tweet['sentiment'].get('score', 'N/A'):.2f}, 出所: {tweet.get('source_url') or '不明'})")
+            if not label_examples:
+                report_parts.append(f"  {not_found}")
+
+        if term_stats and term_stats.get("top_terms"):
+            report_parts.append("\n【よく話題に上っている語】:")
+            report_parts.append("  " + ", ".join(f"{term} ({count}件)" for term, count in term_stats["top_terms"]))
+            report_parts.append("\n【感情別の特徴的な語】:")
+            for label in ("ポジティブ", "ネガティブ", "ニュートラル"):
+                terms = term_stats["distinctive_terms"].get(label)
+                formatted = ", ".join(f"{term} ({count}件)" for term, count in terms) if terms else "(特徴的な語は見つかりませんでした)"
+                report_parts.append(f"  - {label}: {formatted}")
         
+        trend_result = trend.result(max_buckets=self.trend_max_buckets) if trend is not None and not trend.empty else None
+        if trend_result and trend_result["buckets"]:
+            interval_name = INTERVAL_NAMES.get(trend_result["interval"], trend_result["interval"])
+            report_parts.append(f"\n【時間帯ごとの推移 ({interval_name}ごと、直近{len(trend_result['buckets'])}区間)】:")
+            for bucket in trend_result["buckets"]:
+                counts = bucket["counts"]
+                line = (
+                    f"  {bucket['start'][5:16].replace('T', ' ')}  {bucket['total']}件"
+                    f" (ポジ {counts.get('ポジティブ', 0)} / ネガ {counts.get('ネガティブ', 0)} / ニュー {counts.get('ニュートラル', 0)},"
+                    f" ポジ-ネガ {bucket['net']:+.2f})"
+                )
+                if bucket["spike"]:
+                    line += " ▲急増"
+                report_parts.append(line)
+
         report_parts.append("\n" + "=" * 40)
-        try:
-            # タイムゾーンを指定して現在時刻を取得
-            analysis_time = pd.Timestamp.now(tz='Asia/Tokyo').strftime('%Y-%m-%d %H:%M:%S %Z')
-        except Exception: # pandas がない場合などのフォールバック
-            import datetime
-            analysis_time = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # タイムゾーンを指定して現在時刻を取得 (日本時間は夏時間がないので固定オフセットで十分)
+        jst = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+        analysis_time = datetime.datetime.now(jst).strftime('%Y-%m-%d %H:%M:%S %Z')
         report_parts.append(f"分析日時: {analysis_time}")
 
         report_output["text_report"] = "\n".join(report_parts)
         
-        # 円グラフを生成して辞書に追加
-        report_output["pie_chart_base64"] = self.generate_sentiment_pie_chart(sentiment_counts, total_analyzed, keyword)
+        # 円グラフを生成して辞書に追加 (json 形式の場合はブラウザで描画するためのデータを chart_data に入れる)
+        chart = self.generate_sentiment_pie_chart(sentiment_counts, total_analyzed, keyword)
+        if isinstance(chart, dict):
+            report_output["chart_data"] = chart
+        else:
+            report_output["pie_chart_base64"] = chart
+
+        # 時間帯ごとの推移 (集計データとグラフ)
+        if trend_result and trend_result["buckets"]:
+            report_output["trend"] = trend_result
+            trend_chart = self.chart_renderer.render_trend(trend_result, keyword)
+            if isinstance(trend_chart, dict):
+                report_output["trend_chart_data"] = trend_chart
+            else:
+                report_output["trend_chart_base64"] = trend_chart
         
         return report_output
 
+    def generate_comparison_report(self, tweets, members, fetched=None,
+                                   positive_examples=5, negative_examples=5, neutral_examples=3):
+        """
+        複数キーワードをまとめて分析した結果から、キーワードごとのレポートとキーワード間の比較を返す。
+        tweets はツイート ID で重複を除いた感情分析済みの TweetBatch、members は {keyword: tweets 内の位置の配列}、
+        fetched は {keyword: 重複を除く前の取得件数}。各キーワードのレポートは tweets の該当行だけを集計する。
+        """
+        keywords = list(members)
+        fetched = fetched or {}
+        reports, summaries = [], []
+        for keyword in keywords:
+            with span('aggregate', len(members[keyword])):
+                aggregator, term_stats, trend = self._aggregate(
+                    tweets[members[keyword]], positive_examples, negative_examples, neutral_examples,
+                )
+            if aggregator.seen:
+                report = self.generate_report_from_aggregate(keyword, aggregator, term_stats=term_stats, trend=trend)
+            else:
+                report = {"text_report": "該当するツイートは見つかりませんでした。", "pie_chart_base64": None}
+            reports.append({"keyword": keyword, **report})
+            summaries.append(self._keyword_summary(keyword, aggregator, fetched.get(keyword, aggregator.seen)))
+
+        # キーワード x ツイートの所属行列から、キーワード間で共通するツイートの数を求める
+        membership = np.zeros((len(keywords), len(tweets)), dtype=np.int32)
+        for i, keyword in enumerate(keywords):
+            membership[i, members[keyword]] = 1
+        shared = membership @ membership.T
+        # 他のどのキーワードにも含まれないツイートの数
+        exclusive = membership[:, membership.sum(axis=0) == 1].sum(axis=1)
+        overlaps = []
+        for i in range(len(keywords)):
+            summaries[i]["exclusive"] = int(exclusive[i])
+            for j in range(i + 1, len(keywords)):
+                union = shared[i, i] + shared[j, j] - shared[i, j]
+                overlaps.append({
+                    "keywords": [keywords[i], keywords[j]],
+                    "shared": int(shared[i, j]),
+                    "jaccard": round(float(shared[i, j] / union), 4) if union else 0.0,
+                })
+
+        comparison = {
+            "keywords": summaries,
+            "overlaps": overlaps,
+            "fetched_tweets": sum(summary["fetched"] for summary in summaries),
+            "unique_tweets": len(tweets),
+        }
+        result = {
+            "keywords": keywords,
+            "text_report": self._render_comparison_text(comparison),
+            "comparison": comparison,
+            REPORTS_KEY: reports,
+        }
+        chart = self.chart_renderer.render_comparison(summaries)
+        if isinstance(chart, dict):
+            result["comparison_chart_data"] = chart
+        elif chart:
+            result["comparison_chart_base64"] = chart
+        return result
+
+    @staticmethod
+    def _keyword_summary(keyword, aggregator, fetched):
+        """比較用のキーワードごとの集計 (件数・割合・平均スコア・ポジティブ - ネガティブの割合)"""
+        total = aggregator.total
+        counts = {label: aggregator.counts.get(label, 0) for label in ("ポジティブ", "ネガティブ", "ニュートラル")}
+        return {
+            "keyword": keyword,
+            "fetched": fetched,
+            "analyzed": total,
+            "counts": counts,
+            "shares": {label: round(count / total * 100, 2) if total else 0.0 for label, count in counts.items()},
+            "mean_scores": {label: round(score, 4) for label, score in aggregator.mean_scores().items()},
+            "net": round((counts["ポジティブ"] - counts["ネガティブ"]) / total, 4) if total else 0.0,
+        }
+
+    @staticmethod
+    def _render_comparison_text(comparison):
+        summaries = comparison["keywords"]
+        report_parts = []
+        report_parts.append("調査テーマ: " + " / ".join(f"「{summary['keyword']}」" for summary in summaries) + " の比較")
+        report_parts.append("=" * 40)
+        report_parts.append(
+            f"収集したツイート数: 延べ{comparison['fetched_tweets']}件 (重複を除いて{comparison['unique_tweets']}件)"
+        )
+        report_parts.append("-" * 40)
+        report_parts.append("\n【キーワード別の感情の割合】:")
+        for summary in summaries:
+            shares = summary["shares"]
+            report_parts.append(
+                f"  - 「{summary['keyword']}」 {summary['analyzed']}件:"
+                f" ポジ {shares['ポジティブ']:.2f}% / ネガ {shares['ネガティブ']:.2f}% / ニュー {shares['ニュートラル']:.2f}%"
+                f" (ポジ-ネガ {summary['net']:+.2f}, 他のキーワードと重複しない {summary['exclusive']}件)"
+            )
+        if comparison["overlaps"]:
+            report_parts.append("\n【キーワード間で共通するツイート】:")
+            for overlap in comparison["overlaps"]:
+                first, second = overlap["keywords"]
+                report_parts.append(
+                    f"  - 「{first}」と「{second}」: {overlap['shared']}件 (Jaccard 係数 {overlap['jaccard']:.2f})"
+                )
+        ranked = [summary for summary in summaries if summary["analyzed"]]
+        if len(ranked) > 1:
+            ranked.sort(key=lambda summary: summary["net"], reverse=True)
+            report_parts.append("\n【ポジティブ - ネガティブの割合の順位】:")
+            for rank, summary in enumerate(ranked, 1):
+                report_parts.append(f"  {rank}. 「{summary['keyword']}」 {summary['net']:+.2f}")
+
+        report_parts.append("\n" + "=" * 40)
+        jst = datetime.timezone(datetime.timedelta(hours=9), 'JST')
+        report_parts.append(f"分析日時: {datetime.datetime.now(jst).strftime('%Y-%m-%d %H:%M:%S %Z')}")
+        return "\n".join(report_parts)
+
 # テスト用
 if __name__ == '__main__':
     reporter = ReportGenerator()
@@ -0,0 +1,112 @@
+# app/task_executor.py
+import logging
+import threading
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueueFullError(Exception):
+    """待ち行列が上限に達していて、新しいタスクを受け付けられない場合に送出される"""
+
+
+def new_task_id():
+    """衝突しないタスクIDを生成する"""
+    return uuid.uuid4().hex
+
+
+class TaskExecutor:
+    """
+    分析タスク用の固定サイズのワーカープール。
+    - max_workers: 同時に実行するタスク数
+    - max_pending: 実行待ちで保持するタスク数の上限 (超えた場合は TaskQueueFullError)
+    - stage_limits: ステージ名ごとの同時実行数の上限 (例: {'collect': 4, 'inference': 2})
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, stage_limits=None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._running = set()
+        self._cond = threading.Condition()
+        self._stage_semaphores = {
+            name: threading.BoundedSemaphore(limit)
+            for name, limit in (stage_limits or {}).items() if limit
+        }
+        self._workers = []
+        self._shutdown = False
+
+    def _ensure_workers(self):
+        # ワーカースレッドは最初のタスク投入時に起動する
+        if self._workers:
+            return
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._run, name=f"task-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, task_id, fn, *args, **kwargs):
+        """タスクを待ち行列に追加する。満杯の場合は TaskQueueFullError を送出する"""
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("TaskExecutor has been shut down")
+            if len(self._pending) >= self.max_pending:
+                raise TaskQueueFullError(f"Task queue is full ({self.max_pending} pending)")
+            self._ensure_workers()
+            self._pending.append((task_id, fn, args, kwargs))
+            self._cond.notify()
+
+    def queue_position(self, task_id):
+        """実行待ちのタスクの順番 (1始まり) を返す。実行中・未登録の場合は None"""
+        with self._cond:
+            for position, (pending_id, _, _, _) in enumerate(self._pending, start=1):
+                if pending_id == task_id:
+                    return position
+        return None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "running": len(self._running),
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+            }
+
+    @contextmanager
+    def stage(self, name):
+        """ステージごとの同時実行数を制限するコンテキストマネージャー (上限未設定のステージは無制限)"""
+        semaphore = self._stage_semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._shutdown:
+                    self._cond.wait()
+                if self._shutdown and not self._pending:
+                    return
+                task_id, fn, args, kwargs = self._pending.popleft()
+                self._running.add(task_id)
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                # タスク関数側でエラー処理を行う前提だが、ワーカーが止まらないようにここでも捕捉する
+                logger.error(f"Unhandled error in task {task_id}: {e}", exc_info=True)
+            finally:
+                with self._cond:
+                    self._running.discard(task_id)
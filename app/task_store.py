@@ -0,0 +1,330 @@
+# app/task_store.py
+import base64
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from app.reporter import REPORTS_KEY
+
+logger = logging.getLogger(__name__)
+
+# レポート辞書の中で、グラフ画像 (data URI) を保持するキー
+CHART_KEY = "pie_chart_base64"
+# グラフ名 -> レポート辞書のキー (グラフは名前ごとに別に保存し、/chart/<task_id>?name=<名前> で返す)
+CHART_KEYS = {"pie": CHART_KEY, "trend": "trend_chart_base64", "comparison": "comparison_chart_base64"}
+# 複数キーワードの結果 (REPORTS_KEY にキーワードごとのレポートのリストを持つ) では、
+# 各レポートのグラフは '<グラフ名>-<レポートの添字>' の名前で保存する。例: pie-0, trend-1
+
+
+def split_data_uri(data_uri):
+    """'data:<mime>;base64,<data>' 形式の文字列を (mime, bytes) に分解する"""
+    if isinstance(data_uri, str) and data_uri.startswith("data:") and ";base64," in data_uri:
+        header, encoded = data_uri.split(",", 1)
+        return header[len("data:"):-len(";base64")], base64.b64decode(encoded)
+    return None, None
+
+
+def to_data_uri(mime, data):
+    return f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
+
+def _pop_charts(report, suffix, charts):
+    for name, key in CHART_KEYS.items():
+        if report.get(key):
+            mime, data = split_data_uri(report.pop(key))
+            if mime:
+                charts[name + suffix] = (mime, data)
+
+
+def _has_charts(report):
+    return isinstance(report, dict) and any(report.get(key) for key in CHART_KEYS.values())
+
+
+def split_charts(result):
+    """レポート辞書からグラフ画像を取り出し、(グラフを除いたレポート, {グラフ名: (mime, bytes)}) を返す"""
+    charts = {}
+    if not isinstance(result, dict):
+        return result, charts
+    reports = result.get(REPORTS_KEY)
+    nested = isinstance(reports, list) and any(_has_charts(report) for report in reports)
+    if not nested and not _has_charts(result):
+        return result, charts
+    result = dict(result)
+    _pop_charts(result, "", charts)
+    if nested:
+        result[REPORTS_KEY] = [dict(report) if isinstance(report, dict) else report for report in reports]
+        for i, report in enumerate(result[REPORTS_KEY]):
+            if isinstance(report, dict):
+                _pop_charts(report, f"-{i}", charts)
+    return result, charts
+
+
+def restore_charts(result, charts):
+    """split_charts で取り出したグラフ ({グラフ名: (mime, bytes)}) を data URI に戻した結果の辞書を返す"""
+    result = dict(result)
+    reports = list(result.get(REPORTS_KEY) or [])
+    for name, chart in charts.items():
+        base, _, index = name.partition("-")
+        if base not in CHART_KEYS:
+            continue
+        if not index:
+            result[CHART_KEYS[base]] = to_data_uri(*chart)
+        elif index.isdigit() and int(index) < len(reports):
+            reports[int(index)] = {**reports[int(index)], CHART_KEYS[base]: to_data_uri(*chart)}
+    if REPORTS_KEY in result:
+        result[REPORTS_KEY] = reports
+    return result
+
+
+class MemoryTaskStore:
+    """
+    プロセス内の辞書にタスク状態と結果を保持するストア (開発・単一プロセス用)。
+    TTL と最大件数を超えた古いタスクは自動的に削除する。
+    """
+
+    def __init__(self, ttl_seconds=3600, max_tasks=1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_tasks = max_tasks
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _get_locked(self, task_id):
+        # 削除前でも TTL 切れのタスクは存在しないものとして扱う
+        task = self._tasks.get(task_id)
+        if task and self.ttl_seconds and task["updated_at"] < time.time() - self.ttl_seconds:
+            return None
+        return task
+
+    def create(self, task_id, status="pending"):
+        with self._lock:
+            self._tasks[task_id] = {"status": status, "result": None, "charts": {}, "updated_at": time.time()}
+            self._evict_locked()
+
+    def set_status(self, task_id, status):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task:
+                task["status"] = status
+                task["updated_at"] = time.time()
+
+    def set_result(self, task_id, status, result):
+        result, charts = split_charts(result)
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = self._tasks[task_id] = {}
+            task.update({"status": status, "result": result, "charts": charts, "updated_at": time.time()})
+
+    def get_status(self, task_id):
+        with self._lock:
+            task = self._get_locked(task_id)
+            return task["status"] if task else None
+
+    def get(self, task_id, include_chart=False):
+        """
+        {'status', 'result', 'has_chart', 'charts'} を返す (charts は保存されているグラフ名のリスト)。
+        include_chart=True ならグラフを result に戻す
+        """
+        with self._lock:
+            task = self._get_locked(task_id)
+            if not task:
+                return None
+            status = task["status"]
+            result = task["result"]
+            charts = task["charts"]
+        if include_chart and charts and isinstance(result, dict):
+            result = restore_charts(result, charts)
+        return {"status": status, "result": result, "has_chart": "pie" in charts, "charts": sorted(charts)}
+
+    def get_chart(self, task_id, name="pie"):
+        """グラフを (mime, bytes) で返す。存在しない場合は None"""
+        with self._lock:
+            task = self._get_locked(task_id)
+            return task["charts"].get(name) if task else None
+
+    def delete(self, task_id):
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def evict(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        if self.ttl_seconds:
+            threshold = time.time() - self.ttl_seconds
+            for task_id in [k for k, v in self._tasks.items() if v["updated_at"] < threshold]:
+                del self._tasks[task_id]
+        if self.max_tasks and len(self._tasks) > self.max_tasks:
+            oldest = sorted(self._tasks, key=lambda k: self._tasks[k]["updated_at"])
+            for task_id in oldest[:len(self._tasks) - self.max_tasks]:
+                del self._tasks[task_id]
+
+
+class SQLiteTaskStore:
+    """
+    SQLite にタスク状態と結果を保存するストア。複数の gunicorn ワーカープロセスから共有できる。
+    レポート本体は zlib 圧縮した JSON、グラフ画像はデコード済みのバイナリを別テーブルに保存し、
+    状態確認時にはグラフを読み込まない。
+    """
+
+    def __init__(self, db_path, ttl_seconds=3600, max_tasks=1000, evict_every=50):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_tasks = max_tasks
+        self.evict_every = evict_every
+        self._creates_since_evict = 0
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                " task_id TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " result BLOB,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_updated ON tasks (updated_at)")
+            # 以前のグラフ1枚だけのテーブルは作り直す (グラフは TTL で消える一時データのため移行しない)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(task_charts)")]
+            if columns and "name" not in columns:
+                conn.execute("DROP TABLE task_charts")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS task_charts ("
+                " task_id TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " mime TEXT NOT NULL,"
+                " data BLOB NOT NULL,"
+                " PRIMARY KEY (task_id, name))"
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # 接続はスレッド/プロセスごとに都度作成し、使い終わったら閉じる
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn: # 正常終了時はコミット、例外時はロールバック
+                yield conn
+        finally:
+            conn.close()
+
+    def _min_updated_at(self):
+        # 削除前でも TTL 切れのタスクは読み出さない
+        return time.time() - self.ttl_seconds if self.ttl_seconds else 0
+
+    @staticmethod
+    def _encode_result(result):
+        return zlib.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+
+    @staticmethod
+    def _decode_result(blob):
+        return json.loads(zlib.decompress(blob).decode("utf-8")) if blob is not None else None
+
+    def create(self, task_id, status="pending"):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, result, updated_at) VALUES (?, ?, NULL, ?)",
+                (task_id, status, time.time()),
+            )
+        with self._lock:
+            self._creates_since_evict += 1
+            should_evict = self._creates_since_evict >= self.evict_every
+            if should_evict:
+                self._creates_since_evict = 0
+        if should_evict:
+            self.evict()
+
+    def set_status(self, task_id, status):
+        with self._connect() as conn:
+            conn.execute("UPDATE tasks SET status = ?, updated_at = ? WHERE task_id = ?", (status, time.time(), task_id))
+
+    def set_result(self, task_id, status, result):
+        result, charts = split_charts(result)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, result, updated_at) VALUES (?, ?, ?, ?)",
+                (task_id, status, self._encode_result(result), time.time()),
+            )
+            if charts:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO task_charts (task_id, name, mime, data) VALUES (?, ?, ?, ?)",
+                    [(task_id, name, mime, data) for name, (mime, data) in charts.items()],
+                )
+
+    def get_status(self, task_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT status FROM tasks WHERE task_id = ? AND updated_at >= ?", (task_id, self._min_updated_at())
+            ).fetchone()
+        return row[0] if row else None
+
+    def get(self, task_id, include_chart=False):
+        """
+        {'status', 'result', 'has_chart', 'charts'} を返す (charts は保存されているグラフ名のリスト)。
+        include_chart=True ならグラフを result に戻す
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT t.status, t.result, GROUP_CONCAT(c.name) FROM tasks t"
+                " LEFT JOIN task_charts c ON c.task_id = t.task_id WHERE t.task_id = ? AND t.updated_at >= ?"
+                " GROUP BY t.task_id",
+                (task_id, self._min_updated_at()),
+            ).fetchone()
+        if not row:
+            return None
+        status, blob, chart_names = row
+        charts = sorted(chart_names.split(",")) if chart_names else []
+        result = self._decode_result(blob)
+        if include_chart and charts and isinstance(result, dict):
+            stored = {name: self.get_chart(task_id, name) for name in charts}
+            result = restore_charts(result, {name: chart for name, chart in stored.items() if chart})
+        return {"status": status, "result": result, "has_chart": "pie" in charts, "charts": charts}
+
+    def get_chart(self, task_id, name="pie"):
+        """グラフを (mime, bytes) で返す。存在しない場合は None"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT c.mime, c.data FROM task_charts c JOIN tasks t ON t.task_id = c.task_id"
+                " WHERE c.task_id = ? AND c.name = ? AND t.updated_at >= ?",
+                (task_id, name, self._min_updated_at()),
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def delete(self, task_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+            conn.execute("DELETE FROM task_charts WHERE task_id = ?", (task_id,))
+
+    def evict(self):
+        """TTL 切れ・最大件数超過のタスクを削除する"""
+        try:
+            with self._connect() as conn:
+                if self.ttl_seconds:
+                    conn.execute("DELETE FROM tasks WHERE updated_at < ?", (time.time() - self.ttl_seconds,))
+                if self.max_tasks:
+                    conn.execute(
+                        "DELETE FROM tasks WHERE task_id IN ("
+                        " SELECT task_id FROM tasks ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_tasks,),
+                    )
+                conn.execute("DELETE FROM task_charts WHERE task_id NOT IN (SELECT task_id FROM tasks)")
+        except sqlite3.Error as e:
+            logger.error(f"Error evicting tasks from '{self.db_path}': {e}", exc_info=True)
+
+
+def create_task_store(backend, db_path=None, ttl_seconds=3600, max_tasks=1000):
+    """設定値からタスクストアを生成する ('sqlite' または 'memory')"""
+    if backend == "sqlite":
+        return SQLiteTaskStore(db_path, ttl_seconds=ttl_seconds, max_tasks=max_tasks)
+    if backend == "memory":
+        return MemoryTaskStore(ttl_seconds=ttl_seconds, max_tasks=max_tasks)
+    raise ValueError(f"Unknown task store backend: {backend}")
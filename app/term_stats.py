@@ -0,0 +1,70 @@
+# app/term_stats.py
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+def _identity(tokens):
+    # 形態素解析済みの語のリストをそのまま使う
+    return tokens
+
+
+class TermStatistics:
+    """
+    形態素解析済みの語のリストから、疎な文書-語行列 (scikit-learn) を作って集計する。
+    - top_terms: 多くのツイートで言及されている語 (文書頻度順)
+    - distinctive_terms: 感情ラベルごとに、他のラベルと比べて特徴的な語 (平滑化した対数オッズ比)
+    """
+
+    def __init__(self, min_df=2, smoothing=0.5):
+        self.min_df = min_df
+        self.smoothing = smoothing
+
+    def _vectorize(self, token_lists):
+        # 同じツイート内の重複は数えない (binary) ので、値は「その語を含むツイート数」になる
+        vectorizer = CountVectorizer(analyzer=_identity, binary=True, min_df=self.min_df)
+        try:
+            matrix = vectorizer.fit_transform(token_lists)
+        except ValueError:
+            # 条件を満たす語が1つもない場合
+            return None, None
+        return matrix.tocsr(), vectorizer.get_feature_names_out()
+
+    def compute(self, token_lists, labels, top_n=10, distinctive_n=5, label_names=None):
+        """
+        token_lists と labels (各ツイートの感情ラベル) から
+        {'top_terms': [(語, 件数), ...], 'distinctive_terms': {ラベル: [(語, 件数), ...]}} を返す。
+        """
+        result = {"top_terms": [], "distinctive_terms": {}}
+        if not token_lists:
+            return result
+        matrix, terms = self._vectorize(token_lists)
+        if matrix is None:
+            return result
+
+        doc_freq = np.asarray(matrix.sum(axis=0)).ravel()
+        top_indices = np.argsort(-doc_freq, kind="stable")[:top_n]
+        result["top_terms"] = [(terms[i], int(doc_freq[i])) for i in top_indices]
+
+        labels = np.asarray(labels)
+        n_docs = matrix.shape[0]
+        alpha = self.smoothing
+        for label in (label_names or sorted(set(labels.tolist()))):
+            mask = labels == label
+            n_label = int(mask.sum())
+            n_other = n_docs - n_label
+            if n_label == 0 or n_other == 0:
+                continue
+            in_label = np.asarray(matrix[mask].sum(axis=0)).ravel()
+            in_other = doc_freq - in_label
+            # 語を含むツイートの割合の対数オッズを、対象ラベルとそれ以外で比較する
+            log_odds = (
+                np.log((in_label + alpha) / (n_label - in_label + alpha))
+                - np.log((in_other + alpha) / (n_other - in_other + alpha))
+            )
+            # 対象ラベルで1回しか出てこない語は偶然の可能性が高いので除く
+            log_odds[in_label < 2] = -np.inf
+            candidates = np.argsort(-log_odds, kind="stable")[:distinctive_n]
+            result["distinctive_terms"][label] = [
+                (terms[i], int(in_label[i])) for i in candidates if np.isfinite(log_odds[i]) and log_odds[i] > 0
+            ]
+        return result
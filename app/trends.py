@@ -0,0 +1,178 @@
+# app/trends.py
+import numpy as np
+
+from app.tweet_batch import round_score
+
+# pandas は読み込みに時間がかかるため、使う時点で import する
+
+# 集計から除外するラベル
+EXCLUDED_LABELS = {"ERROR"}
+
+# 表示用の間隔の名前 (pandas のオフセット表記 -> 日本語)
+INTERVAL_NAMES = {"15min": "15分", "30min": "30分", "1h": "1時間", "6h": "6時間", "1D": "1日"}
+
+
+class SentimentTrend:
+    """
+    created_at を interval (pandas のオフセット表記。例: '15min', '1h', '1D') ごとの時間帯に区切り、
+    時間帯 x ラベルごとの件数とスコア合計を列指向の DataFrame で保持する。
+    update で新しいツイートの集計を足し込めるので、過去のツイート自体は保持しない (merge も同様)。
+    時間帯の区切りは timezone の時刻で行う (1日ごとの集計が日本時間の0時で区切られるように)。
+    """
+
+    def __init__(self, interval="1h", timezone="Asia/Tokyo", spike_window=12, spike_threshold=2.0):
+        self.interval = interval
+        self.timezone = timezone
+        # 急増の判定: 直前 spike_window 個の時間帯の平均 + spike_threshold x 標準偏差 を超えた時間帯
+        self.spike_window = spike_window
+        self.spike_threshold = spike_threshold
+        self._counts = None
+        self._score_sums = None
+
+    @staticmethod
+    def columns_from_tweets(tweets):
+        """ツイートの辞書のリストから (created_at, label, score) の列を取り出す"""
+        created_at, labels, scores = [], [], []
+        for tweet in tweets:
+            sentiment = tweet.get('sentiment')
+            if not sentiment or sentiment.get('label') in EXCLUDED_LABELS or not tweet.get('created_at'):
+                continue
+            created_at.append(tweet['created_at'])
+            labels.append(sentiment['label'])
+            scores.append(sentiment.get('score', 0) or 0)
+        return created_at, labels, scores
+
+    def update(self, tweets):
+        return self.update_columns(*self.columns_from_tweets(tweets))
+
+    def update_batch(self, batch):
+        """TweetBatch の分を足し込む (ERROR・未分析・created_at のない行は除く)"""
+        rows = batch.valid_mask() & np.not_equal(batch.created_at, None)
+        scores = round_score(batch.scores[rows])
+        return self.update_columns(batch.created_at[rows], batch.labels[rows], scores)
+
+    def update_columns(self, created_at, labels, scores):
+        """列 (同じ長さのリスト/配列) で受け取った分を、時間帯ごとの集計に足し込む"""
+        import pandas as pd
+        if len(created_at) == 0:
+            return self
+        frame = pd.DataFrame({
+            "created_at": pd.to_datetime(pd.Series(created_at), utc=True, errors="coerce"),
+            "label": labels,
+            "score": np.asarray(scores, dtype=float),
+        }).dropna(subset=["created_at"])
+        if frame.empty:
+            return self
+        frame["created_at"] = frame["created_at"].dt.tz_convert(self.timezone)
+        # 時間帯の開始時刻で切り捨てて、時間帯 x ラベルで集計する
+        frame["bucket"] = frame["created_at"].dt.floor(self.interval)
+        grouped = frame.groupby(["bucket", "label"])["score"]
+        self._add(grouped.size().unstack(fill_value=0), grouped.sum().unstack(fill_value=0.0))
+        return self
+
+    def _add(self, counts, score_sums):
+        if self._counts is None:
+            self._counts, self._score_sums = counts, score_sums
+        else:
+            self._counts = self._counts.add(counts, fill_value=0).fillna(0).astype(int)
+            self._score_sums = self._score_sums.add(score_sums, fill_value=0.0).fillna(0.0)
+
+    def merge(self, other):
+        """別の集計 (同じ interval / timezone) を取り込む。self を返す"""
+        if (other.interval, other.timezone) != (self.interval, self.timezone):
+            raise ValueError("Cannot merge trends with different interval or timezone")
+        if other._counts is not None:
+            self._add(other._counts, other._score_sums)
+        return self
+
+    @property
+    def empty(self):
+        return self._counts is None or self._counts.empty
+
+    def bucket_rows(self):
+        """
+        永続化用に (時間帯の開始 ISO 文字列, ラベル, 件数, スコア合計) のリストを返す。
+        開始時刻は文字列の大小で比較できるよう UTC で表す。
+        """
+        if self.empty:
+            return []
+        counts = self._counts.stack()
+        sums = self._score_sums.stack().reindex(counts.index, fill_value=0.0)
+        return [
+            (bucket.tz_convert("UTC").isoformat(), label, int(count), float(score_sum))
+            for (bucket, label), count, score_sum in zip(counts.index, counts.to_numpy(), sums.to_numpy())
+            if count
+        ]
+
+    @classmethod
+    def from_bucket_rows(cls, rows, **kwargs):
+        """bucket_rows で保存した行から復元する"""
+        trend = cls(**kwargs)
+        if rows:
+            import pandas as pd
+            frame = pd.DataFrame(rows, columns=["bucket", "label", "count", "score_sum"])
+            frame["bucket"] = pd.to_datetime(frame["bucket"], utc=True).dt.tz_convert(trend.timezone)
+            table = frame.pivot_table(index="bucket", columns="label", values=["count", "score_sum"],
+                                      aggfunc="sum", fill_value=0)
+            trend._add(table["count"].astype(int), table["score_sum"].astype(float))
+        return trend
+
+    def table(self, max_buckets=None):
+        """
+        時間帯ごとの DataFrame を返す (件数のない時間帯も 0 件として埋める)。
+        列: ラベルごとの件数, total, mean_<ラベル> (平均スコア), net (ポジティブ - ネガティブの割合), spike
+        max_buckets を指定した場合は、直近 max_buckets 個の時間帯の急増判定に必要な範囲
+        (直前の spike_window 個を含む) だけを埋める (長い期間を短い間隔で集計した場合に行数が膨らまないように)。
+        """
+        import pandas as pd
+        if self.empty:
+            return pd.DataFrame()
+        counts = self._counts.sort_index()
+        start, end = counts.index[0], counts.index[-1]
+        if max_buckets:
+            interval = pd.tseries.frequencies.to_offset(self.interval)
+            start = max(start, end - interval * (max_buckets + self.spike_window - 1))
+            counts = counts[counts.index >= start]
+        counts = counts.reindex(pd.date_range(start, end, freq=self.interval), fill_value=0)
+        sums = self._score_sums.reindex(index=counts.index, columns=counts.columns, fill_value=0.0)
+        total = counts.sum(axis=1)
+        table = counts.copy()
+        table["total"] = total
+        means = sums / counts.where(counts > 0)
+        for label in counts.columns:
+            table[f"mean_{label}"] = means[label].round(4)
+        positive = counts["ポジティブ"] if "ポジティブ" in counts else 0
+        negative = counts["ネガティブ"] if "ネガティブ" in counts else 0
+        table["net"] = ((positive - negative) / total.where(total > 0)).fillna(0.0).round(4)
+
+        # 直前の時間帯の件数と比べて急増した時間帯を検出する (現在の時間帯は比較対象に含めない)
+        # 件数が少ない場合のばらつきで誤検出しないよう、平均の1.5倍以上であることも条件にする
+        history = total.shift(1).rolling(self.spike_window, min_periods=3)
+        baseline, spread = history.mean(), history.std().fillna(0.0)
+        spike = (total > baseline + self.spike_threshold * spread.clip(lower=1.0)) & (total >= baseline * 1.5)
+        table["spike"] = spike.fillna(False)
+        return table
+
+    def result(self, max_buckets=None):
+        """JSON に変換できる形式で返す。max_buckets を指定した場合は直近の時間帯だけを返す"""
+        table = self.table(max_buckets)
+        if table.empty:
+            return {"interval": self.interval, "buckets": [], "spikes": []}
+        labels = list(self._counts.columns)
+        if max_buckets:
+            table = table.iloc[-max_buckets:]
+        buckets = []
+        for start, row in zip(table.index, table.to_dict("records")):
+            buckets.append({
+                "start": start.isoformat(),
+                "total": int(row["total"]),
+                "counts": {label: int(row[label]) for label in labels},
+                "mean_scores": {label: row[f"mean_{label}"] for label in labels if row[label]},
+                "net": row["net"],
+                "spike": bool(row["spike"]),
+            })
+        return {
+            "interval": self.interval,
+            "buckets": buckets,
+            "spikes": [bucket["start"] for bucket in buckets if bucket["spike"]],
+        }
@@ -0,0 +1,255 @@
+# app/tweet_batch.py
+import logging
+
+import numpy as np
+
+from app.analyzer import LABEL_MAP
+
+logger = logging.getLogger(__name__)
+
+# 感情ラベルのコード (label_codes の値はこのタプルの添字。未分析は NO_LABEL)
+LABELS = ("ポジティブ", "ネガティブ", "ニュートラル", "ERROR", "UNKNOWN")
+LABEL_CODES = {label: code for code, label in enumerate(LABELS)}
+NO_LABEL = -1
+ERROR_CODE = LABEL_CODES["ERROR"]
+UNKNOWN_CODE = LABEL_CODES["UNKNOWN"]
+_LABEL_ARRAY = np.array(LABELS + (None,), dtype=object)  # 添字 -1 (NO_LABEL) は None になる
+# スコアの小数点以下の桁数 (analyzer の結果の辞書と同じ)
+SCORE_DECIMALS = 4
+
+# 文字列・オブジェクトの列 (dtype=object の numpy 配列)
+OBJECT_COLUMNS = ("ids", "created_at", "author_ids", "texts", "cleaned_texts", "source_urls", "tokens", "extras")
+# 辞書形式との対応 (列名 -> 辞書のキー)
+DICT_KEYS = {
+    "ids": "id",
+    "texts": "text",
+    "created_at": "created_at",
+    "author_ids": "author_id",
+    "source_urls": "source_url",
+    "cleaned_texts": "cleaned_text",
+    "tokens": "tokens",
+}
+
+
+def round_score(scores):
+    """スコア (float32 の値または配列) を辞書形式と同じ桁数の float64 に丸める (集計の結果を辞書形式と一致させる)"""
+    return np.round(np.asarray(scores, dtype=np.float64), SCORE_DECIMALS)
+
+
+def label_code(label, unknown_labels=None):
+    """
+    ラベル名をコードにする。モデルの英語のラベル (LABEL_MAP のキー、大文字・小文字は問わない) も受け付ける。
+    対応しないラベルは UNKNOWN にし、unknown_labels (set) を渡した場合はそこに追加する
+    """
+    code = LABEL_CODES.get(label)
+    if code is None:
+        code = LABEL_CODES.get(LABEL_MAP.get(str(label).upper()))
+    if code is None:
+        if unknown_labels is not None:
+            unknown_labels.add(label)
+        return UNKNOWN_CODE
+    return code
+
+
+def _warn_unknown_labels(unknown_labels):
+    if unknown_labels:
+        logger.warning(f"Unknown sentiment labels {sorted(map(str, unknown_labels))} are counted as UNKNOWN")
+
+
+def object_array(items=None, length=0):
+    """リスト (要素がリストでもよい) から1次元の dtype=object 配列を作る。items が None の場合は None で埋める"""
+    if items is None:
+        return np.full(length, None, dtype=object)
+    return np.fromiter(items, dtype=object, count=len(items))
+
+
+class TweetBatch:
+    """
+    ツイートの列指向の集まり。ツイートごとの辞書の代わりに、列ごとの配列で持つ。
+    - ids / created_at / author_ids / texts / cleaned_texts / source_urls / tokens: dtype=object の配列
+    - label_codes: 感情ラベルのコード (int8、LABELS の添字、未分析は NO_LABEL)
+    - scores: 感情スコア (float32)
+    - extras: 感情分析結果の補足 ('note' / 'error_message' など) の辞書 (ない場合は None)
+    batch[start:stop] は全列の numpy のビュー (コピーしない) を返すので、推論のチャンクに切り出して
+    set_sentiments で結果を書き込むと、元のバッチに反映される。
+    to_dicts / from_dicts でこれまでの辞書形式と相互に変換できる。
+    """
+
+    __slots__ = OBJECT_COLUMNS + ("label_codes", "scores")
+
+    def __init__(self, ids, texts, created_at=None, author_ids=None, source_urls=None, cleaned_texts=None,
+                 tokens=None, label_codes=None, scores=None, extras=None):
+        length = len(ids)
+        self.ids = ids if isinstance(ids, np.ndarray) else object_array(ids)
+        self.texts = texts if isinstance(texts, np.ndarray) else object_array(texts)
+        for name, value in (("created_at", created_at), ("author_ids", author_ids), ("source_urls", source_urls),
+                            ("cleaned_texts", cleaned_texts), ("extras", extras)):
+            setattr(self, name, value if isinstance(value, np.ndarray) else object_array(value, length))
+        # tokens は形態素解析した場合だけ持つ
+        self.tokens = tokens if tokens is None or isinstance(tokens, np.ndarray) else object_array(tokens)
+        self.label_codes = np.full(length, NO_LABEL, dtype=np.int8) if label_codes is None else label_codes
+        self.scores = np.zeros(length, dtype=np.float32) if scores is None else scores
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _columns(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __getitem__(self, key):
+        """スライスはビュー (コピーなし)、添字の配列・真偽値の配列は該当する行のコピーを返す"""
+        if isinstance(key, (int, np.integer)):
+            raise TypeError("Use to_dict(i) to get a single tweet")
+        return TweetBatch(**{
+            name: None if column is None else column[key]
+            for name, column in self._columns().items()
+        })
+
+    def iter_slices(self, size):
+        """size 件ずつのビューを返す"""
+        for start in range(0, len(self), size):
+            yield self[start:start + size]
+
+    @classmethod
+    def empty(cls):
+        return cls([], [])
+
+    @classmethod
+    def concat(cls, batches):
+        batches = [batch for batch in batches if len(batch)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        columns = {}
+        for name in cls.__slots__:
+            values = [getattr(batch, name) for batch in batches]
+            if name == "tokens" and any(value is None for value in values):
+                values = [object_array(None, len(batch)) if value is None else value
+                          for batch, value in zip(batches, values)]
+            columns[name] = np.concatenate(values)
+        return cls(**columns)
+
+    @classmethod
+    def from_api(cls, data):
+        """Twitter API v2 のレスポンスの data (ツイートの辞書のリスト) から作る"""
+        ids = [tweet['id'] for tweet in data]
+        author_ids = [tweet.get('author_id') for tweet in data]
+        return cls(
+            ids=ids,
+            texts=[tweet['text'] for tweet in data],
+            created_at=[tweet.get('created_at') for tweet in data],
+            author_ids=author_ids,
+            source_urls=[f"https://twitter.com/{author_id}/status/{tweet_id}"
+                         for tweet_id, author_id in zip(ids, author_ids)],
+        )
+
+    @classmethod
+    def from_dicts(cls, tweets):
+        """これまでの辞書形式 (sentiment を含んでいてもよい) のリストから作る"""
+        tweets = list(tweets)
+        columns = {name: [tweet.get(key) for tweet in tweets] for name, key in DICT_KEYS.items()}
+        if all(tokens is None for tokens in columns["tokens"]):
+            columns["tokens"] = None
+        batch = cls(**columns)
+        sentiments = [tweet.get('sentiment') for tweet in tweets]
+        analyzed = [i for i, sentiment in enumerate(sentiments) if sentiment]
+        if analyzed:
+            batch.set_sentiments([sentiments[i] for i in analyzed], np.asarray(analyzed))
+        return batch
+
+    def set_sentiments(self, results, index=None):
+        """
+        感情分析の結果 ({'label', 'score', ...} のリスト) を書き込む。
+        index を省略した場合は先頭から順に、指定した場合は index の行に書き込む。
+        """
+        if index is None:
+            index = np.arange(len(results))
+        codes = np.empty(len(results), dtype=np.int8)
+        scores = np.empty(len(results), dtype=np.float32)
+        unknown_labels = set()
+        for position, (i, result) in enumerate(zip(index, results)):
+            label = result.get('label')
+            codes[position] = label_code(label, unknown_labels)
+            scores[position] = result.get('score', 0) or 0
+            extra = {key: value for key, value in result.items() if key not in ('label', 'score')}
+            if codes[position] == UNKNOWN_CODE and label != "UNKNOWN":
+                # 対応しないラベル (LABEL_0 など) は元の値を残しておく
+                extra["raw_label"] = label
+            self.extras[i] = extra or None
+        _warn_unknown_labels(unknown_labels)
+        self.label_codes[index] = codes
+        self.scores[index] = scores
+
+    def set_sentiment(self, mask, label, score=0.0, **extra):
+        """mask (真偽値の配列または添字) の行に同じ結果を書き込む"""
+        unknown_labels = set()
+        self.label_codes[mask] = label_code(label, unknown_labels)
+        _warn_unknown_labels(unknown_labels)
+        self.scores[mask] = score
+        for i in np.flatnonzero(mask) if np.asarray(mask).dtype == bool else mask:
+            self.extras[i] = dict(extra) or None
+
+    def copy_sentiments(self, source, source_index, index=None):
+        """source (TweetBatch) の source_index の行の結果を、self の index の行 (省略時は先頭から) に写す"""
+        if index is None:
+            index = np.arange(len(source_index))
+        self.label_codes[index] = source.label_codes[source_index]
+        self.scores[index] = source.scores[source_index]
+        self.extras[index] = source.extras[source_index]
+
+    def set_tokens(self, token_lists, index=None):
+        """形態素解析の結果を書き込む (バッチ全体に対して呼ぶこと。スライスでは元のバッチに列が作られない)"""
+        if self.tokens is None:
+            self.tokens = object_array(None, len(self))
+        values = object_array(token_lists)
+        if index is None:
+            self.tokens[:len(values)] = values
+        else:
+            self.tokens[index] = values
+
+    def analysis_texts(self):
+        """感情分析に使うテキストの配列 (cleaned_texts。前処理していない行は texts)"""
+        missing = np.equal(self.cleaned_texts, None)
+        return np.where(missing, self.texts, self.cleaned_texts) if missing.any() else self.cleaned_texts
+
+    @property
+    def labels(self):
+        """ラベル名の配列 (未分析は None)"""
+        return _LABEL_ARRAY[self.label_codes]
+
+    def valid_mask(self):
+        """集計対象 (分析済みで ERROR 以外) の行"""
+        return (self.label_codes != NO_LABEL) & (self.label_codes != ERROR_CODE)
+
+    def label_counts(self, weights=None):
+        """{ラベル: 件数} (未分析は含まない)。weights を指定した場合は重み付きの件数"""
+        analyzed = self.label_codes != NO_LABEL
+        counts = np.bincount(self.label_codes[analyzed], weights=None if weights is None else weights[analyzed],
+                             minlength=len(LABELS))
+        return {LABELS[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def sentiment(self, i):
+        """i 行目の感情分析の結果を辞書形式で返す (未分析は None)"""
+        code = self.label_codes[i]
+        if code == NO_LABEL:
+            return None
+        return {"label": LABELS[code], "score": float(round_score(self.scores[i])), **(self.extras[i] or {})}
+
+    def to_dict(self, i, fields=None):
+        tweet = {}
+        for name, key in DICT_KEYS.items():
+            column = getattr(self, name)
+            if column is None or (name in ("cleaned_texts", "tokens") and column[i] is None):
+                continue
+            tweet[key] = column[i]
+        sentiment = self.sentiment(i)
+        if sentiment is not None:
+            tweet['sentiment'] = sentiment
+        if fields is not None:
+            tweet = {key: tweet[key] for key in fields if key in tweet}
+        return tweet
+
+    def to_dicts(self):
+        """これまでの辞書形式のリストに変換する"""
+        return [self.to_dict(i) for i in range(len(self))]
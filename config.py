@@ -7,4 +7,111 @@ load_dotenv()
 X_API_KEY = os.getenv("")
 X_API_SECRET_KEY = os.getenv("")
 X_BEARER_TOKEN = os.getenv("")
-# 他の設定値もここに追加
\ No newline at end of file
+# 他の設定値もここに追加
+
+# Twitter (X) API v2 recent search 設定 (ローカルのスタブサーバーで試験する場合は URL を差し替える)
+TWITTER_BEARER_TOKEN = os.getenv("TWITTER_BEARER_TOKEN", X_BEARER_TOKEN)
+TWITTER_SEARCH_URL = os.getenv("TWITTER_SEARCH_URL", "https://api.twitter.com/2/tweets/search/recent")
+# 1タスクで収集する最大ツイート数 (100件を超える場合は next_token でページングする)
+COLLECT_MAX_RESULTS = int(os.getenv("COLLECT_MAX_RESULTS", "50"))
+COLLECT_MAX_CONCURRENT_QUERIES = int(os.getenv("COLLECT_MAX_CONCURRENT_QUERIES", "4"))
+COLLECT_MAX_RETRIES = int(os.getenv("COLLECT_MAX_RETRIES", "5"))
+# /analyze_batch で1回に指定できるキーワードの数 (キーワードごとに最大 COLLECT_MAX_RESULTS 件を収集する)
+ANALYZE_BATCH_MAX_KEYWORDS = int(os.getenv("ANALYZE_BATCH_MAX_KEYWORDS", "5"))
+
+# 感情分析モデル (Hugging Face のモデル名またはローカルのディレクトリ。空の場合は app.analyzer.MODEL_NAME)
+SENTIMENT_MODEL_NAME = os.getenv("SENTIMENT_MODEL_NAME", "")
+# 感情分析モデルの推論バックエンド ('fp32' / 'int8' / 'int8-torchscript')
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "fp32")
+# 量子化・トレース済みモデルの保存先 (起動のたびに作り直さないため)
+SENTIMENT_MODEL_CACHE_DIR = os.getenv("SENTIMENT_MODEL_CACHE_DIR", "data/models")
+# モデルのロード後、リクエストを受け付ける前にウォームアップ推論を行うか
+MODEL_WARMUP_ENABLED = os.getenv("MODEL_WARMUP_ENABLED", "1") == "1"
+# モデルのロード中に /analyze が 503 を返す際の Retry-After (秒)
+MODEL_LOADING_RETRY_AFTER_SECONDS = int(os.getenv("MODEL_LOADING_RETRY_AFTER_SECONDS", "10"))
+
+# 複数の gunicorn ワーカーでのモデルの持ち方
+# - local: ワーカープロセスごとにモデルをロードする (デフォルト)
+# - preload: fork 前のマスタープロセスで一度だけロードし、全ワーカーで共有する (gunicorn --preload で起動すること)
+# - server: モデルサーバープロセス (python -m app.model_server) に Unix ソケット経由で推論を依頼する
+MODEL_SERVING_MODE = os.getenv("MODEL_SERVING_MODE", "local")
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "data/model_server.sock")
+# モデルサーバーへの1リクエストのタイムアウト (秒) と、起動 (モデルのロード) を待つ最大時間 (秒)
+MODEL_SERVER_TIMEOUT_SECONDS = int(os.getenv("MODEL_SERVER_TIMEOUT_SECONDS", "120"))
+MODEL_SERVER_STARTUP_TIMEOUT_SECONDS = int(os.getenv("MODEL_SERVER_STARTUP_TIMEOUT_SECONDS", "600"))
+
+# カスケード分類器 (軽量な1段目で確信度の高いテキストを判定し、残りだけを BERT に回す)
+# 1段目のモデルは python -m app.cascade で BERT のラベルから学習して保存する
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH", "data/models/cascade.joblib")
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.9"))
+# 1段目で判定したテキストのうち、BERT でも確認して一致率を集計する割合
+CASCADE_AUDIT_RATE = float(os.getenv("CASCADE_AUDIT_RATE", "0.05"))
+
+# 感情分析のバッチ推論設定
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "16"))
+SENTIMENT_MAX_TOKENS_PER_BATCH = int(os.getenv("SENTIMENT_MAX_TOKENS_PER_BATCH", "4096"))
+
+# 感情分析結果キャッシュ設定 (メモリ LRU + SQLite)
+SENTIMENT_CACHE_ENABLED = os.getenv("SENTIMENT_CACHE_ENABLED", "1") == "1"
+SENTIMENT_CACHE_PATH = os.getenv("SENTIMENT_CACHE_PATH", "data/sentiment_cache.sqlite3")
+SENTIMENT_CACHE_MEMORY_SIZE = int(os.getenv("SENTIMENT_CACHE_MEMORY_SIZE", "10000"))
+SENTIMENT_CACHE_MAX_ROWS = int(os.getenv("SENTIMENT_CACHE_MAX_ROWS", "200000"))
+SENTIMENT_CACHE_MAX_AGE_SECONDS = int(os.getenv("SENTIMENT_CACHE_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+
+# 推論ワーカー設定 (全タスクのテキストをまとめてバッチ推論する)
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "64"))
+INFERENCE_MAX_WAIT_MS = int(os.getenv("INFERENCE_MAX_WAIT_MS", "20"))
+# 0 の場合は torch のデフォルトスレッド数を使用
+INFERENCE_NUM_THREADS = int(os.getenv("INFERENCE_NUM_THREADS", "0"))
+# 推論結果を待つ最大秒数 (ワーカーが止まった場合にリクエストをブロックし続けないため。0 の場合は無制限)
+INFERENCE_RESULT_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_RESULT_TIMEOUT_SECONDS", "300"))
+
+# 分析タスクの実行設定 (ワーカー数・待ち行列の上限・ステージごとの同時実行数)
+TASK_MAX_WORKERS = int(os.getenv("TASK_MAX_WORKERS", "4"))
+TASK_MAX_PENDING = int(os.getenv("TASK_MAX_PENDING", "32"))
+TASK_MAX_CONCURRENT_COLLECT = int(os.getenv("TASK_MAX_CONCURRENT_COLLECT", "4"))
+TASK_MAX_CONCURRENT_INFERENCE = int(os.getenv("TASK_MAX_CONCURRENT_INFERENCE", "2"))
+# 待ち行列が満杯の場合に Retry-After ヘッダーで返す秒数
+TASK_RETRY_AFTER_SECONDS = int(os.getenv("TASK_RETRY_AFTER_SECONDS", "30"))
+
+# タスク状態・結果の保存先 ('sqlite' は複数プロセスで共有可能、'memory' は単一プロセス用)
+TASK_STORE_BACKEND = os.getenv("TASK_STORE_BACKEND", "sqlite")
+TASK_STORE_PATH = os.getenv("TASK_STORE_PATH", "data/tasks.sqlite3")
+TASK_TTL_SECONDS = int(os.getenv("TASK_TTL_SECONDS", "3600"))
+TASK_MAX_STORED = int(os.getenv("TASK_MAX_STORED", "1000"))
+
+# 進捗配信 (SSE) 設定
+# 感情分析をこの件数ごとに区切って途中集計を配信する
+STREAM_PROGRESS_CHUNK_SIZE = int(os.getenv("STREAM_PROGRESS_CHUNK_SIZE", "64"))
+STREAM_HEARTBEAT_SECONDS = int(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+# キーワード監視モード (since_id チェックポイントとローリング集計) 設定
+MONITOR_DB_PATH = os.getenv("MONITOR_DB_PATH", "data/monitor.sqlite3")
+# 0 の場合は古いツイートを集計から除外しない
+MONITOR_RETENTION_SECONDS = int(os.getenv("MONITOR_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# 監視モードの1回の実行で取得する最大ツイート数 (前回以降の新しいツイートを next_token でたどって取得する)
+# 上限に達した場合、取得しきれなかった古い範囲は次回の実行で取得する
+MONITOR_MAX_RESULTS = int(os.getenv("MONITOR_MAX_RESULTS", "500"))
+
+# グラフの出力形式 ('png' / 'svg' / 'json') と描画用のプロセス数 (0 の場合は分析スレッド内で描画する)
+CHART_FORMAT = os.getenv("CHART_FORMAT", "png")
+CHART_RENDER_PROCESSES = int(os.getenv("CHART_RENDER_PROCESSES", "1"))
+
+# 時間帯ごとの感情の推移 (pandas のオフセット表記: '15min' / '1h' / '1D' など。空文字で無効)
+TREND_INTERVAL = os.getenv("TREND_INTERVAL", "1h")
+# レポートに載せる直近の時間帯の数
+TREND_MAX_BUCKETS = int(os.getenv("TREND_MAX_BUCKETS", "24"))
+
+# タスクごとの処理時間の内訳 (段階ごとの秒数・件数) を結果の "profile" に含めるか
+# (無効でも /analyze のリクエストで "profile": true を指定したタスクは含める)
+TASK_PROFILING_ENABLED = os.getenv("TASK_PROFILING_ENABLED", "0") == "1"
+
+# 近似重複 (コピペ・bot 投稿) の抑制設定 (MinHash による推定 Jaccard 類似度のしきい値)
+# 有効にすると、近似重複のツイートには代表のツイートの分析結果を使う (既定は無効)
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "0") == "1"
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.8"))
+
+# 話題の語を抽出するための形態素解析設定 (プロセス数 0 は CPU コア数)
+TOKENIZE_ENABLED = os.getenv("TOKENIZE_ENABLED", "1") == "1"
+TOKENIZE_PROCESSES = int(os.getenv("TOKENIZE_PROCESSES", "0"))
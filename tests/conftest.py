@@ -0,0 +1,41 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+# リポジトリのルート (app / config) を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.main を import するテスト用の設定 (config の読み込みより前に設定する)
+# 状態はメモリか一時ディレクトリに置き、グラフは JSON で同じプロセス内で作る。
+# 起動時のモデルのロードは存在しないパスで失敗させ、テストごとに差し替える
+_TEST_DATA_DIR = tempfile.mkdtemp(prefix="social-listening-tests-")
+for _name, _value in {
+    "TASK_STORE_BACKEND": "memory",
+    "SENTIMENT_CACHE_ENABLED": "0",
+    "MONITOR_DB_PATH": os.path.join(_TEST_DATA_DIR, "monitor.sqlite3"),
+    "SENTIMENT_MODEL_NAME": os.path.join(_TEST_DATA_DIR, "no-model"),
+    "CHART_FORMAT": "json",
+    "CHART_RENDER_PROCESSES": "0",
+    "TOKENIZE_PROCESSES": "1",
+}.items():
+    os.environ.setdefault(_name, _value)
+
+# 小さな BERT (app.benchmark.build_tiny_model) の語彙に含める文字
+TINY_MODEL_TEXTS = (
+    "この映画、本当に感動した！素晴らしいストーリーだった。",
+    "今日のランチは最悪だった。味がひどいし、サービスも悪い。",
+    "まあ、悪くはないけど、期待していたほどではなかったな。",
+    "トレース用のサンプル文です。",
+)
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """ランダムな重みの小さな BERT とトークナイザーを保存したディレクトリ"""
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from app.benchmark import build_tiny_model
+    return build_tiny_model(str(tmp_path_factory.mktemp("tiny-model")), TINY_MODEL_TEXTS)
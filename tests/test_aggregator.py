@@ -0,0 +1,76 @@
+# tests/test_aggregator.py
+import json
+
+import pytest
+
+from app.aggregator import SentimentAggregator
+from app.tweet_batch import TweetBatch
+
+LABEL_CYCLE = ("ポジティブ", "ネガティブ", "ニュートラル", "ポジティブ", "ERROR")
+# 同点のスコアを多く含める (例の並びは先に追加された方が優先される)
+SCORE_CYCLE = (0.9, 0.75, 0.9, 0.5, 0.75, 0.9, 0.6)
+
+
+def make_tweets(count):
+    tweets = []
+    for i in range(count):
+        label = LABEL_CYCLE[i % len(LABEL_CYCLE)]
+        tweets.append({
+            "id": str(i), "text": f"text {i}", "cleaned_text": f"text {i}",
+            "created_at": "2026-01-01T00:00:00Z", "source_url": f"https://twitter.com/u/status/{i}",
+            "sentiment": {"label": label, "score": 0.0 if label == "ERROR" else SCORE_CYCLE[i % len(SCORE_CYCLE)]},
+        })
+    # 未分析のツイートは件数 (seen) だけに数える
+    tweets.append({"id": "unanalyzed", "text": "x", "cleaned_text": "x"})
+    return tweets
+
+
+def example_ids(aggregator):
+    return {label: [example["id"] for example in examples] for label, examples in aggregator.examples().items()}
+
+
+def summary(aggregator):
+    data = aggregator.to_dict()
+    data["score_sums"] = {label: pytest.approx(value) for label, value in data["score_sums"].items()}
+    data["examples"] = example_ids(aggregator)
+    return data
+
+
+def test_add_batch_matches_repeated_add():
+    tweets = make_tweets(40)
+    one_by_one = SentimentAggregator().add_many(tweets)
+    batched = SentimentAggregator().add_batch(TweetBatch.from_dicts(tweets))
+
+    assert summary(batched) == summary(one_by_one)
+    assert one_by_one.seen == 41
+    assert one_by_one.counts == {"ポジティブ": 16, "ネガティブ": 8, "ニュートラル": 8}
+    # スコアの高い順、同点は先に追加された順
+    assert example_ids(one_by_one)["ポジティブ"] == ["0", "5", "23", "28", "30"]
+
+
+@pytest.mark.parametrize("split", [0, 7, 20, 41])
+def test_merge_of_parts_matches_a_single_pass(split):
+    tweets = make_tweets(40)
+    whole = SentimentAggregator().add_many(tweets)
+    merged = SentimentAggregator().add_many(tweets[:split]).merge(SentimentAggregator().add_many(tweets[split:]))
+    assert summary(merged) == summary(whole)
+
+    # 列指向の集計同士でも同じ
+    halves = [SentimentAggregator().add_batch(TweetBatch.from_dicts(part)) for part in (tweets[:split], tweets[split:])]
+    assert summary(halves[0].merge(halves[1])) == summary(whole)
+
+
+def test_merge_rejects_different_histogram_bins():
+    with pytest.raises(ValueError):
+        SentimentAggregator(histogram_bins=10).merge(SentimentAggregator(histogram_bins=5))
+
+
+def test_to_dict_round_trips_through_json():
+    tweets = make_tweets(40)
+    aggregator = SentimentAggregator().add_many(tweets[:25])
+    restored = SentimentAggregator.from_dict(json.loads(json.dumps(aggregator.to_dict(), ensure_ascii=False)))
+    assert restored.to_dict() == aggregator.to_dict()
+
+    # 復元した集計に続きを追加しても、最初から1回で集計した場合と同じになる (bulk の再開)
+    restored.add_many(tweets[25:])
+    assert summary(restored) == summary(SentimentAggregator().add_many(tweets))
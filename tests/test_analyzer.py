@@ -0,0 +1,68 @@
+# tests/test_analyzer.py
+import pytest
+
+from app.analyzer import LABEL_MAP, SentimentAnalyzer
+from conftest import TINY_MODEL_TEXTS
+
+# 長さの異なるテキストを混ぜ、ソート後のバッチ分割で入力順が入れ替わるようにする
+TEXTS = [
+    TINY_MODEL_TEXTS[0] * 3,
+    "最悪。",
+    "",
+    TINY_MODEL_TEXTS[1],
+    "感動した",
+    None,
+    TINY_MODEL_TEXTS[2] * 2,
+    "   ",
+    TINY_MODEL_TEXTS[3],
+]
+
+
+@pytest.fixture(scope="module")
+def analyzer(tiny_model_dir):
+    analyzer = SentimentAnalyzer(tiny_model_dir)
+    assert analyzer.is_loaded, analyzer.load_error
+    return analyzer
+
+
+def test_batch_results_follow_input_order_and_match_single_results(analyzer):
+    # 件数とトークン数の上限を小さくして、複数のバッチに分ける
+    batch = analyzer.analyze_batch(TEXTS, batch_size=2, max_tokens_per_batch=64)
+    assert len(batch) == len(TEXTS)
+    for text, result in zip(TEXTS, batch):
+        single = analyzer.analyze_sentiment(text)
+        assert result["label"] == single["label"]
+        assert result["score"] == pytest.approx(single["score"], abs=1e-3)
+        assert result["label"] in LABEL_MAP.values()
+
+
+def test_batch_splitting_does_not_change_results(analyzer):
+    one_batch = analyzer.analyze_batch(TEXTS, batch_size=len(TEXTS))
+    split = analyzer.analyze_batch(TEXTS, batch_size=1)
+    assert [result["label"] for result in split] == [result["label"] for result in one_batch]
+    assert [result["score"] for result in split] == pytest.approx([result["score"] for result in one_batch], abs=1e-3)
+
+
+def test_empty_input_gets_the_same_label_on_both_paths(analyzer):
+    expected = {"label": LABEL_MAP["NEUTRAL"], "score": 0.0, "note": "Empty or invalid input text"}
+    assert analyzer.analyze_sentiment("") == expected
+    assert analyzer.analyze_batch(["", " "]) == [expected, expected]
+
+
+def test_cache_file_name_depends_on_backend_and_torch_version(monkeypatch, tmp_path):
+    torch = pytest.importorskip("torch")
+    analyzer = SentimentAnalyzer.__new__(SentimentAnalyzer)
+    analyzer.model_name, analyzer.model_cache_dir = "org/model", str(tmp_path)
+
+    def cache_name(backend, version):
+        analyzer.backend = backend
+        monkeypatch.setattr(torch, "__version__", version)
+        return analyzer._cache_path()
+
+    assert cache_name("int8", "2.3.0") == str(tmp_path / "org__model.int8.torch-2.3.0.pt")
+    assert cache_name("int8-torchscript", "2.3.0") == str(tmp_path / "org__model.int8-torchscript.torch-2.3.0.ts")
+    # torch を更新すると古いキャッシュは使わずに作り直す
+    assert cache_name("int8", "2.4.1") != cache_name("int8", "2.3.0")
+
+    analyzer.model_cache_dir = None
+    assert analyzer._cache_path() is None
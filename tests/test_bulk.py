@@ -0,0 +1,96 @@
+# tests/test_bulk.py
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import bulk
+from app.aggregator import SentimentAggregator
+from app.preprocessor import Preprocessor
+
+
+class FakeAnalyzer:
+    def analyze_batch(self, texts, batch_size=None):
+        return [{"label": "ポジティブ" if "良い" in text else "ネガティブ", "score": 0.9} for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def worker(monkeypatch):
+    # モデルをロードするワーカープロセスの代わりに、同じプロセスのスレッドで _analyze_chunk を実行する
+    monkeypatch.setitem(bulk._worker, "analyzer", FakeAnalyzer())
+    monkeypatch.setitem(bulk._worker, "preprocessor", Preprocessor(tokenize_processes=1))
+    monkeypatch.setitem(bulk._worker, "batch_size", 8)
+    monkeypatch.setitem(bulk._worker, "tokenize", False)
+    monkeypatch.setattr(bulk.BulkAnalysis, "_get_pool", lambda self: ThreadPoolExecutor(max_workers=2))
+
+
+def write_input(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            text = f"今日は良い天気 {i}" if i % 3 else f"今日は雨 {i}"
+            f.write(json.dumps({"id": str(i), "text": text, "created_at": "2026-01-01T00:00:00Z"},
+                               ensure_ascii=False) + "\n")
+
+
+def make_bulk(tmp_path):
+    return bulk.BulkAnalysis(str(tmp_path / "input.jsonl"), str(tmp_path / "out.jsonl"),
+                             chunk_size=4, processes=2, checkpoint_every=2, trend_interval=None)
+
+
+def read_ids(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+def test_runs_all_chunks_in_order(tmp_path):
+    write_input(tmp_path / "input.jsonl", 22)
+    analysis = make_bulk(tmp_path).run()
+    assert analysis.completed and analysis.records_done == 22
+    assert read_ids(tmp_path / "out.jsonl") == [str(i) for i in range(22)]
+    assert analysis.aggregator.total == 22
+
+
+@pytest.mark.parametrize("fail_at", ["write", "merge"])
+def test_resume_after_crash_while_applying_chunk(tmp_path, monkeypatch, fail_at):
+    write_input(tmp_path / "input.jsonl", 22)
+    first = make_bulk(tmp_path)
+    crash_chunk = 3  # チェックポイント (2チャンクごと) の直後のチャンク
+
+    if fail_at == "write":
+        original_write = first.writer.write
+
+        def write(index, records):
+            if index == crash_chunk:
+                # 一部だけ書き込んだところで中断する
+                original_write(index, records[:2])
+                raise KeyboardInterrupt
+            original_write(index, records)
+
+        monkeypatch.setattr(first.writer, "write", write)
+    else:
+        original_merge = SentimentAggregator.merge
+        crashed = []
+
+        def merge(self, other):
+            if first.next_chunk == crash_chunk and not crashed:
+                crashed.append(True)
+                raise KeyboardInterrupt
+            return original_merge(self, other)
+
+        monkeypatch.setattr(SentimentAggregator, "merge", merge)
+
+    with pytest.raises(KeyboardInterrupt):
+        first.run()
+    with open(first.checkpoint_path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    # 書きかけのチャンクは含めず、直前のチェックポイントのまま
+    assert checkpoint["next_chunk"] == 2 and checkpoint["records_done"] == 8
+
+    resumed = make_bulk(tmp_path)
+    assert resumed.load_checkpoint()
+    resumed.run()
+
+    # 重複も欠落もなく、入力の順に1回ずつ出力される
+    assert read_ids(tmp_path / "out.jsonl") == [str(i) for i in range(22)]
+    assert resumed.records_done == 22
+    assert resumed.aggregator.total == 22
@@ -0,0 +1,109 @@
+# tests/test_cache.py
+import time
+
+from app.cache import CachedSentimentAnalyzer, SentimentCache, make_cache_key
+
+
+class FakeAnalyzer:
+    """analyze_batch に渡されたテキストを記録し、テキストの長さをスコアにして返す"""
+
+    def __init__(self, model_name="m", backend="fp32", results=None):
+        self.model_name = model_name
+        self.backend = backend
+        self.results = results or {}
+        self.calls = []
+
+    def analyze_batch(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return [
+            dict(self.results.get(text, {"label": "ポジティブ", "score": len(text) / 100}))
+            if text and text.strip() else {"label": "ニュートラル", "score": 0.0, "note": "Empty or invalid input text"}
+            for text in texts
+        ]
+
+
+def test_memory_hit_then_disk_hit_then_miss(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = SentimentCache(db_path)
+    cache.put_many({"a": {"label": "ポジティブ", "score": 0.9}})
+
+    assert cache.get_many(["a"]) == {"a": {"label": "ポジティブ", "score": 0.9}}
+    # 別のインスタンス (別プロセス相当) ではメモリが空なので SQLite から読む
+    other = SentimentCache(db_path)
+    assert other.get_many(["a", "b"]) == {"a": {"label": "ポジティブ", "score": 0.9}}
+    # 2回目はメモリから返す
+    assert other.get_many(["a"]) == {"a": {"label": "ポジティブ", "score": 0.9}}
+
+    assert cache.stats()["memory_hits"] == 1
+    stats = other.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_rate"] == round(2 / 3, 4)
+
+
+def test_memory_lru_is_bounded():
+    cache = SentimentCache(memory_size=2)
+    cache.put_many({"a": {"label": "ポジティブ", "score": 0.9}, "b": {"label": "ネガティブ", "score": 0.8}})
+    # a を参照してから c を追加すると、最も古い b が追い出される
+    cache.get_many(["a"])
+    cache.put_many({"c": {"label": "ポジティブ", "score": 0.7}})
+
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_disk_entries_expire_after_max_age(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    SentimentCache(db_path, max_age_seconds=0.2).put_many({"a": {"label": "ポジティブ", "score": 0.9}})
+    time.sleep(0.3)
+
+    # 削除前でも期限切れのエントリは返さない
+    cache = SentimentCache(db_path, max_age_seconds=0.2)
+    assert cache.get_many(["a"]) == {}
+    cache.evict()
+    assert SentimentCache(db_path, max_age_seconds=None).get_many(["a"]) == {}
+
+
+def test_disk_rows_are_evicted_oldest_first(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = SentimentCache(db_path, max_rows=2, evict_every=1)
+    for key in ["a", "b", "c"]:
+        cache.put_many({key: {"label": "ポジティブ", "score": 0.5}})
+        time.sleep(0.01)
+
+    assert set(SentimentCache(db_path).get_many(["a", "b", "c"])) == {"b", "c"}
+
+
+def test_backend_and_model_changes_use_separate_keys():
+    cache = SentimentCache()
+    fp32 = FakeAnalyzer()
+    CachedSentimentAnalyzer(fp32, cache).analyze_batch(["良い"])
+
+    for analyzer in [FakeAnalyzer(backend="int8"), FakeAnalyzer(model_name="other")]:
+        CachedSentimentAnalyzer(analyzer, cache).analyze_batch(["良い"])
+        assert analyzer.calls == [["良い"]]
+    assert make_cache_key("m", "良い") != make_cache_key("m#int8", "良い")
+
+    # 同じモデル・バックエンドなら NFKC と空白の正規化後に同じテキストはヒットする
+    CachedSentimentAnalyzer(fp32, cache).analyze_batch(["良い", " 良い "])
+    assert fp32.calls == [["良い"]]
+
+
+def test_errors_and_notes_are_not_cached():
+    cache = SentimentCache()
+    analyzer = FakeAnalyzer(results={"失敗": {"label": "ERROR", "score": 0.0, "error_message": "boom"}})
+    cached = CachedSentimentAnalyzer(analyzer, cache)
+
+    texts = ["失敗", "", "良い", "良い"]
+    first = cached.analyze_batch(texts)
+    assert [result["label"] for result in first] == ["ERROR", "ニュートラル", "ポジティブ", "ポジティブ"]
+    # 重複したテキストは1回だけ推論する
+    assert analyzer.calls == [["失敗", "良い"], [""]]
+
+    second = cached.analyze_batch(texts)
+    assert second == first
+    # ERROR と空のテキストは毎回推論し直す
+    assert analyzer.calls[2:] == [["失敗"], [""]]
+    assert cache.get_many([make_cache_key("m", "失敗")]) == {}
+
+    cache.put_many({"noted": {"label": "ポジティブ", "score": 0.0, "note": "x"}})
+    assert cache.get_many(["noted"]) == {}
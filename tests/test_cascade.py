@@ -0,0 +1,92 @@
+# tests/test_cascade.py
+import zlib
+
+import numpy as np
+
+from app.cascade import CascadeSentimentAnalyzer
+
+
+class FirstStage:
+    """テキストごとに決めた確率を返す1段目の分類器"""
+
+    classes_ = np.array(["ネガティブ", "ポジティブ"])
+
+    def __init__(self, probabilities):
+        self.probabilities = probabilities
+
+    def predict_proba(self, texts):
+        return np.array([self.probabilities[text] for text in texts])
+
+
+class RecordingModel:
+    """受け取ったテキストを記録し、常に「ニュートラル」を返す (2段目の BERT の代わり)"""
+
+    model_name = "m"
+    backend = "fp32"
+
+    def __init__(self):
+        self.calls = []
+
+    def analyze_batch(self, texts, **kwargs):
+        self.calls.append(list(texts))
+        return [{"label": "ニュートラル", "score": 0.5, "text": text} for text in texts]
+
+
+PROBABILITIES = {
+    "確実に良い": [0.05, 0.95],
+    "確実に悪い": [0.97, 0.03],
+    "どちらとも": [0.4, 0.6],
+    "ぎりぎり": [0.1, 0.9],
+    "少し悪い": [0.8, 0.2],
+}
+
+
+def test_routes_confident_texts_to_the_first_stage_and_keeps_order():
+    model = RecordingModel()
+    cascade = CascadeSentimentAnalyzer(model, FirstStage(PROBABILITIES), threshold=0.9, audit_rate=0)
+    texts = ["どちらとも", "確実に良い", "", "ぎりぎり", "少し悪い", "確実に悪い"]
+
+    results = cascade.analyze_batch(texts)
+    # しきい値以上 (0.9 ちょうども含む) は1段目、それ以外と空のテキストは BERT
+    assert model.calls == [["どちらとも", "", "少し悪い"]]
+    assert [result["label"] for result in results] == [
+        "ニュートラル", "ポジティブ", "ニュートラル", "ポジティブ", "ニュートラル", "ネガティブ",
+    ]
+    assert results[1]["score"] == 0.95 and results[5]["score"] == 0.97
+    assert results[0]["text"] == "どちらとも" and results[4]["text"] == "少し悪い"
+
+    stats = cascade.stats()
+    assert (stats["total"], stats["first_stage"], stats["model"]) == (5, 3, 2)
+    assert stats["first_stage_rate"] == 0.6
+    assert (stats["audited"], stats["audit_agreement"]) == (0, None)
+
+
+def test_audit_sampling_is_deterministic_and_uses_the_model_result():
+    texts = [f"確実なテキスト{i}" for i in range(200)]
+    probabilities = {text: [0.0, 1.0] for text in texts}
+    expected = [text for text in texts if zlib.crc32(text.encode("utf-8")) % 10000 < 0.2 * 10000]
+    assert 0 < len(expected) < len(texts)
+
+    for _ in range(2):
+        model = RecordingModel()
+        cascade = CascadeSentimentAnalyzer(model, FirstStage(probabilities), threshold=0.9, audit_rate=0.2)
+        results = cascade.analyze_batch(texts)
+        # 毎回 (プロセスが変わっても) 同じテキストが抽出される
+        assert model.calls == [expected]
+        # 抽出したテキストは BERT の結果を返す
+        assert [result["label"] for result in results] == [
+            "ニュートラル" if text in expected else "ポジティブ" for text in texts
+        ]
+        stats = cascade.stats()
+        assert (stats["first_stage"], stats["model"], stats["audited"]) == (
+            len(texts) - len(expected), len(expected), len(expected),
+        )
+        assert stats["audit_agreement"] == 0.0
+
+
+def test_threshold_above_one_sends_everything_to_the_model():
+    model = RecordingModel()
+    cascade = CascadeSentimentAnalyzer(model, FirstStage(PROBABILITIES), threshold=1.01, audit_rate=0)
+    cascade.analyze_batch(list(PROBABILITIES))
+    assert model.calls == [list(PROBABILITIES)]
+    assert cascade.stats()["first_stage"] == 0
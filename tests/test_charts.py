@@ -0,0 +1,23 @@
+# tests/test_charts.py
+from app.charts import ChartRenderer, pie_chart_data
+
+
+def test_pie_shares_use_the_report_total():
+    counts = {"ポジティブ": 2, "ネガティブ": 1, "ニュートラル": 1, "UNKNOWN": 4}
+    # レポートの分析件数 (UNKNOWN を含む8件) を分母にする
+    data = ChartRenderer("json", processes=0).render(counts, "AI")
+    assert [(s["label"], s["share"]) for s in data["slices"]] == [
+        ("ポジティブ", 25.0), ("ネガティブ", 12.5), ("ニュートラル", 12.5),
+    ]
+    assert [s["share"] for s in pie_chart_data(counts, "AI")["slices"]] == [50.0, 25.0, 25.0]
+    assert pie_chart_data({"UNKNOWN": 3}, "AI", total=3) is None
+
+
+def test_comparison_shares_use_analyzed_count():
+    summaries = [
+        {"keyword": "A", "counts": {"ポジティブ": 1, "ネガティブ": 1, "ニュートラル": 0}, "analyzed": 4},
+        {"keyword": "B", "counts": {"ポジティブ": 0, "ネガティブ": 0, "ニュートラル": 0}, "analyzed": 0},
+    ]
+    data = ChartRenderer("json", processes=0).render_comparison(summaries)
+    assert data["keywords"] == ["A"] and data["totals"] == [4]
+    assert [series["shares"] for series in data["series"]] == [[25.0], [25.0], [0.0]]
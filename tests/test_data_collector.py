@@ -0,0 +1,190 @@
+# tests/test_data_collector.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from app.data_collector import DataCollectionError, DataCollector
+
+
+class StubTwitterAPI:
+    """
+    recent search API の代わりにローカルで応答する HTTP サーバー。
+    - pages: {クエリのキーワード: [ページの data, ...]} (next_token はページの添字)
+    - failures: 先頭から順に返すエラー応答 [(ステータス, ヘッダー), ...]
+    - failing_keywords: 常に 500 を返すキーワード
+    """
+
+    def __init__(self, pages=None, failures=None, delay=0.0, failing_keywords=()):
+        self.pages = pages or {}
+        self.failures = list(failures or [])
+        self.failing_keywords = set(failing_keywords)
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/2/tweets/search/recent"
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+                with api._lock:
+                    api.requests.append(params)
+                    api.in_flight += 1
+                    api.max_in_flight = max(api.max_in_flight, api.in_flight)
+                    failure = api.failures.pop(0) if api.failures else None
+                    if params["query"].split(" lang:")[0] in api.failing_keywords:
+                        failure = (500, {})
+                try:
+                    time.sleep(api.delay)
+                    if failure:
+                        status, headers = failure
+                        body = {"title": "error"}
+                    else:
+                        status, headers = 200, {"x-rate-limit-remaining": "100"}
+                        body = api.page(params)
+                    data = json.dumps(body).encode("utf-8")
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                finally:
+                    with api._lock:
+                        api.in_flight -= 1
+
+        return Handler
+
+    def page(self, params):
+        keyword = params["query"].split(" lang:")[0]
+        pages = self.pages.get(keyword, [])
+        index = int(params.get("next_token", 0))
+        if index >= len(pages):
+            return {"meta": {"result_count": 0}}
+        meta = {"result_count": len(pages[index])}
+        if index + 1 < len(pages):
+            meta["next_token"] = str(index + 1)
+        return {"data": pages[index], "meta": meta}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_page(start, count, author="u"):
+    return [
+        {"id": str(i), "text": f"tweet {i}", "created_at": "2026-01-01T00:00:00.000Z", "author_id": author}
+        for i in range(start, start + count)
+    ]
+
+
+def make_collector(api, **kwargs):
+    kwargs.setdefault("backoff_seconds", 0.01)
+    return DataCollector(bearer_token="test", search_url=api.url, **kwargs)
+
+
+def test_follows_next_token_until_max_results():
+    pages = {"AI": [make_page(0, 10), make_page(10, 10), make_page(20, 10)]}
+    with StubTwitterAPI(pages) as api:
+        collector = make_collector(api)
+        tweets = collector.search_tweets("AI", max_results=25)
+    assert [tweet["id"] for tweet in tweets] == [str(i) for i in range(25)]
+    assert [request.get("next_token") for request in api.requests] == [None, "1", "2"]
+    # 残りの件数に合わせて1ページの件数を減らす (最小は10件)
+    assert [int(request["max_results"]) for request in api.requests] == [25, 15, 10]
+    assert tweets[0]["source_url"] == "https://twitter.com/u/status/0"
+
+
+def test_stops_when_no_next_token_and_passes_window():
+    with StubTwitterAPI({"AI": [make_page(0, 10)]}) as api:
+        collector = make_collector(api)
+        batches = list(collector.iter_batches("AI", max_results=100, since_id="5", until_id="50"))
+    assert len(api.requests) == 1
+    assert api.requests[0]["since_id"] == "5" and api.requests[0]["until_id"] == "50"
+    assert [len(batch) for batch in batches] == [10]
+
+
+def test_waits_until_rate_limit_reset_after_429():
+    reset_at = time.time() + 0.5
+    failures = [(429, {"x-rate-limit-remaining": "0", "x-rate-limit-reset": str(reset_at)})]
+    with StubTwitterAPI({"AI": [make_page(0, 10)]}, failures=failures) as api:
+        collector = make_collector(api)
+        start = time.time()
+        tweets = collector.search_tweets("AI", max_results=10)
+    assert len(tweets) == 10
+    assert len(api.requests) == 2
+    # リセット時刻まで待ってから再試行する
+    assert time.time() - start >= 0.4
+
+
+def test_retries_server_errors_then_succeeds():
+    failures = [(503, {}), (500, {})]
+    with StubTwitterAPI({"AI": [make_page(0, 10)]}, failures=failures) as api:
+        collector = make_collector(api, max_retries=3)
+        tweets = collector.search_tweets("AI", max_results=10)
+    assert len(tweets) == 10
+    assert len(api.requests) == 3
+
+
+def test_gives_up_after_max_retries():
+    failures = [(503, {})] * 10
+    with StubTwitterAPI({"AI": [make_page(0, 10)]}, failures=failures) as api:
+        collector = make_collector(api, max_retries=2)
+        with pytest.raises(DataCollectionError):
+            collector.search_tweets("AI", max_results=10)
+    assert len(api.requests) == 3
+
+
+def test_client_errors_are_not_retried():
+    with StubTwitterAPI({"AI": [make_page(0, 10)]}, failures=[(401, {})]) as api:
+        collector = make_collector(api, max_retries=3)
+        with pytest.raises(DataCollectionError):
+            collector.search_tweets("AI", max_results=10)
+    assert len(api.requests) == 1
+
+
+def test_iter_many_fetches_queries_concurrently():
+    pages = {
+        "A": [make_page(0, 10), make_page(10, 10)],
+        "B": [make_page(100, 10), make_page(110, 10)],
+        "C": [make_page(200, 10)],
+    }
+    with StubTwitterAPI(pages, delay=0.2) as api:
+        collector = make_collector(api, max_concurrent_queries=3)
+        start = time.time()
+        results = collector.search_many(["A", "B", "C", "A"], max_results=20)
+        elapsed = time.time() - start
+    assert {keyword: len(tweets) for keyword, tweets in results.items()} == {"A": 20, "B": 20, "C": 10}
+    # 重複したキーワードは1回だけ取得する
+    assert len(api.requests) == 5
+    assert api.max_in_flight >= 2
+    # 直列なら 5 x 0.2 秒かかる
+    assert elapsed < 0.9
+
+
+def test_iter_many_raises_after_yielding_other_queries():
+    pages = {"A": [make_page(0, 10)]}
+    with StubTwitterAPI(pages, failing_keywords={"B"}) as api:
+        collector = make_collector(api, max_retries=0)
+        received = []
+        with pytest.raises(DataCollectionError):
+            for keyword, page in collector.iter_many(["A", "B"], max_results=10, as_batches=True):
+                received.append((keyword, len(page)))
+    assert received == [("A", 10)]
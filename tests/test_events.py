@@ -0,0 +1,65 @@
+# tests/test_events.py
+import threading
+
+from app.events import TaskEventBroker, format_sse
+
+
+def test_events_are_delivered_in_order_to_live_subscriber():
+    broker = TaskEventBroker()
+    broker.publish("t1", "pending", {"task_id": "t1"})
+    received = []
+    subscribed = threading.Event()
+
+    def consume():
+        for event, data in broker.subscribe("t1", heartbeat_seconds=0.05):
+            subscribed.set()
+            if event is not None:
+                received.append((event, data))
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    assert subscribed.wait(2)
+    broker.publish("t1", "processing")
+    broker.publish("t1", "progress", {"done": 10})
+    broker.publish("t1", "completed", {"status": "completed"})
+    broker.publish("t1", "progress", {"done": 20})
+    consumer.join(2)
+
+    assert not consumer.is_alive()
+    # 終了イベントで購読が終わり、その後のイベントは届かない
+    assert received == [
+        ("pending", {"task_id": "t1"}),
+        ("processing", {}),
+        ("progress", {"done": 10}),
+        ("completed", {"status": "completed"}),
+    ]
+
+
+def test_late_subscriber_gets_full_history_after_task_finished():
+    broker = TaskEventBroker()
+    for event in ("pending", "processing", "failed"):
+        broker.publish("t1", event, {"event": event})
+    assert [event for event, _ in broker.subscribe("t1")] == ["pending", "processing", "failed"]
+    # 何度購読しても最初から再送される
+    assert [data for _, data in broker.subscribe("t1")][-1] == {"event": "failed"}
+
+
+def test_heartbeat_while_idle():
+    broker = TaskEventBroker()
+    broker.publish("t1", "pending")
+    events = broker.subscribe("t1", heartbeat_seconds=0.01)
+    assert next(events) == ("pending", {})
+    assert next(events) == (None, None)
+
+
+def test_finished_channels_are_purged_after_retention():
+    broker = TaskEventBroker(retention_seconds=0)
+    broker.publish("old", "completed")
+    broker.publish("running", "processing")
+    broker.publish("new", "completed")
+    assert not broker.has_task("old")
+    assert broker.has_task("running")
+
+
+def test_format_sse():
+    assert format_sse("progress", {"ラベル": 1}) == 'event: progress\ndata: {"ラベル": 1}\n\n'
@@ -0,0 +1,115 @@
+# tests/test_inference_worker.py
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from app.inference_worker import InferenceWorker, InferenceWorkerStoppedError
+
+
+class RecordingAnalyzer:
+    """受け取ったバッチを記録し、"boom" を含むバッチでは例外を送出する"""
+
+    model_name = "m"
+    backend = "fp32"
+
+    def __init__(self, release=None):
+        self.batches = []
+        self.release = release
+
+    def analyze_batch(self, texts, **kwargs):
+        if self.release is not None:
+            self.release.wait(5)
+        self.batches.append(list(texts))
+        if "boom" in texts:
+            raise ValueError("boom")
+        return [{"label": "ポジティブ", "score": float(len(text))} for text in texts]
+
+
+@pytest.fixture
+def make_worker():
+    workers = []
+
+    def make(analyzer, **kwargs):
+        worker = InferenceWorker(analyzer, **kwargs)
+        workers.append(worker)
+        return worker
+
+    yield make
+    for worker in workers:
+        worker.stop(timeout=5)
+
+
+def test_batches_up_to_max_batch_size_and_keeps_order(make_worker):
+    analyzer = RecordingAnalyzer()
+    worker = make_worker(analyzer, max_batch_size=4, max_wait_ms=200)
+    texts = ["a" * n for n in range(1, 11)]
+
+    results = worker.analyze_batch(texts)
+    assert [result["score"] for result in results] == [float(n) for n in range(1, 11)]
+    assert [len(batch) for batch in analyzer.batches] == [4, 4, 2]
+    assert sum(analyzer.batches, []) == texts
+
+
+def test_texts_from_separate_calls_share_a_batch_within_max_wait(make_worker):
+    analyzer = RecordingAnalyzer()
+    worker = make_worker(analyzer, max_batch_size=64, max_wait_ms=300)
+    first = worker.submit("a")
+    second = worker.submit("bb")
+    assert (first.result(5)["score"], second.result(5)["score"]) == (1.0, 2.0)
+    assert analyzer.batches == [["a", "bb"]]
+
+    # 待ち時間を過ぎたら件数が少なくても推論する
+    start = time.monotonic()
+    worker.analyze_sentiment("ccc")
+    assert time.monotonic() - start < 2
+    assert analyzer.batches[-1] == ["ccc"]
+
+
+def test_batch_error_is_set_on_every_future_in_the_batch(make_worker):
+    worker = make_worker(RecordingAnalyzer(), max_batch_size=2, max_wait_ms=200)
+    futures = worker.submit_many(["x", "boom", "y"])
+
+    for future in futures[:2]:
+        with pytest.raises(ValueError, match="boom"):
+            future.result(5)
+    # 別のバッチは影響を受けない
+    assert futures[2].result(5)["score"] == 1.0
+
+
+def test_result_timeout(make_worker):
+    release = threading.Event()
+    worker = make_worker(RecordingAnalyzer(release), max_wait_ms=0, result_timeout=0.1)
+    with pytest.raises(TimeoutError):
+        worker.analyze_batch(["a"])
+    release.set()
+
+
+def test_stop_fails_queued_and_later_texts(make_worker):
+    release = threading.Event()
+    worker = make_worker(RecordingAnalyzer(release), max_batch_size=1, max_wait_ms=0)
+    futures = worker.submit_many(["a", "b", "c"])
+    time.sleep(0.1)
+
+    # 推論中のバッチは完了させ、キューに残っているテキストは失敗させる
+    worker.stop(timeout=0.1)
+    for future in futures[1:]:
+        with pytest.raises(InferenceWorkerStoppedError):
+            future.result(1)
+    release.set()
+    assert futures[0].result(5)["score"] == 1.0
+
+    # 停止後に渡したテキストはブロックせずに失敗する
+    with pytest.raises(InferenceWorkerStoppedError):
+        worker.analyze_sentiment("d")
+    worker._thread.join(5)
+    assert not worker._thread.is_alive()
+
+
+def test_stop_processes_queued_texts_without_timeout(make_worker):
+    analyzer = RecordingAnalyzer()
+    worker = make_worker(analyzer, max_batch_size=1, max_wait_ms=0)
+    futures = worker.submit_many(["a", "bb"])
+    worker.stop()
+    assert [future.result(0)["score"] for future in futures] == [1.0, 2.0]
@@ -0,0 +1,169 @@
+# tests/test_main.py
+import threading
+import time
+
+import pytest
+
+from app.data_collector import DataCollector
+from app.model_loader import BackgroundModelLoader
+
+# キーワードごとに返すツイート ID (A と B は 3〜5 が重複する)
+CORPUS = {"A": range(0, 6), "B": range(3, 9), "C": range(20, 22)}
+
+
+def tweet_text(tweet_id):
+    return f"{'良い' if tweet_id % 2 == 0 else '悪い'}話 {tweet_id}"
+
+
+class KeywordAnalyzer:
+    """テキストの語でラベルを決め、推論したテキストを記録する"""
+
+    model_name = "stub"
+    backend = "fp32"
+
+    def __init__(self):
+        self.texts = []
+
+    def analyze_batch(self, texts, **kwargs):
+        self.texts.extend(texts)
+        return [{"label": "ポジティブ" if "良い" in text else "ネガティブ", "score": 0.9} for text in texts]
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def analyzer():
+    return KeywordAnalyzer()
+
+
+@pytest.fixture
+def main(monkeypatch, analyzer):
+    from app import main
+
+    collector = DataCollector(bearer_token="test", max_retries=0)
+    collector.requested = []
+
+    def request_page(params):
+        keyword = params["query"].split(" lang:")[0]
+        collector.requested.append(keyword)
+        data = [
+            {"id": str(i), "text": f"{tweet_text(i)} #{keyword} https://example.com",
+             "created_at": "2026-01-01T00:00:00.000Z", "author_id": "u"}
+            for i in CORPUS[keyword]
+        ]
+        return {"data": data, "meta": {"result_count": len(data)}}
+
+    collector._request_page = request_page
+    loader = BackgroundModelLoader(lambda: analyzer)
+    loader.start()
+    loader.wait()
+    monkeypatch.setattr(main, "data_collector", collector)
+    monkeypatch.setattr(main, "model_loader", loader)
+    return main
+
+
+def test_collect_many_deduplicates_and_attributes_to_every_keyword(main, analyzer):
+    tweets, members, fetched = main.collect_many("t", ["A", "B", "C"])
+
+    assert sorted(main.data_collector.requested) == ["A", "B", "C"]
+    assert fetched == {"A": 6, "B": 6, "C": 2}
+    assert sorted(int(tweet_id) for tweet_id in tweets.ids) == [*range(0, 9), 20, 21]
+    # 重複したツイートも、取得したすべてのキーワードに属する
+    for keyword, tweet_ids in CORPUS.items():
+        assert sorted(int(tweet_id) for tweet_id in tweets.ids[members[keyword]]) == list(tweet_ids)
+    assert tweets.cleaned_texts.tolist() == [tweet_text(int(tweet_id)) for tweet_id in tweets.ids]
+
+    analyzed = main.analyze_collected("t", tweets)
+    # 推論も重複を除いたツイートに1回だけ行う
+    assert sorted(analyzer.texts) == sorted(tweets.cleaned_texts.tolist())
+    assert [sentiment["label"] for sentiment in map(analyzed.sentiment, range(len(analyzed)))] == [
+        "ポジティブ" if int(tweet_id) % 2 == 0 else "ネガティブ" for tweet_id in analyzed.ids
+    ]
+
+
+def test_analyze_batch_reports_overlaps_between_keywords(main, analyzer):
+    client = main.app.test_client()
+    response = client.post("/analyze_batch", json={"keywords": ["A", "B", " A ", "C"]})
+    assert response.status_code == 202
+    task_id = response.get_json()["task_id"]
+    wait_until(lambda: client.get(f"/status/{task_id}").get_json()["status"] in ("completed", "failed"))
+
+    status = client.get(f"/status/{task_id}").get_json()
+    assert status["status"] == "completed", status["result"]
+    result = status["result"]
+    assert result["keywords"] == ["A", "B", "C"]
+    # 重複したツイートは1回だけ推論する
+    assert len(analyzer.texts) == 11
+
+    comparison = result["comparison"]
+    assert (comparison["fetched_tweets"], comparison["unique_tweets"]) == (14, 11)
+    summaries = {summary["keyword"]: summary for summary in comparison["keywords"]}
+    assert summaries["A"]["counts"] == {"ポジティブ": 3, "ネガティブ": 3, "ニュートラル": 0}
+    assert summaries["B"]["counts"] == {"ポジティブ": 3, "ネガティブ": 3, "ニュートラル": 0}
+    assert summaries["C"]["counts"] == {"ポジティブ": 1, "ネガティブ": 1, "ニュートラル": 0}
+    assert {keyword: summary["exclusive"] for keyword, summary in summaries.items()} == {"A": 3, "B": 3, "C": 2}
+    assert comparison["overlaps"] == [
+        {"keywords": ["A", "B"], "shared": 3, "jaccard": 0.3333},
+        {"keywords": ["A", "C"], "shared": 0, "jaccard": 0.0},
+        {"keywords": ["B", "C"], "shared": 0, "jaccard": 0.0},
+    ]
+    assert [report["keyword"] for report in result["reports"]] == ["A", "B", "C"]
+    assert "「A」と「B」: 3件" in result["text_report"]
+
+
+@pytest.mark.parametrize("body", [{"keywords": "A"}, {"keywords": []}, {"keywords": [" "]}, {"keywords": list("ABCDEF")}])
+def test_analyze_batch_rejects_invalid_keywords(main, body):
+    assert main.app.test_client().post("/analyze_batch", json=body).status_code == 400
+
+
+def test_not_ready_until_the_model_is_loaded(main, analyzer, monkeypatch):
+    release = threading.Event()
+
+    def load():
+        if not release.wait(5):
+            raise RuntimeError("load was not released")
+        return analyzer
+
+    loader = BackgroundModelLoader(load)
+    loader.start()
+    monkeypatch.setattr(main, "model_loader", loader)
+    client = main.app.test_client()
+
+    # ロード中もプロセスは応答するが、分析は受け付けない
+    assert client.get("/healthz").status_code == 200
+    ready = client.get("/readyz")
+    assert ready.status_code == 503 and ready.get_json()["status"] == "loading"
+    for path, body in [("/analyze", {"keyword": "A"}), ("/analyze_batch", {"keywords": ["A", "B"]})]:
+        response = client.post(path, json=body)
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == str(main.MODEL_LOADING_RETRY_AFTER_SECONDS)
+
+    release.set()
+    assert loader.wait(5)
+    assert client.get("/readyz").status_code == 200
+    response = client.post("/analyze", json={"keyword": "A"})
+    assert response.status_code == 202
+    task_id = response.get_json()["task_id"]
+    wait_until(lambda: client.get(f"/status/{task_id}").get_json()["status"] == "completed")
+
+
+def test_failed_load_is_reported_without_retry_after(main, monkeypatch):
+    def fail():
+        raise RuntimeError("no weights")
+
+    loader = BackgroundModelLoader(fail)
+    loader.start()
+    loader.wait(5)
+    monkeypatch.setattr(main, "model_loader", loader)
+    client = main.app.test_client()
+
+    ready = client.get("/readyz")
+    assert ready.status_code == 503
+    assert ready.get_json()["status"] == "failed" and ready.get_json()["error"] == "no weights"
+    response = client.post("/analyze", json={"keyword": "A"})
+    assert response.status_code == 503 and "Retry-After" not in response.headers
@@ -0,0 +1,88 @@
+# tests/test_metrics.py
+import threading
+
+import pytest
+
+from app import metrics
+from app.metrics import MetricsRegistry
+
+
+def test_render_counter_and_gauge_with_escaped_labels():
+    registry = MetricsRegistry()
+    requests = registry.counter("app_requests_total", 'Requests by "status"\nand path', ("status", "path"))
+    requests.inc(status=200, path="/a")
+    requests.inc(2, status=200, path="/a")
+    requests.inc(status="error", path='C:\\tmp "x"\nnext')
+    registry.gauge("app_queue_depth", "Queue depth", function=lambda: 7)
+    registry.gauge("app_unknown", "Not reported yet", function=lambda: None)
+
+    assert registry.render().splitlines() == [
+        '# HELP app_requests_total Requests by \\"status\\"\\nand path',
+        "# TYPE app_requests_total counter",
+        'app_requests_total{status="200",path="/a"} 3',
+        'app_requests_total{status="error",path="C:\\\\tmp \\"x\\"\\nnext"} 1',
+        "# HELP app_queue_depth Queue depth",
+        "# TYPE app_queue_depth gauge",
+        "app_queue_depth 7",
+        "# HELP app_unknown Not reported yet",
+        "# TYPE app_unknown gauge",
+    ]
+
+
+def test_render_histogram_buckets_sum_and_count():
+    registry = MetricsRegistry()
+    seconds = registry.histogram("app_seconds", "Time", ("stage",), buckets=(0.5, 0.1, 1))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        seconds.observe(value, stage="clean")
+
+    assert registry.render().splitlines() == [
+        "# HELP app_seconds Time",
+        "# TYPE app_seconds histogram",
+        # 境界ちょうどの値はその境界に含める (le)
+        'app_seconds_bucket{stage="clean",le="0.1"} 2',
+        'app_seconds_bucket{stage="clean",le="0.5"} 3',
+        'app_seconds_bucket{stage="clean",le="1"} 3',
+        'app_seconds_bucket{stage="clean",le="+Inf"} 4',
+        'app_seconds_sum{stage="clean"} 2.45',
+        'app_seconds_count{stage="clean"} 4',
+    ]
+
+
+def test_failing_function_does_not_hide_other_metrics():
+    registry = MetricsRegistry()
+
+    def fail():
+        raise RuntimeError("gone")
+
+    registry.gauge("app_broken", "Broken", function=fail)
+    registry.counter("app_ok_total", "OK").inc()
+    assert registry.render().splitlines() == [
+        "# app_broken unavailable: gone", "# HELP app_ok_total OK", "# TYPE app_ok_total counter", "app_ok_total 1",
+    ]
+    with pytest.raises(ValueError):
+        registry.counter("app_ok_total", "again")
+
+
+def test_profiling_collects_spans_of_the_current_task_only():
+    metrics.record_span("outside", 1.0, 5)
+    with metrics.profiling() as profile:
+        with metrics.span("clean", 3):
+            pass
+        metrics.record_span("inference", 0.25, 10)
+        metrics.record_span("inference", 0.5, 6)
+        assert list(metrics.timed_iter("collect", [[1, 2], [3]])) == [[1, 2], [3]]
+        # 別のスレッド (推論ワーカーなど) で記録したスパンは含まない
+        worker = threading.Thread(target=metrics.record_span, args=("worker", 1.0, 1))
+        worker.start()
+        worker.join()
+    metrics.record_span("after", 1.0, 1)
+
+    breakdown = profile.to_dict()
+    assert set(breakdown["stages"]) == {"clean", "inference", "collect"}
+    assert breakdown["stages"]["inference"] == {"calls": 2, "seconds": 0.75, "items": 16}
+    assert breakdown["stages"]["collect"]["calls"] == 2 and breakdown["stages"]["collect"]["items"] == 3
+    assert breakdown["stages"]["clean"]["items"] == 3
+    assert breakdown["total_seconds"] >= 0
+
+    with metrics.profiling(False) as disabled:
+        assert disabled is None
@@ -0,0 +1,100 @@
+# tests/test_model_server.py
+import multiprocessing
+import os
+import socket
+import threading
+
+import pytest
+
+from app.analyzer import AnalyzerWrapper
+from app.model_server import ModelServer, ModelServerClient, recv_message, send_message
+
+
+class EchoAnalyzer:
+    """テキストの長さをスコアにして返す。"boom" を含むバッチでは例外を送出する"""
+
+    model_name = "m"
+    backend = "int8"
+
+    def analyze_batch(self, texts, **kwargs):
+        if "boom" in texts:
+            raise ValueError("boom")
+        return [{"label": "ポジティブ", "score": len(text)} for text in texts]
+
+    def pending(self):
+        return 0
+
+
+def serve(socket_path):
+    ModelServer(socket_path, EchoAnalyzer()).serve_forever()
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    # Unix ソケットのパスは長さの上限 (108バイト程度) があるので短くする
+    path = os.path.join(str(tmp_path), "m.sock")
+    if len(path) >= 100:
+        pytest.skip("temporary path is too long for a Unix socket")
+    return path
+
+
+@pytest.fixture
+def server(socket_path):
+    server = ModelServer(socket_path, EchoAnalyzer())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_messages_round_trip_with_length_prefix():
+    left, right = socket.socketpair()
+    with left, right:
+        # 送信バッファより大きなメッセージも分割して受信する
+        message = {"op": "analyze", "texts": ["日本語のテキスト😊", "x" * 300000]}
+        sender = threading.Thread(target=send_message, args=(left, message))
+        sender.start()
+        assert recv_message(right) == message
+        sender.join()
+
+        left.close()
+        with pytest.raises(ConnectionError):
+            recv_message(right)
+
+
+def test_client_round_trip(server, socket_path):
+    client = ModelServerClient(socket_path, timeout=5).wait_until_ready(5, interval=0.05)
+    assert isinstance(client, AnalyzerWrapper)
+    assert (client.model_name, client.backend, client.sentiment_pipeline) == ("m", "int8", None)
+
+    assert client.analyze_batch(["あ", "いい", ""]) == [
+        {"label": "ポジティブ", "score": 1}, {"label": "ポジティブ", "score": 2}, {"label": "ポジティブ", "score": 0},
+    ]
+    assert client.analyze_batch([]) == []
+    assert client.analyze_sentiment("ううう")["score"] == 3
+    assert client.status()["pending"] == 0
+
+    # サーバー側の例外はエラー応答として返り、接続はそのまま使い続けられる
+    with pytest.raises(RuntimeError, match="boom"):
+        client.analyze_batch(["boom"])
+    with pytest.raises(RuntimeError, match="Unknown op"):
+        client._call({"op": "nope"})
+    assert client.analyze_sentiment("ok")["score"] == 2
+
+
+def test_client_raises_when_the_server_dies(socket_path):
+    process = multiprocessing.get_context("fork").Process(target=serve, args=(socket_path,), daemon=True)
+    process.start()
+    try:
+        client = ModelServerClient(socket_path, timeout=5).wait_until_ready(10, interval=0.05)
+        assert client.analyze_sentiment("ok")["score"] == 2
+    finally:
+        process.kill()
+        process.join(5)
+
+    # 保持している接続が切れ、再接続も失敗する
+    with pytest.raises((ConnectionError, OSError)):
+        client.analyze_sentiment("ok")
+    with pytest.raises(TimeoutError):
+        ModelServerClient(socket_path, timeout=1).wait_until_ready(0.2, interval=0.05)
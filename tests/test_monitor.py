@@ -0,0 +1,57 @@
+# tests/test_monitor.py
+import pytest
+
+from app.monitor import KeywordMonitor, advance_checkpoint
+
+
+def tweet(tweet_id, label="ポジティブ", score=0.9):
+    return {
+        'id': str(tweet_id),
+        'created_at': "2026-01-01T00:00:00.000Z",
+        'cleaned_text': f"text {tweet_id}",
+        'source_url': f"https://twitter.com/u/status/{tweet_id}",
+        'sentiment': {'label': label, 'score': score},
+    }
+
+
+@pytest.mark.parametrize("previous, scored, failed, complete, expected", [
+    # 範囲をすべて取得できた場合は最新の ID まで進める
+    ((None, None, None), ["5", "7"], [], True, ("7", None, None)),
+    (("3", None, None), [], [], True, ("3", None, None)),
+    # 上限で打ち切った場合は since_id を進めず、取得できた範囲を記録する
+    (("3", None, None), ["50", "60"], [], False, ("3", "50", "60")),
+    # 取得しきれなかった範囲を埋めたら、記録していた最新の ID まで進める
+    (("3", "50", "60"), ["10", "20"], [], True, ("60", None, None)),
+    (("3", "50", "60"), ["30", "40"], [], False, ("3", "30", "60")),
+    # 失敗したツイートは越えない (次回もう一度取得する)
+    (("3", None, None), ["5", "9"], ["7"], True, ("5", "9", "9")),
+    (("5", "9", "9"), ["7"], [], True, ("9", None, None)),
+    (("3", None, None), ["5"], ["9"], True, ("5", None, None)),
+    (("3", None, None), [], ["9"], True, ("3", None, None)),
+])
+def test_advance_checkpoint(previous, scored, failed, complete, expected):
+    assert advance_checkpoint(*previous, scored, failed, complete) == expected
+
+
+def test_record_does_not_skip_failed_tweets(tmp_path):
+    monitor = KeywordMonitor(str(tmp_path / "monitor.sqlite3"))
+    monitor.record("AI", [tweet(1), tweet(2, label="ERROR", score=0.0), tweet(3)])
+    assert monitor.get_window("AI") == ("1", "3")
+    assert monitor.snapshot("AI")['counts'] == {"ポジティブ": 2}
+
+    # 次回は失敗したツイートの範囲だけを取得し、取り込めたら最新まで進める
+    assert monitor.record("AI", [tweet(2)]) == 1
+    assert monitor.get_window("AI") == ("3", None)
+    assert monitor.snapshot("AI")['counts'] == {"ポジティブ": 3}
+
+
+def test_record_keeps_unfetched_range_after_truncated_run(tmp_path):
+    monitor = KeywordMonitor(str(tmp_path / "monitor.sqlite3"))
+    monitor.record("AI", [tweet(10)])
+    # 上限で打ち切られ、新しい方の 50〜60 だけを取得した
+    monitor.record("AI", [tweet(60), tweet(55), tweet(50)], complete=False)
+    assert monitor.get_window("AI") == ("10", "50")
+    # 残りの範囲 (10, 50) を取得し終えたら、取得済みの最新まで進める
+    monitor.record("AI", [tweet(40), tweet(20)], complete=True)
+    assert monitor.get_window("AI") == ("60", None)
+    assert monitor.snapshot("AI")['counts'] == {"ポジティブ": 6}
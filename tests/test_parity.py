@@ -0,0 +1,44 @@
+# tests/test_parity.py
+import os
+
+import pytest
+
+from app.analyzer import SentimentAnalyzer
+from app.parity import SAMPLE_TEXTS, compare
+from conftest import TINY_MODEL_TEXTS
+
+TEXTS = list(SAMPLE_TEXTS) + list(TINY_MODEL_TEXTS)
+
+
+def test_compare_skips_errors_and_counts_confusion():
+    reference = [{"label": "ポジティブ", "score": 0.9}, {"label": "ネガティブ", "score": 0.8},
+                 {"label": "ERROR", "score": 0.0}, {"label": "ポジティブ", "score": 0.6}]
+    candidate = [{"label": "ポジティブ", "score": 0.85}, {"label": "ポジティブ", "score": 0.5},
+                 {"label": "ポジティブ", "score": 0.7}, {"label": "ポジティブ", "score": 0.6}]
+    assert compare(reference, candidate) == {
+        "compared": 3,
+        "label_agreement": 0.6667,
+        "score_drift_mean": 0.116667,
+        "score_drift_max": 0.3,
+        "confusion": {"ポジティブ -> ポジティブ": 2, "ネガティブ -> ポジティブ": 1},
+    }
+    assert compare([{"label": "ERROR"}], [{"label": "ERROR"}]) == {"compared": 0}
+
+
+@pytest.mark.parametrize("backend", ["int8", "int8-torchscript"])
+def test_quantized_backend_agrees_with_fp32(tiny_model_dir, tmp_path, backend):
+    reference = SentimentAnalyzer(tiny_model_dir, backend="fp32").analyze_batch(TEXTS)
+    built = SentimentAnalyzer(tiny_model_dir, backend=backend, model_cache_dir=str(tmp_path))
+    assert built.is_loaded, built.load_error
+    assert os.path.exists(built._cache_path())
+
+    report = compare(reference, built.analyze_batch(TEXTS))
+    assert report["compared"] == len(TEXTS)
+    # 重みがランダムな小さなモデルでは確率の差が小さく、量子化でラベルが入れ替わることがある
+    assert report["label_agreement"] >= 0.75
+
+    # 2回目はディスクキャッシュから読み込み、作成直後のモデルと同じ結果を返す
+    cached = SentimentAnalyzer(tiny_model_dir, backend=backend, model_cache_dir=str(tmp_path))
+    assert cached.is_loaded, cached.load_error
+    reloaded = compare(built.analyze_batch(TEXTS), cached.analyze_batch(TEXTS))
+    assert reloaded["label_agreement"] == 1.0 and reloaded["score_drift_max"] < 1e-3
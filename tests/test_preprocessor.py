@@ -0,0 +1,67 @@
+# tests/test_preprocessor.py
+import numpy as np
+import pytest
+
+from app.preprocessor import PARALLEL_TOKENIZE_MIN_TEXTS, NearDuplicateGrouper, Preprocessor, _tokenize_texts
+
+TOKENIZE_TEXTS = [
+    "AIエージェントが雇用に与える影響を考えてみた",
+    "新しいモデルは速くて便利だけど、料金が高い",
+    "",
+    "今日は雨が降っていたので家で映画を見ました",
+    "これは本当に素晴らしい製品です",
+]
+
+
+def test_clean_text_normalizes_and_strips_noise():
+    clean = Preprocessor().clean_text
+    # NFKC (全角英数字・半角カナ) と空白の正規化
+    assert clean("ＡＩエージェント　すごい ｶﾀｶﾅ") == "AIエージェント すごい カタカナ"
+    # URL・メンション・ハッシュタグ (全角の ＃ ＠ も含む)・HTMLタグ
+    assert clean("見て https://example.com/x?a=1 @user_1 #AI ＃タグ ＠さん <b>太字</b>") == "見て 太字"
+    # 絵文字 (ZWJ で結合したもの、国旗、異体字セレクタ、キーキャップ)
+    assert clean("家族👨‍👩‍👧で旅行🇯🇵 ❤️ 1️⃣位😊") == "家族で旅行 1位"
+    assert clean("😊 #AI https://example.com") == ""
+
+
+def test_groups_exact_and_near_duplicates_under_first_seen():
+    grouper = NearDuplicateGrouper(threshold=0.5)
+    base = "AIエージェントが雇用に与える影響について考えてみた結果"
+    texts = ["全然違う内容のツイート", base + "です", base, base + "です", base + "ですね！！", ""]
+    assert grouper.group(texts) == [0, 1, 1, 1, 1, 5]
+
+
+def test_merges_candidates_that_are_similar_to_each_other_but_not_to_the_first():
+    grouper = NearDuplicateGrouper(num_perm=4, bands=2, threshold=0.75)
+    # 3件とも1つ目のバンドが一致するので同じバケットに入る。B と C だけが似ている
+    signatures = {
+        "A": np.array([1, 1, 7, 8], dtype=np.uint64),
+        "B": np.array([1, 1, 2, 2], dtype=np.uint64),
+        "C": np.array([1, 1, 2, 5], dtype=np.uint64),
+    }
+    grouper._signature = signatures.__getitem__
+    assert grouper.group(["A", "B", "C", "C"]) == [0, 1, 1, 1]
+
+
+@pytest.mark.parametrize("keep_pos", [("名詞", "動詞", "形容詞"), None])
+def test_tokenize_pool_matches_in_process(keep_pos):
+    pytest.importorskip("janome")
+    texts = TOKENIZE_TEXTS * (PARALLEL_TOKENIZE_MIN_TEXTS // len(TOKENIZE_TEXTS) + 1)
+    preprocessor = Preprocessor(tokenize_processes=2)
+    try:
+        pooled = preprocessor.tokenize_batch(texts, keep_pos=keep_pos, chunk_size=7)
+        assert preprocessor._tokenize_pool is not None
+    finally:
+        if preprocessor._tokenize_pool is not None:
+            preprocessor._tokenize_pool.shutdown()
+
+    assert pooled == _tokenize_texts(texts, keep_pos=keep_pos)
+    # 件数が少ない場合はプールを使わずに同じ結果を返す
+    small = Preprocessor(tokenize_processes=2)
+    assert small.tokenize_batch(TOKENIZE_TEXTS, keep_pos=keep_pos) == pooled[:len(TOKENIZE_TEXTS)]
+    assert small._tokenize_pool is None
+    if keep_pos:
+        # 品詞で絞り込み (非自立の「いる」などは除く)、動詞・形容詞は基本形にそろえる
+        assert pooled[1] == ["新しい", "モデル", "速い", "便利", "料金", "高い"]
+        assert pooled[2] == []
+        assert pooled[3] == ["今日", "雨", "降る", "家", "映画", "見る"]
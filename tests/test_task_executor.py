@@ -0,0 +1,73 @@
+# tests/test_task_executor.py
+import threading
+import time
+
+import pytest
+
+from app.task_executor import TaskExecutor, TaskQueueFullError
+
+
+@pytest.fixture
+def executor():
+    executor = TaskExecutor(max_workers=1, max_pending=2)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def wait_until(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_rejects_tasks_when_queue_is_full(executor):
+    release = threading.Event()
+    executor.submit("running", release.wait)
+    wait_until(lambda: executor.stats()["running"] == 1)
+
+    executor.submit("p1", release.wait)
+    executor.submit("p2", release.wait)
+    assert executor.queue_position("p1") == 1
+    assert executor.queue_position("p2") == 2
+    # 実行中1件 + 待ち2件で満杯 (/analyze はこの例外で 503 + Retry-After を返す)
+    with pytest.raises(TaskQueueFullError):
+        executor.submit("p3", release.wait)
+    assert executor.stats()["pending"] == 2
+
+    release.set()
+    wait_until(lambda: executor.stats() == {"pending": 0, "running": 0, "max_workers": 1, "max_pending": 2})
+    # 空きができれば再び受け付ける
+    executor.submit("p4", lambda: None)
+
+
+def test_worker_survives_failing_task(executor):
+    done = threading.Event()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    executor.submit("bad", fail)
+    executor.submit("good", done.set)
+    assert done.wait(2)
+
+
+def test_stage_limits_concurrency():
+    executor = TaskExecutor(max_workers=3, max_pending=10, stage_limits={"inference": 1})
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def task():
+        with executor.stage("inference"):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+    for i in range(3):
+        executor.submit(f"t{i}", task)
+    executor.shutdown(wait=True)
+    assert len(peak) == 3 and max(peak) == 1
@@ -0,0 +1,81 @@
+# tests/test_task_store.py
+import base64
+import time
+
+import pytest
+
+from app.task_store import MemoryTaskStore, SQLiteTaskStore
+
+PNG = b"\x89PNG\r\n\x1a\nchart"
+DATA_URI = "data:image/png;base64," + base64.b64encode(PNG).decode("utf-8")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return SQLiteTaskStore(str(tmp_path / "tasks.db"), evict_every=1, **kwargs)
+        return MemoryTaskStore(**kwargs)
+    return make
+
+
+def test_result_and_charts_round_trip(make_store):
+    store = make_store()
+    store.create("t1")
+    assert store.get_status("t1") == "pending"
+    store.set_result("t1", "completed", {"total_analyzed": 3, "pie_chart_base64": DATA_URI})
+
+    task = store.get("t1")
+    assert task["status"] == "completed"
+    assert task["result"] == {"total_analyzed": 3}
+    assert task["has_chart"] and task["charts"] == ["pie"]
+    assert store.get_chart("t1") == ("image/png", PNG)
+    assert store.get("t1", include_chart=True)["result"]["pie_chart_base64"] == DATA_URI
+
+
+def test_expired_task_is_not_served_before_eviction(make_store):
+    store = make_store(ttl_seconds=0.2, max_tasks=None)
+    store.create("t1")
+    store.set_result("t1", "completed", {"pie_chart_base64": DATA_URI})
+    assert store.get("t1") is not None
+    time.sleep(0.3)
+    # 削除の処理が走っていなくても TTL 切れのタスクは返さない
+    assert store.get_status("t1") is None
+    assert store.get("t1") is None
+    assert store.get_chart("t1") is None
+
+
+def test_ttl_eviction_on_create(make_store):
+    store = make_store(ttl_seconds=0.2, max_tasks=None)
+    store.create("old")
+    time.sleep(0.3)
+    store.create("new")
+    # TTL を無効にしても、作成時の削除で消えたタスクは戻らない
+    store.ttl_seconds = None
+    assert store.get_status("old") is None
+    assert store.get_status("new") == "pending"
+
+
+def test_max_tasks_evicts_oldest(make_store):
+    store = make_store(ttl_seconds=None, max_tasks=2)
+    for task_id in ("t1", "t2", "t3"):
+        store.create(task_id)
+        time.sleep(0.01)
+    assert store.get_status("t1") is None
+    assert store.get_status("t2") == "pending"
+    assert store.get_status("t3") == "pending"
+
+
+def test_nested_report_charts_are_stored_per_report(make_store):
+    store = make_store()
+    store.create("t1")
+    store.set_result("t1", "completed", {
+        "comparison_chart_base64": DATA_URI,
+        "reports": [{"keyword": "A", "pie_chart_base64": DATA_URI}, {"keyword": "B"}],
+    })
+    task = store.get("t1")
+    assert task["charts"] == ["comparison", "pie-0"]
+    assert task["result"]["reports"] == [{"keyword": "A"}, {"keyword": "B"}]
+    restored = store.get("t1", include_chart=True)["result"]
+    assert restored["reports"][0]["pie_chart_base64"] == DATA_URI
+    assert restored["comparison_chart_base64"] == DATA_URI
@@ -0,0 +1,38 @@
+# tests/test_term_stats.py
+import math
+
+from app.term_stats import TermStatistics
+
+POSITIVE = [["良い", "製品", "AI"], ["良い", "AI"], ["良い", "便利", "製品"], ["便利", "AI"], ["良い", "AI", "速い", "便利"]]
+NEGATIVE = [["悪い", "AI"], ["悪い", "製品", "高い"], ["高い", "悪い", "速い"]]
+
+
+def log_odds(in_label, in_other, n_label, n_other, alpha=0.5):
+    return (math.log((in_label + alpha) / (n_label - in_label + alpha))
+            - math.log((in_other + alpha) / (n_other - in_other + alpha)))
+
+
+def test_top_terms_by_document_frequency():
+    # 同じツイート内で繰り返された語は1回と数え、min_df 未満の語は除く
+    token_lists = POSITIVE + NEGATIVE + [["一度だけ", "悪い", "悪い"]]
+    result = TermStatistics(min_df=2).compute(token_lists, ["x"] * len(token_lists), top_n=4)
+    # 同数の語は語彙の順
+    assert result["top_terms"] == [("AI", 5), ("悪い", 4), ("良い", 4), ("便利", 3)]
+    # ラベルが1種類だけの場合は比較できない
+    assert result["distinctive_terms"] == {}
+
+
+def test_distinctive_terms_are_ranked_by_log_odds():
+    labels = ["ポジティブ"] * len(POSITIVE) + ["ネガティブ"] * len(NEGATIVE)
+    result = TermStatistics().compute(POSITIVE + NEGATIVE, labels, distinctive_n=3)
+
+    # ポジティブ 5件 / ネガティブ 3件での対数オッズ比
+    assert log_odds(4, 0, 5, 3) > log_odds(3, 0, 5, 3) > log_odds(4, 1, 5, 3) > log_odds(2, 1, 5, 3) > 0
+    assert result["distinctive_terms"]["ポジティブ"] == [("良い", 4), ("便利", 3), ("AI", 4)]
+    # 対象ラベルで1回しか出てこない語 (製品・AI) と、対数オッズ比が正でない語は含めない
+    assert result["distinctive_terms"]["ネガティブ"] == [("悪い", 3), ("高い", 2)]
+
+
+def test_empty_inputs():
+    assert TermStatistics().compute([], []) == {"top_terms": [], "distinctive_terms": {}}
+    assert TermStatistics(min_df=2).compute([["a"], ["b"]], ["x", "y"]) == {"top_terms": [], "distinctive_terms": {}}
@@ -0,0 +1,69 @@
+# tests/test_trends.py
+import pytest
+
+from app.trends import SentimentTrend
+
+
+def tweets_at(times, label="ポジティブ", score=0.8):
+    return [{"created_at": created_at, "sentiment": {"label": label, "score": score}} for created_at in times]
+
+
+def test_buckets_are_floored_in_tokyo_time():
+    # 15:00 UTC が日本時間の0時なので、14:59 と 15:00 は別の日になる
+    trend = SentimentTrend("1D").update(tweets_at(["2026-01-01T14:59:00Z", "2026-01-01T15:00:00Z", "2026-01-02T03:00:00Z"]))
+    result = trend.result()
+    assert [(bucket["start"], bucket["total"]) for bucket in result["buckets"]] == [
+        ("2026-01-01T00:00:00+09:00", 1), ("2026-01-02T00:00:00+09:00", 2),
+    ]
+
+    hourly = SentimentTrend("1h").update(
+        tweets_at(["2026-01-01T00:59:59Z", "2026-01-01T03:10:00Z"])
+        + tweets_at(["2026-01-01T00:00:00Z"], label="ネガティブ", score=0.6)
+        + [{"created_at": None, "sentiment": {"label": "ポジティブ", "score": 0.9}},
+           {"created_at": "2026-01-01T00:30:00Z", "sentiment": {"label": "ERROR", "score": 0.0}}]
+    )
+    buckets = hourly.result()["buckets"]
+    # 件数のない時間帯も 0 件で埋める
+    assert [bucket["start"] for bucket in buckets] == [f"2026-01-01T{hour:02d}:00:00+09:00" for hour in range(9, 13)]
+    assert [bucket["total"] for bucket in buckets] == [2, 0, 0, 1]
+    assert buckets[0]["counts"] == {"ネガティブ": 1, "ポジティブ": 1}
+    assert buckets[0]["mean_scores"] == {"ネガティブ": 0.6, "ポジティブ": 0.8}
+    assert buckets[0]["net"] == 0.0 and buckets[3]["net"] == 1.0
+
+
+def test_merge_matches_a_single_update():
+    first = tweets_at(["2026-01-01T00:10:00Z", "2026-01-01T02:00:00Z"])
+    second = tweets_at(["2026-01-01T00:20:00Z"], label="ネガティブ") + tweets_at(["2026-01-01T05:00:00Z"])
+    merged = SentimentTrend().update(first).merge(SentimentTrend().update(second))
+    assert merged.result() == SentimentTrend().update(first + second).result()
+    assert SentimentTrend().merge(SentimentTrend()).empty
+
+    with pytest.raises(ValueError):
+        SentimentTrend("1h").merge(SentimentTrend("1D"))
+
+
+def test_detects_spike_against_previous_buckets():
+    times = [f"2026-01-01T{hour:02d}:{minute:02d}:00Z" for hour in range(12) for minute in (0, 30)]
+    times += [f"2026-01-01T12:{minute:02d}:00Z" for minute in range(20)]
+    result = SentimentTrend("1h").update(tweets_at(times)).result()
+    assert result["spikes"] == ["2026-01-01T21:00:00+09:00"]
+    assert [bucket["spike"] for bucket in result["buckets"]].count(True) == 1
+
+
+def test_max_buckets_bounds_the_filled_range():
+    # 6年分を1時間ごとに埋めると5万行以上になる
+    trend = SentimentTrend("1h", spike_window=12).update(
+        tweets_at(["2020-01-01T00:00:00Z", "2026-01-01T00:00:00Z", "2026-01-01T03:00:00Z"])
+    )
+    assert len(trend.table(max_buckets=24)) == 24 + 12
+    buckets = trend.result(max_buckets=24)["buckets"]
+    assert len(buckets) == 24
+    assert buckets[-1]["start"] == "2026-01-01T12:00:00+09:00"
+
+
+def test_max_buckets_keeps_spike_detection_unchanged():
+    times = [f"2026-01-0{day}T{hour:02d}:00:00Z" for day in (1, 2) for hour in range(24) if hour % 5]
+    times += ["2026-01-02T23:30:00Z"] * 10
+    trend = SentimentTrend("1h").update(tweets_at(times))
+    assert trend.result(max_buckets=6)["buckets"] == trend.result()["buckets"][-6:]
+    assert trend.result(max_buckets=6)["spikes"] == ["2026-01-03T08:00:00+09:00"]
@@ -0,0 +1,96 @@
+# tests/test_tweet_batch.py
+import logging
+
+import numpy as np
+import pytest
+
+from app.tweet_batch import NO_LABEL, TweetBatch, round_score
+
+
+def make_tweets(count):
+    return [
+        {"id": str(i), "text": f"text {i}", "created_at": f"2026-01-01T00:0{i % 10}:00Z",
+         "author_id": "u", "source_url": f"https://twitter.com/u/status/{i}"}
+        for i in range(count)
+    ]
+
+
+def test_slice_is_a_view_of_the_parent():
+    batch = TweetBatch.from_dicts(make_tweets(6))
+    part = batch[2:4]
+    assert np.shares_memory(part.label_codes, batch.label_codes)
+    part.set_sentiments([{"label": "ポジティブ", "score": 0.9}, {"label": "ネガティブ", "score": 0.8, "note": "x"}])
+    assert list(batch.labels) == [None, None, "ポジティブ", "ネガティブ", None, None]
+    assert batch.sentiment(3) == {"label": "ネガティブ", "score": 0.8, "note": "x"}
+
+
+def test_index_array_returns_a_copy():
+    batch = TweetBatch.from_dicts(make_tweets(4))
+    rows = batch[np.array([0, 2])]
+    rows.set_sentiment(np.array([True, True]), "ERROR", error_message="boom")
+    assert list(rows.ids) == ["0", "2"]
+    assert (batch.label_codes == NO_LABEL).all()
+
+
+def test_iter_slices_and_concat():
+    batch = TweetBatch.from_dicts(make_tweets(7))
+    batch.set_tokens([[f"t{i}"] for i in range(7)])
+    slices = list(batch.iter_slices(3))
+    assert [len(part) for part in slices] == [3, 3, 1]
+    merged = TweetBatch.concat(slices)
+    assert merged.to_dicts() == batch.to_dicts()
+    # tokens を持たないバッチと混ぜた場合は None で埋める
+    mixed = TweetBatch.concat([batch[:2], TweetBatch.from_dicts(make_tweets(1))])
+    assert list(mixed.tokens) == [["t0"], ["t1"], None]
+    assert len(TweetBatch.concat([])) == 0
+
+
+def test_dict_round_trip():
+    tweets = make_tweets(3)
+    tweets[0].update(cleaned_text="clean 0", tokens=["clean"], sentiment={"label": "ポジティブ", "score": 0.1235})
+    tweets[1]["sentiment"] = {"label": "ERROR", "score": 0.0, "error_message": "boom"}
+    assert TweetBatch.from_dicts(tweets).to_dicts() == tweets
+    assert TweetBatch.from_dicts(tweets)[1:].to_dicts() == tweets[1:]
+
+
+def test_from_api():
+    batch = TweetBatch.from_api([{"id": "1", "text": "a", "author_id": "u"}])
+    assert batch.to_dicts() == [{"id": "1", "text": "a", "created_at": None, "author_id": "u",
+                                 "source_url": "https://twitter.com/u/status/1"}]
+
+
+def test_label_counts_and_valid_mask():
+    batch = TweetBatch.from_dicts(make_tweets(4))
+    batch.set_sentiments([{"label": "ポジティブ", "score": 1}, {"label": "ポジティブ", "score": 1},
+                          {"label": "ERROR", "score": 0}])
+    assert batch.label_counts() == {"ポジティブ": 2, "ERROR": 1}
+    assert list(batch.valid_mask()) == [True, True, False, False]
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("NEUTRAL", "ニュートラル"),
+    ("positive", "ポジティブ"),
+    ("NEGATIVE", "ネガティブ"),
+    ("UNKNOWN", "UNKNOWN"),
+])
+def test_english_labels_are_mapped(label, expected, caplog):
+    batch = TweetBatch.from_dicts(make_tweets(1))
+    with caplog.at_level(logging.WARNING, logger="app.tweet_batch"):
+        batch.set_sentiments([{"label": label, "score": 0.5}])
+    assert batch.sentiment(0) == {"label": expected, "score": 0.5}
+    assert not caplog.records
+
+
+def test_unmapped_labels_are_logged_once(caplog):
+    batch = TweetBatch.from_dicts(make_tweets(3))
+    with caplog.at_level(logging.WARNING, logger="app.tweet_batch"):
+        batch.set_sentiments([{"label": "LABEL_0", "score": 0.5}] * 3)
+    assert list(batch.labels) == ["UNKNOWN"] * 3
+    assert batch.sentiment(0) == {"label": "UNKNOWN", "score": 0.5, "raw_label": "LABEL_0"}
+    assert len(caplog.records) == 1 and "LABEL_0" in caplog.records[0].getMessage()
+
+
+def test_round_score_matches_dict_scores():
+    scores = np.array([0.12345678, 0.99996, 0.5], dtype=np.float32)
+    assert list(round_score(scores)) == [0.1235, 1.0, 0.5]
+    assert round_score(scores).dtype == np.float64